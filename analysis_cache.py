@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+詐騙分析結果快取模組
+同一則詐騙訊息常被大量轉傳，每一份都呼叫 OpenAI 分析既慢又浪費。
+以「正規化後的訊息 + 展開後的網址 + 提示詞版本 + 模型」為鍵保存 parse_fraud_analysis 的解析結果，
+命中時直接使用，不再呼叫 OpenAI；使用者名稱等個人化欄位在取出後才填入。
+
+可選擇以 Firestore 作為多個執行個體共用的第二層快取。
+
+詐騙集團轉傳時常更換電話、LINE ID 與金額，完全相同的鍵無法命中，
+因此另以 SimHash 指紋（遮蔽上述可變資訊後計算）建立近似重複索引，
+與先前判定為高風險的訊息夠相似時即可沿用分析結果，或改用較便宜的確認提示詞。
+"""
+
+import re
+import copy
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL, NEAR_DUPLICATE_INDEX_SIZE, NEAR_DUPLICATE_MAX_DISTANCE,
+    NEAR_DUPLICATE_MIN_LENGTH, NEAR_DUPLICATE_RISK_LEVELS
+)
+
+logger = logging.getLogger(__name__)
+
+# 不同使用者轉傳時會改變、但不影響分析結果的欄位，不放進快取
+_PERSONAL_FIELDS = ('display_name',)
+
+# 轉傳時常被夾帶的零寬字元
+_ZERO_WIDTH_CHARS = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff'), None)
+
+
+def normalize_message(message):
+    """
+    正規化訊息內容：全形半形統一（NFKC）、移除零寬字元、合併連續空白
+
+    不轉小寫：短網址代碼與部分網址路徑區分大小寫。
+    """
+    text = unicodedata.normalize('NFKC', message or '').translate(_ZERO_WIDTH_CHARS)
+    return ' '.join(text.split())
+
+
+# 近似重複比對前遮蔽的可變資訊（依序套用）
+_ENTITY_PATTERNS = [
+    (re.compile(r'https?://\S+|www\.\S+|[a-z0-9][a-z0-9-]*(?:\.[a-z0-9-]+)*\.(?:com|net|org|tw|cc|co|me|io|xyz|top|ly|gl)(?:/\S*)?', re.I), '<網址>'),
+    (re.compile(r'(?:line\s*id|line|賴|加賴|ID)\s*[:：]?\s*@?[a-z0-9._-]{3,}', re.I), '<帳號>'),
+    (re.compile(r'@[a-z0-9._-]{3,}', re.I), '<帳號>'),
+    (re.compile(r'(?:\+?886[\s-]?|0)\d{1,3}[\s-]?\d{3,4}[\s-]?\d{3,4}'), '<電話>'),
+    (re.compile(r'\d[\d,.]*\s*(?:萬|千|百|元|塊|%|％)?'), '<數字>'),
+]
+# 64 位元 SimHash 的字元 n-gram 長度
+_SHINGLE_SIZE = 3
+_FINGERPRINT_BITS = 64
+
+
+def mask_entities(message):
+    """將網址、LINE 帳號、電話號碼與金額等轉傳時常被替換的內容換成固定標記"""
+    text = normalize_message(message)
+    for pattern, placeholder in _ENTITY_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text.lower()
+
+
+def simhash(text):
+    """
+    計算文字的 64 位元 SimHash 指紋（以字元 n-gram 為特徵，中文不需斷詞）
+
+    Returns:
+        int: 指紋
+    """
+    text = text.replace(' ', '')
+    counts = {}
+    for i in range(max(1, len(text) - _SHINGLE_SIZE + 1)):
+        shingle = text[i:i + _SHINGLE_SIZE]
+        counts[shingle] = counts.get(shingle, 0) + 1
+
+    weights = [0] * _FINGERPRINT_BITS
+    for shingle, count in counts.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(_FINGERPRINT_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def make_analysis_cache_key(message, expanded_urls, prompt_version, model):
+    """
+    產生分析結果快取鍵
+
+    Args:
+        message: 使用者原始訊息
+        expanded_urls: 訊息中網址展開後的最終網址（順序不影響結果）
+        prompt_version: 提示詞版本
+        model: 分析使用的模型
+
+    Returns:
+        str: SHA-256 十六進位字串
+    """
+    parts = [
+        prompt_version,
+        model,
+        normalize_message(message),
+        '\n'.join(sorted(set(expanded_urls or []))),
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class AnalysisResultCache:
+    """
+    詐騙分析結果快取
+
+    本機以 LRU 保存，項目數與存活時間都有上限；設定 shared_backend 後，
+    本機未命中時會查詢共用快取，新結果也會在背景寫入共用快取。
+    shared_backend 需提供 get_analysis_cache_entry(key) 與 set_analysis_cache_entry(key, entry)，
+    例如 FirebaseManager。
+    """
+
+    def __init__(self, max_size=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL, shared_backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.shared_backend = None
+        self._writer = None
+        self.set_shared_backend(shared_backend)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.backend_errors = 0
+
+    def set_shared_backend(self, shared_backend):
+        """設定（或以 None 取消）共用快取"""
+        self.shared_backend = shared_backend
+        if shared_backend is not None and self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis-cache')
+
+    def get(self, key, display_name=None, record_stats=True):
+        """
+        取得未過期的分析結果
+
+        Args:
+            key: make_analysis_cache_key 產生的快取鍵
+            display_name: 命中時填入結果的使用者名稱
+            record_stats: 是否計入命中率（近似重複索引取用時不計入）
+
+        Returns:
+            tuple 或 None: (解析結果 dict, 原始回應文字)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += record_stats
+
+        if entry is None and self.shared_backend is not None:
+            entry = self._get_shared(key, now)
+            with self._lock:
+                if entry is not None:
+                    self.shared_hits += record_stats
+                    self._store(key, entry)
+
+        if entry is None:
+            with self._lock:
+                self.misses += record_stats
+            return None
+
+        result = copy.deepcopy(entry['result'])
+        if display_name is not None:
+            result['display_name'] = display_name
+        return result, entry['raw_result']
+
+    def put(self, key, result, raw_result):
+        """保存分析結果（不含使用者名稱等個人化欄位）"""
+        shared = {
+            'result': {k: v for k, v in result.items() if k not in _PERSONAL_FIELDS},
+            'raw_result': raw_result,
+            'expires_at': time.time() + self.ttl,
+        }
+        entry = copy.deepcopy(shared)
+        with self._lock:
+            self._store(key, entry)
+
+        if self.shared_backend is not None:
+            self._writer.submit(self._put_shared, key, shared)
+
+    def _store(self, key, entry):
+        """寫入本機 LRU（呼叫者需持有鎖）"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_shared(self, key, now):
+        """從共用快取取得未過期的項目，發生錯誤時視為未命中"""
+        try:
+            entry = self.shared_backend.get_analysis_cache_entry(key)
+        except Exception as e:
+            logger.warning(f"讀取共用分析快取失敗: {e}")
+            with self._lock:
+                self.backend_errors += 1
+            return None
+        if not entry or entry.get('expires_at', 0) <= now or 'result' not in entry:
+            return None
+        return {'result': entry['result'], 'raw_result': entry.get('raw_result', ''), 'expires_at': entry['expires_at']}
+
+    def _put_shared(self, key, entry):
+        """在背景寫入共用快取"""
+        try:
+            self.shared_backend.set_analysis_cache_entry(key, entry)
+        except Exception as e:
+            logger.warning(f"寫入共用分析快取失敗: {e}")
+            with self._lock:
+                self.backend_errors += 1
+
+    def clear(self):
+        """清空本機快取"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """取得快取統計"""
+        with self._lock:
+            total = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / total, 4) if total else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'shared_backend': self.shared_backend is not None,
+                'backend_errors': self.backend_errors,
+            }
+
+
+# 全域分析結果快取實例（共用快取由主程式在 Firebase 可用時設定）
+analysis_cache = AnalysisResultCache()
+
+
+def get_analysis_cache_stats():
+    """取得全域分析結果快取統計"""
+    return analysis_cache.get_stats()
+
+
+class NearDuplicateIndex:
+    """
+    近似重複訊息索引
+
+    以 LSH 分段（banding）找出候選：64 位元指紋切成 max_distance + 1 段，
+    漢明距離不超過 max_distance 的兩個指紋至少有一段完全相同（鴿籠原理），
+    因此只需比對同段相同的候選，不必掃描整個索引。
+
+    只收錄高風險的判定結果：沿用低風險結果可能讓只換了網址的詐騙訊息被放行。
+    """
+
+    def __init__(self, max_size=NEAR_DUPLICATE_INDEX_SIZE, max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+                 min_length=NEAR_DUPLICATE_MIN_LENGTH, ttl=ANALYSIS_CACHE_TTL,
+                 risk_levels=NEAR_DUPLICATE_RISK_LEVELS):
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.min_length = min_length
+        self.ttl = ttl
+        self.risk_levels = frozenset(risk_levels)
+        self.bands = max_distance + 1
+        self._band_bits = -(-_FINGERPRINT_BITS // self.bands)
+        self._entries = OrderedDict()  # 快取鍵 -> (指紋, 到期時間)
+        self._buckets = {}  # (段索引, 段值) -> 快取鍵集合
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.skipped = 0
+        self.candidates = 0
+        self.hits = 0
+        self.evictions = 0
+        self.distance_counts = [0] * (max_distance + 1)
+        self.outcomes = {}
+
+    def fingerprint(self, message):
+        """
+        計算訊息的近似重複指紋
+
+        Returns:
+            int 或 None: 遮蔽可變資訊後太短（特徵不足）時返回 None
+        """
+        masked = mask_entities(message)
+        if len(masked.replace(' ', '')) < self.min_length:
+            return None
+        return simhash(masked)
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self._band_bits) - 1
+        return [(band, fingerprint >> (band * self._band_bits) & mask) for band in range(self.bands)]
+
+    def add(self, fingerprint, cache_key, risk_level):
+        """收錄已分析訊息的指紋（僅限高風險判定）"""
+        if fingerprint is None or risk_level not in self.risk_levels:
+            return False
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (fingerprint, time.time() + self.ttl)
+            for band_key in self._band_keys(fingerprint):
+                self._buckets.setdefault(band_key, set()).add(cache_key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, cache_key):
+        """移除項目與其分段索引（呼叫者需持有鎖）"""
+        fingerprint, _ = self._entries.pop(cache_key)
+        for band_key in self._band_keys(fingerprint):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(cache_key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def find(self, fingerprint):
+        """
+        找出最相似的已收錄訊息
+
+        Returns:
+            tuple 或 None: (快取鍵, 漢明距離)
+        """
+        with self._lock:
+            self.lookups += 1
+            if fingerprint is None:
+                self.skipped += 1
+                return None
+
+            now = time.time()
+            candidate_keys = set()
+            for band_key in self._band_keys(fingerprint):
+                candidate_keys.update(self._buckets.get(band_key, ()))
+            self.candidates += len(candidate_keys)
+
+            best = None
+            for cache_key in candidate_keys:
+                stored, expires_at = self._entries[cache_key]
+                if expires_at <= now:
+                    self._remove(cache_key)
+                    continue
+                distance = bin(stored ^ fingerprint).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (cache_key, distance)
+
+            if best is not None:
+                self.hits += 1
+                self.distance_counts[best[1]] += 1
+            return best
+
+    def record_outcome(self, outcome):
+        """記錄命中後的處理方式（reused、confirmed、rejected、expired）"""
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def get_stats(self):
+        """取得索引統計"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'max_distance': self.max_distance,
+                'bands': self.bands,
+                'lookups': self.lookups,
+                'skipped_short_messages': self.skipped,
+                'candidates_per_lookup': round(self.candidates / self.lookups, 2) if self.lookups else 0.0,
+                'hits': self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'distance_counts': list(self.distance_counts),
+                'outcomes': dict(self.outcomes),
+                'evictions': self.evictions,
+            }
+
+
+# 全域近似重複索引實例
+near_duplicate_index = NearDuplicateIndex()
+
+
+def get_near_duplicate_stats():
+    """取得全域近似重複索引統計"""
+    return near_duplicate_index.get_stats()
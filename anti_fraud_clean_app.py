@@ -4,11 +4,8 @@ import json
 import logging
 import random
 import re
-import requests
-from urllib.parse import urlparse
 from datetime import datetime, timedelta
 import openai
-from openai import OpenAI
 from flask import Flask, request, abort, render_template, jsonify
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
@@ -23,7 +20,26 @@ from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 from linebot.v3.webhooks import MessageEvent as V3MessageEvent
 from linebot.v3.messaging import TextMessage as V3TextMessage
 from firebase_manager import FirebaseManager
-from domain_spoofing_detector import detect_domain_spoofing
+from domain_spoofing_detector import get_spoof_cache_stats, get_permutation_table_stats
+from domain_blocklist import get_blocklist_stats
+from short_url_service import short_url_expander, get_short_url_cache_stats, get_short_url_expander_stats
+from url_checker import check_message_urls
+from structured_analysis import (
+    TEXT_ANALYSIS_FIELDS, TEXT_ANALYSIS_SCHEMA, build_response_format, build_text_analysis_messages,
+    text_analysis_system_prompt, parse_structured_analysis, get_token_usage_stats
+)
+from token_budget import token_budget, get_token_budget_stats
+from analysis_cache import (
+    analysis_cache, near_duplicate_index, make_analysis_cache_key, get_analysis_cache_stats,
+    get_near_duplicate_stats
+)
+from local_risk_scorer import local_risk_scorer, get_local_risk_stats
+from fraud_text_classifier import get_text_classifier_stats
+from circuit_breaker import CircuitOpenError, LatencyBudgetExceeded
+from llm_gateway import llm_gateway, get_llm_gateway_stats, get_circuit_breaker_stats
+from qr_decoder import get_qr_decoder_stats
+from image_preprocessor import get_image_preprocessor_stats
+from screenshot_cache import get_screenshot_cache_stats
 from dotenv import load_dotenv
 import time
 
@@ -162,25 +178,14 @@ else:
     v3_messaging_api = None
     logger.info("LINE Bot API 初始化失敗：缺少必要的環境變數")
 
-# OpenAI設定 - 使用新版本的客戶端初始化，添加錯誤處理
-if OPENAI_API_KEY:
-    try:
-        openai_client = OpenAI(
-            api_key=OPENAI_API_KEY,
-            timeout=30.0,  # 設置超時
-            max_retries=3   # 設置重試次數
-        )
-        logger.info("OpenAI API 初始化成功")
-    except Exception as e:
-        logger.error(f"OpenAI API 初始化失敗: {e}")
-        openai_client = None
-else:
-    openai_client = None
-    logger.warning("OpenAI API 初始化失敗：缺少 API 金鑰")
-
 # 初始化Firebase管理器
 firebase_manager = FirebaseManager.get_instance()
 
+# 多個執行個體共用詐騙分析結果快取
+if ANALYSIS_CACHE_SHARED and firebase_manager.db:
+    analysis_cache.set_shared_backend(firebase_manager)
+    logger.info("詐騙分析結果快取已啟用 Firestore 共用快取")
+
 # 用戶遊戲狀態
 user_game_state = {}
 
@@ -218,32 +223,8 @@ def expand_short_url(url):
     Returns:
         tuple: (原始URL, 展開後的URL, 是否為短網址, 是否成功展開)
     """
-    # 檢查是否為短網址
-    parsed_url = urlparse(url)
-    is_short_url = False
-    for domain in SHORT_URL_DOMAINS:
-        if domain in parsed_url.netloc:
-            is_short_url = True
-            break
-    
-    if not is_short_url:
-        return url, url, False, False
-    
-    # 嘗試展開短網址
-    try:
-        session = requests.Session()
-        response = session.head(url, allow_redirects=True, timeout=5)
-        expanded_url = response.url
-        
-        if expanded_url != url:
-            logger.info(f"成功展開短網址: {url} -> {expanded_url}")
-            return url, expanded_url, True, True
-        else:
-            logger.warning(f"URL可能不是短網址或無法展開: {url}")
-            return url, url, True, False
-    except Exception as e:
-        logger.error(f"展開短網址時出錯: {e}")
-        return url, url, True, False
+    result = short_url_expander.expand(url)
+    return url, result['final_url'], result['is_short_url'], result['success']
 
 # 定義防詐小知識
 anti_fraud_tips = []  # 現在使用 get_anti_fraud_tips() 函數
@@ -328,309 +309,238 @@ def parse_fraud_analysis(analysis_result):
             "is_emerging": False
         }
 
-def _is_legitimate_subdomain(subdomain_part):
-    """檢查子網域部分是否合法"""
-    # 合法的子網域特徵
-    if not subdomain_part or len(subdomain_part) > 20:  # 太長的子網域可疑
+def _finalize_fraud_analysis(parsed_result, analysis_result, display_name, original_url, expanded_url,
+                             is_short_url, url_expanded_successfully, **extra):
+    """
+    在解析後（或快取取出）的分析結果加上使用者名稱與這則訊息的網址資訊
+
+    快取只保存與訊息內容有關的欄位，網址展開狀況與使用者名稱每次都在這裡重新加上。
+    """
+    parsed_result["display_name"] = display_name
+    parsed_result["original_url"] = original_url
+    parsed_result["expanded_url"] = expanded_url
+    parsed_result["is_short_url"] = is_short_url
+    parsed_result["url_expanded_successfully"] = url_expanded_successfully
+    
+    # 如果是短網址但無法展開，提高風險等級
+    if is_short_url and not url_expanded_successfully:
+        if parsed_result["risk_level"] == "低風險":
+            parsed_result["risk_level"] = "中風險"
+            parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n⚠️ 此外，這是一個短網址但無法展開查看真正的目的地，這點也要特別小心。"
+        
+        if "短網址" not in parsed_result["explanation"]:
+            parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n⚠️ 要注意這是一個短網址(像是縮短過的網址)，無法看到真正要去的網站，這種情況要特別小心。"
+        
+        if "短網址" not in parsed_result["suggestions"]:
+            parsed_result["suggestions"] = f"{parsed_result['suggestions']}\n• 遇到短網址時，最好先詢問傳送連結的人是什麼內容，或者乾脆不要點擊。"
+    
+    # 如果是短網址且成功展開，在結果中加入說明
+    if is_short_url and url_expanded_successfully:
+        parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n這個連結是短網址，已經幫您展開查看真正的目的地是: {expanded_url}"
+    
+    response = {
+        "success": True,
+        "message": "分析完成",
+        "result": parsed_result,
+        "raw_result": analysis_result
+    }
+    response.update(extra)
+    return response
+
+def _confirm_near_duplicate(analysis_message, cached_result):
+    """以只需回答是／否的確認提示詞，確認訊息與先前判定的詐騙訊息屬於同一種手法"""
+    if not llm_gateway.available:
         return False
     
-    # 常見的合法子網域前綴
-    legitimate_prefixes = [
-        'www', 'mail', 'email', 'webmail', 'smtp', 'pop', 'imap',
-        'ftp', 'sftp', 'api', 'app', 'mobile', 'm', 'wap',
-        'admin', 'secure', 'ssl', 'login', 'auth', 'account',
-        'shop', 'store', 'buy', 'order', 'cart', 'checkout',
-        'news', 'blog', 'forum', 'support', 'help', 'service',
-        'event', 'events', 'promo', 'promotion', 'campaign',
-        'member', 'members', 'user', 'users', 'profile',
-        'search', 'find', 'discover', 'explore',
-        'download', 'upload', 'file', 'files', 'doc', 'docs',
-        'img', 'image', 'images', 'pic', 'pics', 'photo', 'photos',
-        'video', 'videos', 'media', 'cdn', 'static', 'assets',
-        'dev', 'test', 'staging', 'beta', 'alpha', 'demo',
-        'tw', 'taiwan', 'hk', 'hongkong', 'cn', 'china',
-        'en', 'english', 'zh', 'chinese',
-        'playing', 'play', 'game', 'games', 'entertainment', 'fun',
-        'amp', 'article', 'articles', 'read', 'view', 'content'
-    ]
+    confirm_prompt = (
+        f"先前判定的詐騙類型：{cached_result.get('fraud_type', '詐騙')}"
+        f"（風險等級：{cached_result.get('risk_level', '')}）\n"
+        f"判定理由：{cached_result.get('explanation', '')}\n\n"
+        f"新訊息：\n---\n{analysis_message}\n---"
+    )
+    try:
+        confirm_response = llm_gateway.hedged_complete(
+            "near_duplicate_confirm",
+            [
+                {"role": "system", "content": NEAR_DUPLICATE_CONFIRM_PROMPT},
+                {"role": "user", "content": confirm_prompt}
+            ],
+            temperature=0
+        )
+        answer = confirm_response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.warning(f"近似重複確認失敗，改為完整分析: {e}")
+        return False
+    return answer.startswith("是")
+
+def _store_fraud_analysis(cache_key, fingerprint, user_message, parsed_result, analysis_result):
+    """將完整分析結果寫入快取與近似重複索引"""
+    analysis_cache.put(cache_key, parsed_result, analysis_result)
+    if NEAR_DUPLICATE_MODE in ('reuse', 'confirm'):
+        if fingerprint is None:
+            fingerprint = near_duplicate_index.fingerprint(user_message)
+        near_duplicate_index.add(fingerprint, cache_key, parsed_result["risk_level"])
+
+def _store_late_fraud_analysis(future, cache_key, fingerprint, user_message):
+    """超過延遲預算的分析完成後，將結果寫入快取"""
+    if future.cancelled() or future.exception() is not None or not future.result():
+        return
+    _store_fraud_analysis(cache_key, fingerprint, user_message, *future.result())
+    logger.info(f"晚到的完整分析已寫入快取: {cache_key[:12]}")
+
+def _request_fraud_analysis(analysis_message, special_notes):
+    """
+    呼叫 OpenAI 分析訊息
+
+    優先使用結構化輸出（JSON Schema），模型不支援或回傳內容無法解析時改用舊版文字格式。
+
+    Returns:
+        tuple 或 None: (解析結果, 原始回應文字)，API 返回空結果時為 None
+    """
+    # 訊息過長時壓縮或截斷，讓提示詞不超過預算
+    analysis_message = token_budget.fit(
+        "text_analysis", analysis_message,
+        fixed_prompt=text_analysis_system_prompt(FRAUD_ANALYSIS_STRUCTURED_OUTPUT) + special_notes
+    )
     
-    # 檢查是否為已知的合法前綴
-    if subdomain_part.lower() in legitimate_prefixes:
-        return True
+    if FRAUD_ANALYSIS_STRUCTURED_OUTPUT:
+        try:
+            chat_response = llm_gateway.complete(
+                "text_analysis",
+                build_text_analysis_messages(analysis_message, special_notes),
+                temperature=0.2,
+                response_format=build_response_format("fraud_analysis", TEXT_ANALYSIS_SCHEMA)
+            )
+            analysis_result = chat_response.choices[0].message.content if chat_response.choices else None
+            parsed_result = parse_structured_analysis(analysis_result, TEXT_ANALYSIS_FIELDS)
+            if parsed_result:
+                return parsed_result, analysis_result
+            logger.warning("結構化輸出無法解析，改用文字格式分析")
+        except openai.BadRequestError as e:
+            logger.warning(f"結構化輸出請求失敗，改用文字格式分析: {e}")
     
-    # 檢查是否包含可疑字元或模式
-    suspicious_patterns = [
-        '-tw-', '-official-', '-secure-', '-login-', '-bank-',
-        'phishing', 'fake', 'scam', 'fraud', 'malware'
-    ]
+    chat_response = llm_gateway.complete(
+        "text_analysis",
+        build_text_analysis_messages(analysis_message, special_notes, structured=False),
+        temperature=FRAUD_ANALYSIS_TEMPERATURE,
+        max_tokens=FRAUD_ANALYSIS_MAX_TOKENS
+    )
+    if not (chat_response and chat_response.choices):
+        return None
     
-    for pattern in suspicious_patterns:
-        if pattern in subdomain_part.lower():
-            return False
+    analysis_result = chat_response.choices[0].message.content.strip()
     
-    # 檢查是否只包含字母、數字和連字符
-    import re
-    if not re.match(r'^[a-zA-Z0-9-]+$', subdomain_part):
-        return False
+    # 將結果解析成結構化格式
+    parsed_result = parse_fraud_analysis(analysis_result)
     
-    # 不能以連字符開始或結束
-    if subdomain_part.startswith('-') or subdomain_part.endswith('-'):
-        return False
+    # 檢查解析結果，確保所有必要欄位都有值
+    if not parsed_result.get("explanation") or parsed_result["explanation"] == "無法解析分析結果。":
+        # 如果無法正確解析理由，直接使用原始回應
+        logger.warning("無法正確解析分析理由，使用原始回應替代")
+        parsed_result["explanation"] = analysis_result.replace("風險等級：", "").replace("詐騙類型：", "").replace("說明：", "").replace("建議：", "").replace("新興手法：", "").strip()
+        
+        # 確保理由不為空
+        if not parsed_result["explanation"] or parsed_result["explanation"].strip() == "":
+            parsed_result["explanation"] = "這個內容看起來有點奇怪，建議不要輕易點擊或提供個人資料。如果不確定，可以請家人幫忙確認一下。"
     
-    return True
+    return parsed_result, analysis_result
 
 def detect_fraud_with_chatgpt(user_message, display_name="朋友", user_id=None):
     """使用OpenAI的API檢測詐騙信息"""
-    import re
-    from urllib.parse import urlparse
-    
     try:
-        # 檢查訊息是否包含URL
-        original_url = None
-        expanded_url = None
-        is_short_url = False
-        url_expanded_successfully = False
-        
-        # 改進的URL提取正則表達式，確保只提取有效的URL部分
-        # 支援二級域名如 .com.tw, .co.uk 等
-        url_pattern = re.compile(r'(https?://[^\s\u4e00-\u9fff，。！？；：]+|www\.[^\s\u4e00-\u9fff，。！？；：]+|[a-zA-Z0-9][a-zA-Z0-9-]*\.[a-zA-Z]{2,}(?:\.[a-zA-Z]{2,})?(?:/[^\s\u4e00-\u9fff，。！？；：]*)?)')
-        url_match = url_pattern.search(user_message)
+        # 本地網址檢查（黑名單、短網址展開、網域變形、白名單），命中時不需要呼叫 OpenAI
+        url_check = check_message_urls(user_message, SAFE_DOMAINS, display_name)
+        if url_check['result']:
+            return url_check['result']
         
-        if url_match:
-            original_url = url_match.group(0)
-            # 移除末尾可能的標點符號
-            original_url = re.sub(r'[，。！？；：]+$', '', original_url)
-            
-            # 確保URL開頭是http://或https://
-            if not original_url.startswith(('http://', 'https://')):
-                original_url = 'https://' + original_url
-                
-            # 展開可能的短網址
-            original_url, expanded_url, is_short_url, url_expanded_successfully = expand_short_url(original_url)
-            
-            # 如果是短網址且成功展開，調整分析訊息
-            if is_short_url and url_expanded_successfully:
-                # 將原始訊息中的短網址替換為展開後的URL，以便於分析
-                analysis_message = user_message.replace(url_match.group(0), f"{original_url} (展開後: {expanded_url})")
-                logger.info(f"已展開短網址進行分析: {original_url} -> {expanded_url}")
-            else:
-                analysis_message = user_message
-        else:
-            analysis_message = user_message
-
-        # 首先檢查網域變形攻擊
-        spoofing_result = detect_domain_spoofing(analysis_message, SAFE_DOMAINS)
-        if spoofing_result['is_spoofed']:
-            logger.warning(f"檢測到網域變形攻擊: {spoofing_result['spoofed_domain']} 模仿 {spoofing_result['original_domain']}")
-            return {
-                "success": True,
-                "message": "分析完成",
-                "result": {
-                    "risk_level": "高風險",
-                    "fraud_type": "網域變形詐騙",
-                    "explanation": spoofing_result['risk_explanation'],
-                    "suggestions": f"• 立即停止使用這個網站\n• 不要輸入任何個人資料或密碼\n• 如需使用正牌網站，請直接搜尋 {spoofing_result['original_domain']} 或從書籤進入\n• 將此可疑網址回報給165反詐騙專線",
-                    "is_emerging": False,
-                    "display_name": display_name,
-                    "original_url": original_url,
-                    "expanded_url": expanded_url,
-                    "is_short_url": is_short_url,
-                    "url_expanded_successfully": url_expanded_successfully,
-                    "is_domain_spoofing": True,  # 特殊標記
-                    "spoofing_result": spoofing_result  # 包含完整的變形檢測結果
-                },
-                "raw_result": f"網域變形攻擊檢測：{spoofing_result['spoofing_type']} - {spoofing_result['risk_explanation']}"
-            }
-
-        # 檢查訊息是否包含白名單中的網址 - 改進版
-        # 提取URL進行精確匹配，支援二級域名
-        url_pattern_detailed = re.compile(r'https?://[^\s\u4e00-\u9fff，。！？；：]+|www\.[^\s\u4e00-\u9fff，。！？；：]+|[a-zA-Z0-9][a-zA-Z0-9-]*\.[a-zA-Z]{2,}(?:\.[a-zA-Z]{2,})?(?:/[^\s\u4e00-\u9fff，。！？；：]*)?')
-        urls = url_pattern_detailed.findall(analysis_message)
+        analysis_message = url_check['analysis_message']
+        expanded_urls = url_check['expanded_urls']  # 訊息中每個網址展開後的最終網址（分析結果快取鍵的一部分）
+        url_info = url_check['url_info']
+        original_url = url_info['original_url']
+        is_short_url = url_info['is_short_url']
+        url_expanded_successfully = url_info['url_expanded_successfully']
         
-        # 清理提取的URL，移除末尾標點符號
-        cleaned_urls = []
-        for url in urls:
-            cleaned_url = re.sub(r'[，。！？；：]+$', '', url)
-            if cleaned_url:  # 確保不是空字串
-                cleaned_urls.append(cleaned_url)
-        
-        # 創建標準化的安全網域列表（包含www和非www版本）
-        normalized_safe_domains = {}
-        for safe_domain, description in SAFE_DOMAINS.items():
-            safe_domain_lower = safe_domain.lower()
-            normalized_safe_domains[safe_domain_lower] = (safe_domain, description)
-            
-            # 添加www和非www版本
-            if safe_domain_lower.startswith('www.'):
-                normalized_safe_domains[safe_domain_lower[4:]] = (safe_domain, description)
-            else:
-                normalized_safe_domains['www.' + safe_domain_lower] = (safe_domain, description)
-        
-        # 檢查每個提取的URL
-        for url in cleaned_urls:
-            # 標準化URL
-            if not url.startswith(('http://', 'https://')):
-                if url.startswith('www.'):
-                    url = 'https://' + url
-                else:
-                    url = 'https://' + url
-            
-            try:
-                parsed = urlparse(url)
-                domain = parsed.netloc.lower()
-                
-                # 檢查是否完全匹配白名單網域
-                if domain in normalized_safe_domains:
-                    original_domain, site_description = normalized_safe_domains[domain]
-                    logger.info(f"檢測到白名單中的域名: {domain} -> {original_domain}")
-                    return {
-                        "success": True,
-                        "message": "分析完成",
-                        "result": {
-                            "risk_level": "低風險",
-                            "fraud_type": "非詐騙相關",
-                            "explanation": f"這個網站是 {original_domain}，{site_description}，可以安心使用。",
-                            "suggestions": "這是正規網站，不必特別擔心。如有疑慮，建議您直接從官方管道進入該網站。",
-                            "is_emerging": False,
-                            "display_name": display_name,
-                            "original_url": original_url,
-                            "expanded_url": expanded_url,
-                            "is_short_url": is_short_url,
-                            "url_expanded_successfully": url_expanded_successfully
-                        },
-                        "raw_result": f"經過分析，這是已知的可信任網站：{site_description}"
-                    }
-                
-                # 檢查是否為合法的子網域（例如 event.liontravel.com）
-                for safe_domain_key in SAFE_DOMAINS.keys():
-                    safe_domain_lower = safe_domain_key.lower()
-                    # 移除www前綴進行比較
-                    safe_domain_clean = safe_domain_lower[4:] if safe_domain_lower.startswith('www.') else safe_domain_lower
-                    domain_clean = domain[4:] if domain.startswith('www.') else domain
-                    
-                    # 檢查是否為合法子網域（必須是 *.safe_domain 的格式）
-                    # 修改後的邏輯：更好地處理多層子域名
-                    if domain_clean.endswith('.' + safe_domain_clean):
-                        # 確保不是網域本身
-                        if domain_clean != safe_domain_clean:
-                            # 提取子域名部分
-                            subdomain_part = domain_clean[:-len('.' + safe_domain_clean)]
-                            
-                            # 檢查子域名部分是否合法
-                            if _is_legitimate_subdomain(subdomain_part):
-                                site_description = SAFE_DOMAINS.get(safe_domain_key, "台灣常見的可靠網站")
-                                logger.info(f"檢測到合法子網域: {domain} -> {safe_domain_key}")
-                                return {
-                                    "success": True,
-                                    "message": "分析完成",
-                                    "result": {
-                                        "risk_level": "低風險",
-                                        "fraud_type": "非詐騙相關",
-                                        "explanation": f"這個網站是 {safe_domain_key} 的子網域，{site_description}，可以安心使用。",
-                                        "suggestions": "這是正規網站的子網域，不必特別擔心。如有疑慮，建議您直接從官方管道進入該網站。",
-                                        "is_emerging": False,
-                                        "display_name": display_name,
-                                        "original_url": original_url,
-                                        "expanded_url": expanded_url,
-                                        "is_short_url": is_short_url,
-                                        "url_expanded_successfully": url_expanded_successfully
-                                    },
-                                    "raw_result": f"經過分析，這是已知可信任網站的子網域：{site_description}"
-                                }
-            except Exception as e:
-                # URL解析失敗，繼續檢查下一個
-                continue
         # 如果是短網址但無法展開，提高風險評估
         special_notes = ""
         if is_short_url and not url_expanded_successfully:
             special_notes = "這是個短網址，但我們無法展開查看真正的目的地，這種情況要特別小心。短網址常被詐騙者利用來隱藏真實的惡意網站。除非您非常確定這個連結安全，否則不建議點擊。"
             logger.warning(f"無法展開的短網址: {original_url}，建議提高警覺")
         
-        openai_prompt = f"""
-        你是一位名為「防詐騙助手」的AI聊天機器人，專門幫助50-60歲的長輩防範詐騙。
-        
-        {special_notes}
+        # 短網址無法展開可能是暫時性錯誤，這種訊息不使用也不寫入快取
+        cacheable = not (is_short_url and not url_expanded_successfully)
         
-        以下是需要分析的信息：
-        ---
-        {analysis_message}
-        ---
+        # 同一則訊息（含展開後的網址）已分析過時，直接使用快取的結果，不再呼叫 OpenAI
+        cache_key = make_analysis_cache_key(
+            user_message, expanded_urls, FRAUD_ANALYSIS_PROMPT_VERSION, llm_gateway.model("text_analysis")
+        )
+        cached = analysis_cache.get(cache_key) if cacheable else None
+        if cached:
+            logger.info(f"詐騙分析結果快取命中: {cache_key[:12]}")
+            return _finalize_fraud_analysis(*cached, display_name, cache_hit=True, **url_info)
         
-        請按照以下固定格式回答，每一行都必須包含：
+        url_signals = {
+            # 白名單網址在前面已直接回覆，這裡剩下的網址都不在白名單中
+            "unlisted_urls": url_check['unlisted_urls'],
+            "short_url": is_short_url,
+            "short_url_expanded": url_expanded_successfully
+        }
+        # 本地評分明確偏高或偏低的訊息直接以範本回覆，只有不確定的訊息才呼叫 OpenAI
+        if LOCAL_RISK_SCORING:
+            tier, scored = local_risk_scorer.classify(user_message, url_signals)
+            if tier != 'uncertain':
+                logger.info(f"本地風險評分 {scored['score']}，判定為 {tier}，不呼叫 OpenAI")
+                raw_result = f"本地風險評分：{scored['score']}（{'、'.join(name for name, _, _ in scored['signals']) or '無特徵'}）"
+                return _finalize_fraud_analysis(local_risk_scorer.build_result(tier, scored), raw_result, display_name,
+                                                local_tier=tier, local_score=scored['score'], **url_info)
         
-        風險等級：[極高/高/中高/中/低/極低/無風險]
-        詐騙類型：[具體的詐騙類型，如：釣魚網站、假交友詐騙、投資詐騙等]
-        說明：[用簡單易懂的話解釋為什麼有風險或沒有風險，像鄰居朋友在聊天的語氣，避免複雜術語]
-        建議：[用emoji符號（🚫🔍🌐🛡️💡⚠️等）代替數字編號，給出簡單明確的防範建議]
-        新興手法：[是/否]
-        """
+        # 只換了電話、LINE ID、金額或網址的詐騙訊息：沿用先前高風險判定的分析結果
+        fingerprint = None
+        if cacheable and NEAR_DUPLICATE_MODE in ('reuse', 'confirm'):
+            fingerprint = near_duplicate_index.fingerprint(user_message)
+            match = near_duplicate_index.find(fingerprint)
+            cached = analysis_cache.get(match[0], record_stats=False) if match else None
+            if cached:
+                if NEAR_DUPLICATE_MODE == 'reuse':
+                    outcome = 'reused'
+                elif _confirm_near_duplicate(analysis_message, cached[0]):
+                    outcome = 'confirmed'
+                else:
+                    outcome = 'rejected'
+                near_duplicate_index.record_outcome(outcome)
+                logger.info(f"近似重複訊息（漢明距離 {match[1]}）: {outcome}")
+                if outcome != 'rejected':
+                    return _finalize_fraud_analysis(*cached, display_name, near_duplicate_distance=match[1], **url_info)
+            elif match:
+                near_duplicate_index.record_outcome('expired')
         
         # 調用OpenAI API (修正為新版API格式)
-        if not openai_client:
+        if not llm_gateway.available:
             logger.error("OpenAI客戶端未初始化，無法進行分析")
             return {
                 "success": False,
                 "message": "AI分析服務暫時不可用，請稍後再試"
             }
         
-        chat_response = openai_client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "你是一位名為「防詐騙助手」的AI聊天機器人，專門幫助50-60歲的長輩防範詐騙。你的說話風格要：\n1. 非常簡單易懂，像鄰居朋友在聊天\n2. 用溫暖親切的語氣，不要太正式\n3. 當給建議時，一定要用emoji符號（🚫🔍🌐🛡️💡⚠️等）代替數字編號\n4. 避免複雜的專業術語，用日常生活的話來解釋\n5. 當用戶提到投資、轉帳、可疑訊息時，要特別關心並給出簡單明確的建議\n6. 回應要簡短，不要太長篇大論"},
-                {"role": "user", "content": openai_prompt}
-            ],
-            temperature=0.2,
-            max_tokens=1000
-        )
+        # OpenAI 斷路中或超過延遲預算時，先以本地規則回覆初步結果，不讓使用者一直等待
+        try:
+            analysis = llm_gateway.call("text_analysis", _request_fraud_analysis, analysis_message, special_notes)
+        except (CircuitOpenError, LatencyBudgetExceeded) as e:
+            if isinstance(e, LatencyBudgetExceeded) and cacheable:
+                # 晚到的完整分析寫入快取，使用者再傳一次時就能拿到
+                e.future.add_done_callback(
+                    lambda future: _store_late_fraud_analysis(future, cache_key, fingerprint, user_message)
+                )
+            preliminary_result = local_risk_scorer.build_preliminary_result(local_risk_scorer.score(user_message, url_signals))
+            return _finalize_fraud_analysis(preliminary_result, f"初步結果：{e}", display_name, preliminary=True, **url_info)
         
-        if chat_response and chat_response.choices:
-            analysis_result = chat_response.choices[0].message.content.strip()
+        if analysis:
+            parsed_result, analysis_result = analysis
             logger.info(f"風險分析結果: {analysis_result[:100]}...")  # 僅記錄部分結果
             
-            # 將結果解析成結構化格式
-            parsed_result = parse_fraud_analysis(analysis_result)
+            if cacheable:
+                _store_fraud_analysis(cache_key, fingerprint, user_message, parsed_result, analysis_result)
             
-            # 添加一個使用者可識別的標識
-            parsed_result["display_name"] = display_name
-            
-            # 添加URL相關信息
-            parsed_result["original_url"] = original_url
-            parsed_result["expanded_url"] = expanded_url
-            parsed_result["is_short_url"] = is_short_url
-            parsed_result["url_expanded_successfully"] = url_expanded_successfully
-            
-            # 如果是短網址但無法展開，提高風險等級
-            if is_short_url and not url_expanded_successfully:
-                if parsed_result["risk_level"] == "低風險":
-                    parsed_result["risk_level"] = "中風險"
-                    parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n⚠️ 此外，這是一個短網址但無法展開查看真正的目的地，這點也要特別小心。"
-                
-                if "短網址" not in parsed_result["explanation"]:
-                    parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n⚠️ 要注意這是一個短網址(像是縮短過的網址)，無法看到真正要去的網站，這種情況要特別小心。"
-                
-                if "短網址" not in parsed_result["suggestions"]:
-                    parsed_result["suggestions"] = f"{parsed_result['suggestions']}\n• 遇到短網址時，最好先詢問傳送連結的人是什麼內容，或者乾脆不要點擊。"
-            
-            # 如果是短網址且成功展開，在結果中加入說明
-            if is_short_url and url_expanded_successfully:
-                parsed_result["explanation"] = f"{parsed_result['explanation']}\n\n這個連結是短網址，已經幫您展開查看真正的目的地是: {expanded_url}"
-            
-            # 檢查解析結果，確保所有必要欄位都有值
-            if not parsed_result.get("explanation") or parsed_result["explanation"] == "無法解析分析結果。":
-                # 如果無法正確解析理由，直接使用原始回應
-                logger.warning("無法正確解析分析理由，使用原始回應替代")
-                parsed_result["explanation"] = analysis_result.replace("風險等級：", "").replace("詐騙類型：", "").replace("說明：", "").replace("建議：", "").replace("新興手法：", "").strip()
-                
-                # 確保理由不為空
-                if not parsed_result["explanation"] or parsed_result["explanation"].strip() == "":
-                    parsed_result["explanation"] = "這個內容看起來有點奇怪，建議不要輕易點擊或提供個人資料。如果不確定，可以請家人幫忙確認一下。"
-            
-            return {
-                "success": True,
-                "message": "分析完成",
-                "result": parsed_result,
-                "raw_result": analysis_result
-            }
+            return _finalize_fraud_analysis(parsed_result, analysis_result, display_name, **url_info)
         else:
             logger.error("OpenAI API 返回空結果")
             return {
@@ -668,6 +578,28 @@ def fraud_statistics():
     stats = firebase_manager.get_fraud_statistics()
     return render_template('statistics.html', stats=stats)
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """顯示各項快取的命中率等效能指標"""
+    return jsonify({
+        "spoof_verdict_cache": get_spoof_cache_stats(),
+        "typosquat_table": get_permutation_table_stats(SAFE_DOMAINS),
+        "domain_blocklist": get_blocklist_stats(),
+        "short_url_cache": get_short_url_cache_stats(),
+        "short_url_expander": get_short_url_expander_stats(),
+        "analysis_cache": get_analysis_cache_stats(),
+        "near_duplicate_index": get_near_duplicate_stats(),
+        "token_usage": get_token_usage_stats(),
+        "token_budget": get_token_budget_stats(),
+        "local_risk_scorer": get_local_risk_stats(),
+        "text_classifier": get_text_classifier_stats(),
+        "circuit_breaker": get_circuit_breaker_stats(),
+        "llm_gateway": get_llm_gateway_stats(),
+        "qr_decoder": get_qr_decoder_stats(),
+        "image_preprocessor": get_image_preprocessor_stats(),
+        "screenshot_cache": get_screenshot_cache_stats()
+    })
+
 # 只有在handler存在時才添加事件處理器
 if handler:
     @handler.add(MessageEvent, message=TextMessage)
@@ -987,15 +919,19 @@ if handler:
         
         logger.info(f"進入一般聊天模式: {cleaned_message}")
         try:
-            chat_response = openai_client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                 {"role": "system", "content": "你是一位名為「土豆」的AI聊天機器人，專門幫助50-60歲的長輩防範詐騙。你的說話風格要：\n1. 非常簡單易懂，像鄰居朋友在聊天\n2. 用溫暖親切的語氣，不要太正式\n3. 當給建議時，一定要用emoji符號（🚫🔍🌐🛡️💡⚠️等）代替數字編號\n4. 避免複雜的專業術語，用日常生活的話來解釋\n5. 當用戶提到投資、轉帳、可疑訊息時，要特別關心並給出簡單明確的建議\n6. 回應要簡短，不要太長篇大論"},
-                 {"role": "user", "content": cleaned_message}
-                ],
-                temperature=CHAT_TEMPERATURE,
-                max_tokens=CHAT_MAX_TOKENS
-            )
+            try:
+                chat_response = llm_gateway.hedged_complete(
+                    "chat",
+                    [
+                     {"role": "system", "content": CHAT_REPLY_SYSTEM_PROMPT},
+                     {"role": "user", "content": token_budget.fit("chat", cleaned_message, fixed_prompt=CHAT_REPLY_SYSTEM_PROMPT)}
+                    ],
+                    temperature=CHAT_TEMPERATURE
+                )
+            except (CircuitOpenError, LatencyBudgetExceeded) as e:
+                # 改用下方的忙碌回覆
+                logger.warning(f"聊天回覆暫時無法取得: {e}")
+                chat_response = None
             
             if chat_response and chat_response.choices:
                 chat_reply = chat_response.choices[0].message.content.strip()
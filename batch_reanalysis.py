@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批次重新分析模組
+修改提示詞或新增詐騙類型後，以 OpenAI Batch API 重新分析歷史的 fraud_reports 與 emerging_fraud_reports：
+
+1. 從 FirebaseManager 逐頁串流讀取回報，寫成 Batch API 的 JSONL 輸入檔（每檔最多 BATCH_REANALYSIS_MAX_REQUESTS 筆）
+2. 上傳並建立批次，定期查詢直到完成
+3. 下載結果，以 Firestore 批次寫入存回各回報的 reanalysis 欄位（加上 --relabel 時同時更新 fraud_type 與 risk_level）
+
+Batch API 的費用約為同步呼叫的一半，也不佔用線上服務的同時請求名額與斷路器。
+請求內容與線上的結構化文字分析相同（同一個系統提示、JSON Schema 與 token 上限）。
+
+不連網試跑整個流程（以本地規則產生回應，不會寫入 Firestore）：
+    python batch_reanalysis.py --stub --limit 20
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+
+from config import (
+    LLM_ROUTES, BATCH_REANALYSIS_COLLECTIONS, BATCH_REANALYSIS_DIR,
+    BATCH_REANALYSIS_MAX_REQUESTS, BATCH_REANALYSIS_POLL_SECONDS, FIRESTORE_PAGE_SIZE, FIRESTORE_BATCH_WRITE_SIZE
+)
+from structured_analysis import (
+    TEXT_ANALYSIS_FIELDS, TEXT_ANALYSIS_SCHEMA, build_response_format, build_text_analysis_messages,
+    text_analysis_system_prompt, parse_structured_analysis
+)
+from token_budget import token_budget
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def build_batch_request(collection, doc_id, message, model):
+    """產生一筆 Batch API 請求（custom_id 為「集合/文件ID」）"""
+    message = token_budget.fit("text_analysis", message, fixed_prompt=text_analysis_system_prompt())
+    return {
+        "custom_id": f"{collection}/{doc_id}",
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": build_text_analysis_messages(message),
+            "temperature": 0.2,
+            "max_tokens": LLM_ROUTES['text_analysis']['max_tokens'],
+            "response_format": build_response_format("fraud_analysis", TEXT_ANALYSIS_SCHEMA),
+        },
+    }
+
+
+def iter_report_messages(firebase_manager, collections, limit=None):
+    """
+    串流讀取各集合中有訊息內容的回報
+
+    Returns:
+        (集合, 文件ID, 訊息) 的迭代器
+    """
+    for collection in collections:
+        field = BATCH_REANALYSIS_COLLECTIONS[collection]
+        count = 0
+        for report in firebase_manager.stream_collection(collection, FIRESTORE_PAGE_SIZE):
+            if limit is not None and count >= limit:
+                break
+            message = report.get(field)
+            if isinstance(message, str) and message.strip():
+                count += 1
+                yield collection, report['id'], message
+
+
+def write_batch_files(requests, output_dir, max_requests=BATCH_REANALYSIS_MAX_REQUESTS):
+    """
+    將請求逐筆寫入 JSONL 輸入檔，超過每檔上限時換下一個檔案
+
+    Returns:
+        list: [(檔案路徑, 請求數)]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    files = []
+    handle = None
+    try:
+        for request in requests:
+            if handle is None or files[-1][1] >= max_requests:
+                if handle is not None:
+                    handle.close()
+                path = os.path.join(output_dir, f"reanalysis_{prefix}_{len(files) + 1}.jsonl")
+                handle = open(path, 'w', encoding='utf-8')
+                files.append([path, 0])
+            handle.write(json.dumps(request, ensure_ascii=False) + "\n")
+            files[-1][1] += 1
+    finally:
+        if handle is not None:
+            handle.close()
+    return [tuple(item) for item in files]
+
+
+def parse_batch_output(text):
+    """
+    解析 Batch API 的輸出檔
+
+    Returns:
+        tuple: ({集合: {文件ID: 分析結果}}, 失敗的 custom_id 列表)
+    """
+    results, failed = {}, []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get('custom_id', '')
+        response = item.get('response') or {}
+        parsed = None
+        if response.get('status_code') == 200 and not item.get('error'):
+            choices = (response.get('body') or {}).get('choices') or []
+            if choices:
+                parsed = parse_structured_analysis(choices[0]['message'].get('content'), TEXT_ANALYSIS_FIELDS)
+        collection, _, doc_id = custom_id.partition('/')
+        if parsed is None or not doc_id:
+            failed.append(custom_id)
+            continue
+        results.setdefault(collection, {})[doc_id] = parsed
+    return results, failed
+
+
+class BatchReanalysisJob:
+    """串流讀取回報、送出批次、寫回結果的重新分析工作"""
+
+    def __init__(self, client, firebase_manager, model=None, output_dir=BATCH_REANALYSIS_DIR,
+                 poll_seconds=BATCH_REANALYSIS_POLL_SECONDS, relabel=False, sleep=time.sleep):
+        self.client = client
+        self.firebase_manager = firebase_manager
+        self.model = model or LLM_ROUTES['text_analysis']['model']
+        self.output_dir = output_dir
+        self.poll_seconds = poll_seconds
+        self.relabel = relabel
+        self._sleep = sleep
+        self.stats = {'requests': 0, 'batches': 0, 'succeeded': 0, 'failed': 0, 'written': 0}
+
+    def prepare(self, collections, limit=None):
+        """讀取回報並寫成 JSONL 輸入檔"""
+        requests = (build_batch_request(collection, doc_id, message, self.model)
+                    for collection, doc_id, message in iter_report_messages(self.firebase_manager, collections, limit))
+        files = write_batch_files(requests, self.output_dir)
+        self.stats['requests'] += sum(count for _, count in files)
+        return files
+
+    def submit(self, path):
+        """上傳輸入檔並建立批次，返回批次ID"""
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window='24h',
+            metadata={'job': 'fraud_reanalysis', 'model': self.model},
+        )
+        self.stats['batches'] += 1
+        logger.info(f"已建立批次 {batch.id}（{os.path.basename(path)}）")
+        return batch.id
+
+    def wait(self, batch_id):
+        """定期查詢批次狀態直到結束"""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in _FINAL_STATUSES:
+                return batch
+            logger.info(f"批次 {batch_id} 狀態：{batch.status}")
+            self._sleep(self.poll_seconds)
+
+    def _build_update(self, batch_id, result):
+        update = {
+            'reanalysis': dict(result, model=self.model, batch_id=batch_id, reanalyzed_at=datetime.datetime.now()),
+        }
+        if self.relabel:
+            update['fraud_type'] = result['fraud_type']
+            update['risk_level'] = result['risk_level']
+        return update
+
+    def collect(self, batch):
+        """下載批次結果並以批次寫入存回 Firestore"""
+        if batch.status != 'completed':
+            logger.error(f"批次 {batch.id} 未完成：{batch.status}")
+            return 0
+        results, failed = {}, []
+        if batch.output_file_id:
+            results, failed = parse_batch_output(self.client.files.content(batch.output_file_id).text)
+        if batch.error_file_id:
+            _, errors = parse_batch_output(self.client.files.content(batch.error_file_id).text)
+            failed.extend(errors)
+        if failed:
+            logger.warning(f"批次 {batch.id} 有 {len(failed)} 筆請求失敗，例如：{failed[:5]}")
+
+        written = 0
+        for collection, by_id in results.items():
+            updates = {doc_id: self._build_update(batch.id, result) for doc_id, result in by_id.items()}
+            written += self.firebase_manager.batch_update_documents(collection, updates, FIRESTORE_BATCH_WRITE_SIZE)
+        self.stats['succeeded'] += sum(len(by_id) for by_id in results.values())
+        self.stats['failed'] += len(failed)
+        self.stats['written'] += written
+        return written
+
+    def run(self, collections=tuple(BATCH_REANALYSIS_COLLECTIONS), limit=None):
+        """執行完整流程，返回統計"""
+        for path, count in self.prepare(collections, limit):
+            logger.info(f"輸入檔 {path}：{count} 筆請求")
+            self.collect(self.wait(self.submit(path)))
+        return dict(self.stats)
+
+
+def _local_responder(user_content):
+    """本地試跑用：以本地風險評分產生與結構化輸出相同欄位的回應"""
+    from local_risk_scorer import local_risk_scorer
+    tier, scored = local_risk_scorer.classify(user_content)
+    if tier == 'uncertain':
+        return {"risk": "中", "type": "待確認", "reason": "本地規則無法判斷，需要 AI 分析。", "advice": "💡 請以 AI 重新分析", "emerging": False}
+    result = local_risk_scorer.build_result(tier, scored)
+    return {"risk": result['risk_level'].replace('風險', ''), "type": result['fraud_type'],
+            "reason": result['explanation'], "advice": result['suggestions'], "emerging": False}
+
+
+class LocalBatchStub:
+    """
+    不連網的 Batch API 替身（提供 files.create / files.content / batches.create / batches.retrieve）
+
+    建立批次時立即以 responder(使用者提示) 產生每筆請求的回應；responder 返回 None 時該筆請求視為失敗。
+    """
+
+    def __init__(self, responder=None):
+        self.responder = responder or _local_responder
+        self._files = {}
+        self._batches = {}
+        self.files = _StubFiles(self)
+        self.batches = _StubBatches(self)
+
+    def _store(self, content):
+        file_id = f"file-stub-{len(self._files) + 1}"
+        self._files[file_id] = content
+        return file_id
+
+    def _run_batch(self, input_file_id):
+        output, errors = io.StringIO(), io.StringIO()
+        for line in self._files[input_file_id].splitlines():
+            request = json.loads(line)
+            answer = self.responder(request['body']['messages'][-1]['content'])
+            if answer is None:
+                errors.write(json.dumps({"custom_id": request['custom_id'], "response": None,
+                                         "error": {"code": "stub_error", "message": "responder returned None"}},
+                                        ensure_ascii=False) + "\n")
+                continue
+            body = {"choices": [{"message": {"role": "assistant", "content": json.dumps(answer, ensure_ascii=False)}}]}
+            output.write(json.dumps({"custom_id": request['custom_id'], "response": {"status_code": 200, "body": body},
+                                     "error": None}, ensure_ascii=False) + "\n")
+        return (self._store(output.getvalue()) if output.getvalue() else None,
+                self._store(errors.getvalue()) if errors.getvalue() else None)
+
+
+class _StubObject:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _StubFiles:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, file, purpose):
+        content = file.read()
+        return _StubObject(id=self._stub._store(content.decode('utf-8') if isinstance(content, bytes) else content))
+
+    def content(self, file_id):
+        return _StubObject(text=self._stub._files[file_id])
+
+
+class _StubBatches:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, input_file_id, endpoint, completion_window, metadata=None):
+        output_file_id, error_file_id = self._stub._run_batch(input_file_id)
+        batch_id = f"batch-stub-{len(self._stub._batches) + 1}"
+        # 第一次查詢時仍在處理中，第二次才完成，以涵蓋輪詢流程
+        self._stub._batches[batch_id] = [
+            _StubObject(id=batch_id, status='in_progress', output_file_id=None, error_file_id=None),
+            _StubObject(id=batch_id, status='completed', output_file_id=output_file_id, error_file_id=error_file_id),
+        ]
+        return _StubObject(id=batch_id, status='validating')
+
+    def retrieve(self, batch_id):
+        states = self._stub._batches[batch_id]
+        return states.pop(0) if len(states) > 1 else states[0]
+
+
+class _DryRunFirebase:
+    """試跑用：讀取真正的 Firestore，但只記錄要寫入的內容"""
+
+    def __init__(self, firebase_manager):
+        self._firebase_manager = firebase_manager
+        self.updates = {}
+
+    def stream_collection(self, collection, page_size=500):
+        return self._firebase_manager.stream_collection(collection, page_size)
+
+    def batch_update_documents(self, collection, updates, batch_size=500):
+        self.updates.setdefault(collection, {}).update(updates)
+        return len(updates)
+
+
+def main(argv=None):
+    """以 Batch API 重新分析歷史回報"""
+    parser = argparse.ArgumentParser(description="以 OpenAI Batch API 重新分析歷史詐騙回報")
+    parser.add_argument('--collections', nargs='+', choices=list(BATCH_REANALYSIS_COLLECTIONS),
+                        default=list(BATCH_REANALYSIS_COLLECTIONS))
+    parser.add_argument('--limit', type=int, help="每個集合最多處理的回報數")
+    parser.add_argument('--relabel', action='store_true', help="同時以新結果更新 fraud_type 與 risk_level")
+    parser.add_argument('--stub', action='store_true', help="以本地替身試跑（不呼叫 OpenAI，不寫入 Firestore）")
+    parser.add_argument('--resume', metavar='BATCH_ID', help="不建立新批次，等待並寫回已送出的批次")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from firebase_manager import FirebaseManager
+    firebase_manager = FirebaseManager.get_instance()
+    if args.stub:
+        client, firebase_manager = LocalBatchStub(), _DryRunFirebase(firebase_manager)
+    else:
+        from llm_gateway import create_openai_client
+        client = create_openai_client()
+        if client is None:
+            print("❌ OpenAI 客戶端未初始化")
+            return 1
+
+    job = BatchReanalysisJob(client, firebase_manager, relabel=args.relabel, poll_seconds=0 if args.stub else BATCH_REANALYSIS_POLL_SECONDS)
+    if args.resume:
+        job.collect(job.wait(args.resume))
+        stats = dict(job.stats)
+    else:
+        stats = job.run(args.collections, args.limit)
+    print(f"📊 {json.dumps(stats, ensure_ascii=False)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
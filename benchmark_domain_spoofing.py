@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+網域變形檢測基準測試
+從 safe_domains.json 產生帶標籤的測試語料（變形網域與合法網域），
+量測 domain_spoofing_detector 的準確率與效能，結果存成 JSON 方便比較。
+
+使用方式：
+    python benchmark_domain_spoofing.py
+    python benchmark_domain_spoofing.py --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from datetime import datetime
+from urllib.parse import urlparse
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from domain_spoofing_detector import (
+    detect_domain_spoofing, spoof_verdict_cache, get_safe_domains_version
+)
+
+# 變形類別（標籤為詐騙）
+SPOOF_CATEGORIES = ["insertion", "substitution", "tw_suffix", "homograph", "tld_swap", "gov_lookalike"]
+# 合法類別（標籤為正常）
+LEGIT_CATEGORIES = ["whitelisted", "www_variant", "legit_tld_variant", "unrelated"]
+
+# 字元替換時使用的鍵盤鄰近字元
+_KEYBOARD_NEIGHBORS = {
+    'a': 'qsz', 'b': 'vgn', 'c': 'xdv', 'd': 'sfe', 'e': 'wrd', 'f': 'dgr', 'g': 'fht',
+    'h': 'gjy', 'i': 'uok', 'j': 'hku', 'k': 'jli', 'l': 'kop', 'm': 'nj', 'n': 'bmh',
+    'o': 'ipl', 'p': 'ol', 'q': 'wa', 'r': 'etf', 's': 'adw', 't': 'ryg', 'u': 'yij',
+    'v': 'cbf', 'w': 'qes', 'x': 'zcs', 'y': 'tuh', 'z': 'xa',
+}
+
+# 相似字元替換（ASCII 及西里爾字母）
+_HOMOGLYPHS = {'o': ['0', 'о'], 'l': ['1', 'I'], 'i': ['1', 'і'], 'e': ['е'], 'a': ['а'], 'c': ['с'], 'm': ['rn']}
+
+_SWAP_TLDS = ['.net', '.xyz', '.top', '.cc', '.co', '.info']
+
+# 與白名單無關的正常網域
+_UNRELATED_DOMAINS = [
+    "example.org", "python.org", "wikipedia.org", "mozilla.org", "debian.org",
+    "stackoverflow.com", "github.io", "readthedocs.io", "pypi.org", "w3.org",
+    "ietf.org", "kernel.org", "apache.org", "gnu.org", "rust-lang.org",
+]
+
+
+def load_safe_domains(path=None):
+    """
+    載入並扁平化 safe_domains.json
+
+    白名單中有些項目帶有路徑（例如 line.me/pay），只保留主機名稱並去除重複，
+    否則帶路徑的項目不是有效的主機名稱，以它產生的合法樣本會被誤算成誤判。
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'safe_domains.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    flattened_safe_domains = {}
+    for domains in data['safe_domains'].values():
+        if not isinstance(domains, dict):
+            continue
+        for domain, description in domains.items():
+            hostname = urlparse('//' + domain.strip()).hostname
+            if hostname:
+                flattened_safe_domains.setdefault(hostname, description)
+    return flattened_safe_domains
+
+
+def _split_domain(domain):
+    """拆成 (基礎網域名稱, 其餘後綴)，例如 shopee.tw -> ('shopee', '.tw')"""
+    domain = domain.lower()
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    base, _, suffix = domain.partition('.')
+    return base, '.' + suffix if suffix else ''
+
+
+def _insertion(rng, base):
+    """重複或插入一個字元"""
+    i = rng.randrange(len(base))
+    if rng.random() < 0.5:
+        return base[:i] + base[i] + base[i:]
+    return base[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + base[i:]
+
+
+def _substitution(rng, base):
+    """以鍵盤鄰近字元替換一個字母"""
+    positions = [i for i, ch in enumerate(base) if ch in _KEYBOARD_NEIGHBORS]
+    if not positions:
+        return None
+    i = rng.choice(positions)
+    return base[:i] + rng.choice(_KEYBOARD_NEIGHBORS[base[i]]) + base[i + 1:]
+
+
+def _homograph(rng, base):
+    """以外觀相似的字元替換一個字母"""
+    positions = [i for i, ch in enumerate(base) if ch in _HOMOGLYPHS]
+    if not positions:
+        return None
+    i = rng.choice(positions)
+    return base[:i] + rng.choice(_HOMOGLYPHS[base[i]]) + base[i + 1:]
+
+
+def generate_corpus(safe_domains, seed=42, per_domain=1):
+    """
+    產生帶標籤的測試語料
+
+    Args:
+        safe_domains: 扁平化的白名單網域字典
+        seed: 亂數種子（固定種子讓每次產生的語料相同）
+        per_domain: 每個白名單網域每種變形產生的樣本數
+
+    Returns:
+        list: [{'host', 'category', 'is_spoof', 'target'}, ...]
+    """
+    rng = random.Random(seed)
+    corpus = []
+    seen = set()
+    normalized = set()
+    for domain in safe_domains:
+        domain = domain.lower()
+        normalized.add(domain)
+        normalized.add(domain[4:] if domain.startswith('www.') else 'www.' + domain)
+
+    def add(host, category, is_spoof, target):
+        if not host or host in seen:
+            return
+        # 產生的變形剛好是另一個白名單網域時不列入
+        if is_spoof and host in normalized:
+            return
+        seen.add(host)
+        corpus.append({'host': host, 'category': category, 'is_spoof': is_spoof, 'target': target})
+
+    for safe_domain in sorted(safe_domains, key=str.lower):
+        base, suffix = _split_domain(safe_domain)
+        if not suffix or len(base) < 3:
+            continue
+
+        # 合法樣本
+        add(safe_domain.lower(), "whitelisted", False, safe_domain)
+        www_variant = safe_domain.lower()[4:] if safe_domain.lower().startswith('www.') else 'www.' + safe_domain.lower()
+        add(www_variant, "www_variant", False, safe_domain)
+        if suffix == '.com.tw':
+            add(base + '.tw', "legit_tld_variant", False, safe_domain)
+
+        if suffix.endswith('.gov.tw'):
+            # 政府網站變形
+            for _ in range(per_domain):
+                add(rng.choice([f"{base}-gov.com", f"{base}gov.net", f"gov-{base}.com", f"{base}.gov.tw.{rng.choice(['cc', 'top', 'xyz'])}"]),
+                    "gov_lookalike", True, safe_domain)
+            continue
+
+        for _ in range(per_domain):
+            add(_insertion(rng, base) + suffix, "insertion", True, safe_domain)
+            substituted = _substitution(rng, base)
+            if substituted:
+                add(substituted + suffix, "substitution", True, safe_domain)
+            add(f"{base}-{rng.choice(['tw', 'taiwan'])}{rng.choice(['.com', '.net', suffix])}", "tw_suffix", True, safe_domain)
+            homograph = _homograph(rng, base)
+            if homograph:
+                add(homograph.encode('idna').decode('ascii') + suffix if not homograph.isascii() else homograph + suffix,
+                    "homograph", True, safe_domain)
+            swapped = rng.choice([tld for tld in _SWAP_TLDS if tld != suffix])
+            add(base + swapped, "tld_swap", True, safe_domain)
+
+    for domain in _UNRELATED_DOMAINS:
+        if domain not in normalized:
+            add(domain, "unrelated", False, None)
+
+    return corpus
+
+
+def _percentile(sorted_values, pct):
+    """取已排序數列的百分位數"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def run_benchmark(safe_domains, corpus, warm_passes=1):
+    """
+    執行基準測試
+
+    冷啟動量測前會清空檢測結果快取，確保量到的是實際的檢測成本；
+    之後再以快取量測重複網域的效能。
+
+    Returns:
+        dict: 準確率與效能指標
+    """
+    # 預先計算白名單版本與索引，不列入量測
+    get_safe_domains_version(safe_domains)
+    detect_domain_spoofing("warmup.example", safe_domains)
+    spoof_verdict_cache.clear()
+
+    latencies = []
+    per_category = {}
+    tp = fp = tn = fn = 0
+    misses = []
+    false_alarms = []
+
+    start = time.perf_counter()
+    for sample in corpus:
+        t0 = time.perf_counter()
+        result = detect_domain_spoofing(sample['host'], safe_domains)
+        latencies.append(time.perf_counter() - t0)
+
+        predicted = bool(result.get('is_spoofed'))
+        stats = per_category.setdefault(sample['category'], {'total': 0, 'flagged': 0})
+        stats['total'] += 1
+        stats['flagged'] += int(predicted)
+
+        if sample['is_spoof'] and predicted:
+            tp += 1
+        elif sample['is_spoof']:
+            fn += 1
+            misses.append(sample['host'])
+        elif predicted:
+            fp += 1
+            false_alarms.append(sample['host'])
+        else:
+            tn += 1
+    cold_elapsed = time.perf_counter() - start
+
+    warm_elapsed = 0.0
+    for _ in range(warm_passes):
+        start = time.perf_counter()
+        for sample in corpus:
+            detect_domain_spoofing(sample['host'], safe_domains)
+        warm_elapsed += time.perf_counter() - start
+
+    for category, stats in per_category.items():
+        stats['flag_rate'] = round(stats['flagged'] / stats['total'], 4) if stats['total'] else 0.0
+
+    latencies.sort()
+    total = len(corpus)
+    precision = tp / (tp + fp) if (tp + fp) else 0.0
+    recall = tp / (tp + fn) if (tp + fn) else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) else 0.0
+
+    return {
+        'accuracy': {
+            'precision': round(precision, 4),
+            'recall': round(recall, 4),
+            'f1': round(f1, 4),
+            'true_positives': tp,
+            'false_positives': fp,
+            'true_negatives': tn,
+            'false_negatives': fn,
+            'per_category': per_category,
+            'missed_samples': misses[:50],
+            'false_alarm_samples': false_alarms[:50],
+        },
+        'performance': {
+            'urls': total,
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 4),
+            'p99_ms': round(_percentile(latencies, 99) * 1000, 4),
+            'max_ms': round(latencies[-1] * 1000, 4) if latencies else 0.0,
+            'cold_urls_per_second': round(total / cold_elapsed, 1) if cold_elapsed else 0.0,
+            'warm_urls_per_second': round(total * warm_passes / warm_elapsed, 1) if warm_elapsed else 0.0,
+        },
+    }
+
+
+def compare_results(previous, current):
+    """列出與前一次結果的差異"""
+    lines = []
+    for section, keys in (('accuracy', ['precision', 'recall', 'f1', 'false_positives', 'false_negatives']),
+                          ('performance', ['p50_ms', 'p99_ms', 'cold_urls_per_second', 'warm_urls_per_second'])):
+        for key in keys:
+            before = previous.get(section, {}).get(key)
+            after = current[section][key]
+            if before is None:
+                continue
+            lines.append(f"  {key:<22} {before:>12} -> {after:<12} ({after - before:+.4f})")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="網域變形檢測準確率與效能基準測試")
+    parser.add_argument('--safe-domains', default=None, help="safe_domains.json 路徑")
+    parser.add_argument('--seed', type=int, default=42, help="語料亂數種子")
+    parser.add_argument('--per-domain', type=int, default=1, help="每個網域每種變形的樣本數")
+    parser.add_argument('--output', default='domain_spoofing_benchmark.json', help="結果輸出檔案")
+    parser.add_argument('--compare', default=None, help="要比較的前一次結果 JSON")
+    parser.add_argument('--dump-corpus', default=None, help="另存產生的語料 JSON")
+    args = parser.parse_args(argv)
+
+    safe_domains = load_safe_domains(args.safe_domains)
+    corpus = generate_corpus(safe_domains, seed=args.seed, per_domain=args.per_domain)
+    if args.dump_corpus:
+        with open(args.dump_corpus, 'w', encoding='utf-8') as f:
+            json.dump(corpus, f, ensure_ascii=False, indent=2)
+
+    results = run_benchmark(safe_domains, corpus)
+    results['meta'] = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'per_domain': args.per_domain,
+        'safe_domains': len(safe_domains),
+        'registry_version': get_safe_domains_version(safe_domains),
+        'corpus_size': len(corpus),
+        'spoof_samples': sum(1 for sample in corpus if sample['is_spoof']),
+        'legit_samples': sum(1 for sample in corpus if not sample['is_spoof']),
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    accuracy = results['accuracy']
+    performance = results['performance']
+    print(f"📊 語料：{results['meta']['corpus_size']} 筆（變形 {results['meta']['spoof_samples']} / 正常 {results['meta']['legit_samples']}）")
+    print(f"🎯 Precision {accuracy['precision']:.4f}  Recall {accuracy['recall']:.4f}  F1 {accuracy['f1']:.4f}")
+    for category in SPOOF_CATEGORIES + LEGIT_CATEGORIES:
+        stats = accuracy['per_category'].get(category)
+        if stats:
+            print(f"  {category:<18} {stats['flagged']:>5}/{stats['total']:<5} 判定為變形 ({stats['flag_rate']:.2%})")
+    print(f"⏱️ p50 {performance['p50_ms']} ms  p99 {performance['p99_ms']} ms  "
+          f"冷啟動 {performance['cold_urls_per_second']} URLs/s  快取 {performance['warm_urls_per_second']} URLs/s")
+    print(f"💾 結果已儲存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"🔁 與 {args.compare} 比較：")
+        for line in compare_results(previous, results):
+            print(line)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+短網址展開基準測試
+在本機轉址模擬伺服器上量測各種展開方式的延遲、讀取量與正確性，不需要網路連線。
+
+量測的展開方式：
+    legacy_head: 舊版 expand_short_url（每次新建 Session，HEAD 自動轉址）
+    expand_short_url: 目前 expand_short_url 使用的共用展開器
+    full_redirect: improved_short_url_expansion.expand_short_url_with_full_redirect
+
+使用方式：
+    python benchmark_url_expansion.py
+    python benchmark_url_expansion.py --iterations 20 --output expansion.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from datetime import datetime
+
+import requests
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from redirect_standin_server import RedirectStandInServer, default_scenarios
+from short_url_service import ShortURLExpander, short_url_expander
+from improved_short_url_expansion import expand_short_url_with_full_redirect
+
+
+def _legacy_head(url):
+    """舊版展開方式：每次新建 Session，以 HEAD 自動追蹤 HTTP 轉址"""
+    try:
+        response = requests.Session().head(url, allow_redirects=True, timeout=5)
+        return response.url, 0
+    except Exception:
+        return url, 0
+
+
+def _percentile(sorted_values, pct):
+    """取已排序數列的百分位數"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def run_benchmark(iterations=5):
+    """
+    執行基準測試
+
+    Returns:
+        dict: {展開方式: {情境: 指標}}
+    """
+    results = {}
+    with RedirectStandInServer() as server:
+        # 模擬伺服器的主機視為短網址服務；不使用快取，量測實際展開成本
+        expander = ShortURLExpander(cache=None, short_hosts={server.host})
+
+        def run_expand(url):
+            before = expander.get_stats()['bytes_read']
+            final_url = expander.expand(url)['final_url']
+            return final_url, expander.get_stats()['bytes_read'] - before
+
+        def run_full_redirect(url):
+            before = short_url_expander.get_stats()['bytes_read']
+            final_url = expand_short_url_with_full_redirect(url)[1]
+            return final_url, short_url_expander.get_stats()['bytes_read'] - before
+
+        strategies = {
+            'legacy_head': _legacy_head,
+            'expand_short_url': run_expand,
+            'full_redirect': run_full_redirect,
+        }
+
+        for strategy_name, strategy in strategies.items():
+            strategy_results = {}
+            for scenario_name, start_path, expected_path in default_scenarios():
+                url = server.url(start_path)
+                expected_url = server.url(expected_path)
+                latencies = []
+                correct = 0
+                bytes_read = 0
+                server_before = server.get_stats(wait_idle=True)
+
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    final_url, read = strategy(url)
+                    latencies.append(time.perf_counter() - start)
+                    correct += int(final_url == expected_url)
+                    bytes_read += read
+
+                # 客戶端提早停止讀取後，伺服器可能還在送出剩下的內容，等它結束再取樣
+                server_after = server.get_stats(wait_idle=True)
+                latencies.sort()
+                strategy_results[scenario_name] = {
+                    'correct': correct,
+                    'runs': iterations,
+                    'accuracy': round(correct / iterations, 4),
+                    'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+                    'max_ms': round(latencies[-1] * 1000, 2),
+                    'bytes_read_per_run': bytes_read // iterations,
+                    'server_bytes_sent_per_run': (server_after['bytes_sent'] - server_before['bytes_sent']) // iterations,
+                    'requests_per_run': round((server_after['requests'] - server_before['requests']) / iterations, 1),
+                }
+            results[strategy_name] = strategy_results
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="短網址展開基準測試（使用本機模擬伺服器）")
+    parser.add_argument('--iterations', type=int, default=5, help="每個情境的執行次數")
+    parser.add_argument('--output', default='url_expansion_benchmark.json', help="結果輸出檔案")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.iterations)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'iterations': args.iterations,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for strategy_name, strategy_results in results.items():
+        print(f"📊 {strategy_name}")
+        for scenario_name, metrics in strategy_results.items():
+            status = "✅" if metrics['accuracy'] == 1 else "❌"
+            print(f"  {status} {scenario_name:<18} p50 {metrics['p50_ms']:>8} ms  "
+                  f"讀取 {metrics['bytes_read_per_run']:>8} B  伺服器送出 {metrics['server_bytes_sent_per_run']:>8} B  "
+                  f"請求 {metrics['requests_per_run']}")
+    print(f"💾 結果已儲存到 {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
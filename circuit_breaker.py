@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenAI 呼叫的斷路器模組
+以最近 N 次呼叫的錯誤率與 p95 延遲判斷上游是否異常，異常時快速斷路（open），
+斷路期間的請求不再等待 OpenAI，由呼叫端立即改用本地規則的初步結果回覆。
+
+每次呼叫都在背景執行緒執行並設有延遲預算：超過預算時呼叫端先拿到 LatencyBudgetExceeded
+（可從 future 取得之後才完成的結果），不會讓 LINE 的 reply token 在等待中過期；
+晚到的結果仍會計入延遲統計。
+
+斷路一段時間後進入半開（half_open），放行一個試探請求，成功即恢復、失敗則再次斷路。
+
+斷路器只衡量上游：呼叫端指定的本地例外（ignored_exceptions，例如等待同時請求名額逾時）不計入，
+呼叫中以 exclude_from_latency() 回報的本地等待時間也不計入延遲。
+各用途的斷路器由 LLM 閘道（llm_gateway.LLMGateway）建立。
+"""
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from config import (
+    CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_MIN_CALLS, CIRCUIT_BREAKER_ERROR_RATE, CIRCUIT_BREAKER_P95_LATENCY,
+    CIRCUIT_BREAKER_OPEN_SECONDS, CIRCUIT_BREAKER_MAX_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# 目前執行緒在斷路器呼叫中累計的本地等待時間
+_local = threading.local()
+
+
+class CircuitOpenError(Exception):
+    """斷路中，請求未送出"""
+
+
+class LatencyBudgetExceeded(Exception):
+    """呼叫超過延遲預算；呼叫仍在背景執行，完成後的結果可從 future 取得"""
+
+    def __init__(self, name, budget, future):
+        super().__init__(f"{name} 呼叫超過延遲預算 {budget} 秒")
+        self.future = future
+
+
+def _percentile(values, percentile):
+    """計算百分位數（最近鄰法）"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+
+def exclude_from_latency(seconds):
+    """在斷路器呼叫中扣除本地等待（例如等待同時請求名額）的時間，不算進上游延遲"""
+    _local.excluded = getattr(_local, 'excluded', 0.0) + seconds
+
+
+class CircuitBreaker:
+    """依錯誤率與 p95 延遲斷路，並以延遲預算避免呼叫端被長時間卡住"""
+
+    def __init__(self, name, window=CIRCUIT_BREAKER_WINDOW, min_calls=CIRCUIT_BREAKER_MIN_CALLS,
+                 error_rate=CIRCUIT_BREAKER_ERROR_RATE, p95_latency=CIRCUIT_BREAKER_P95_LATENCY,
+                 open_seconds=CIRCUIT_BREAKER_OPEN_SECONDS, max_workers=CIRCUIT_BREAKER_MAX_WORKERS):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.p95_latency = p95_latency
+        self.open_seconds = open_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-breaker")
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=window)  # (是否成功, 延遲秒數)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {'calls': 0, 'failures': 0, 'ignored': 0, 'rejected': 0, 'budget_exceeded': 0, 'opened': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self):
+        """是否可以送出請求（半開時只放行一個試探請求）"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def _open(self, reason):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.stats['opened'] += 1
+        logger.warning(f"{self.name} 斷路器開啟：{reason}")
+
+    def record(self, success, latency):
+        """記錄一次呼叫的結果與延遲，必要時斷路或恢復"""
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['failures'] += not success
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success and latency < self.p95_latency:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"{self.name} 斷路器恢復")
+                else:
+                    self._open("試探請求失敗或過慢")
+                return
+            self._calls.append((success, latency))
+            if state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(not ok for ok, _ in self._calls)
+                p95 = _percentile([elapsed for _, elapsed in self._calls], 95)
+                if failures / len(self._calls) >= self.error_rate:
+                    self._open(f"錯誤率 {failures}/{len(self._calls)}")
+                elif p95 >= self.p95_latency:
+                    self._open(f"p95 延遲 {p95:.1f} 秒")
+
+    def _ignore(self):
+        """本地例外不計入統計；半開時釋出試探名額，讓下一個請求重新試探"""
+        with self._lock:
+            self.stats['ignored'] += 1
+            if self._current_state() == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _timed_call(self, func, args, kwargs, ignored_exceptions):
+        _local.excluded = 0.0
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except ignored_exceptions:
+            self._ignore()
+            raise
+        except Exception:
+            self.record(False, max(0.0, time.monotonic() - start - _local.excluded))
+            raise
+        self.record(True, max(0.0, time.monotonic() - start - _local.excluded))
+        return result
+
+    def call(self, func, *args, latency_budget=None, ignored_exceptions=(), **kwargs):
+        """
+        透過斷路器呼叫 func
+
+        Args:
+            latency_budget: 最多等待的秒數（None 表示等到完成）
+            ignored_exceptions: 不計入斷路器的本地例外類別（照常拋出）
+
+        Raises:
+            CircuitOpenError: 斷路中
+            LatencyBudgetExceeded: 超過延遲預算（呼叫仍在背景完成）
+            func 本身拋出的例外
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} 斷路中")
+        future = self._executor.submit(self._timed_call, func, args, kwargs, tuple(ignored_exceptions))
+        try:
+            return future.result(timeout=latency_budget)
+        except FutureTimeoutError:
+            with self._lock:
+                self.stats['budget_exceeded'] += 1
+            logger.warning(f"{self.name} 呼叫超過延遲預算 {latency_budget} 秒，先回覆初步結果")
+            raise LatencyBudgetExceeded(self.name, latency_budget, future)
+
+    def get_stats(self):
+        """取得斷路器狀態、近期錯誤率與 p95 延遲"""
+        with self._lock:
+            latencies = [elapsed for _, elapsed in self._calls]
+            return dict(
+                self.stats,
+                state=self._current_state(),
+                p95_threshold=self.p95_latency,
+                window_calls=len(self._calls),
+                window_error_rate=round(sum(not ok for ok, _ in self._calls) / len(self._calls), 4) if self._calls else 0.0,
+                window_p95_latency=round(_percentile(latencies, 95), 3) if latencies else 0.0,
+            )
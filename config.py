@@ -84,6 +84,8 @@ FRAUD_ANALYSIS_SYSTEM_PROMPT = """你是一位名為「防詐騙助手」的AI
 建議：（給出具體可行的防範建議，一定要用emoji符號（🚫🔍🌐🛡️💡⚠️等）代替數字編號。語言要像鄰居朋友在關心提醒一樣親切簡單。）
 新興手法：[是/否]"""
 
+# 提示詞一律以固定內容開頭、可變內容（使用者訊息、補充說明）放在最後，
+# 讓 OpenAI 的提示詞前綴快取可以重複使用；詐騙分析以 CHAT_SYSTEM_PROMPT 開頭
 CHAT_SYSTEM_PROMPT = """你是一位名為「防詐騙助手」的AI聊天機器人，專門幫助50-60歲的長輩防範詐騙。你的說話風格要：
 1. 非常簡單易懂，像鄰居朋友在聊天
 2. 用溫暖親切的語氣，不要太正式
@@ -92,16 +94,156 @@ CHAT_SYSTEM_PROMPT = """你是一位名為「防詐騙助手」的AI聊天機器
 5. 當用戶提到投資、轉帳、可疑訊息時，要特別關心並給出簡單明確的建議
 6. 回應要簡短，不要太長篇大論"""
 
+# 閒聊回覆沿用原本的「土豆」名稱，其餘內容與 CHAT_SYSTEM_PROMPT 相同
+CHAT_REPLY_SYSTEM_PROMPT = CHAT_SYSTEM_PROMPT.replace("「防詐騙助手」", "「土豆」", 1)
+
+# 文字詐騙分析：接在 CHAT_SYSTEM_PROMPT 之後的固定指示
+TEXT_ANALYSIS_INSTRUCTIONS = """
+現在請分析使用者傳來的訊息的詐騙風險。
+使用者內容中「補充說明」是系統提供的參考資訊（例如網址檢查結果），「訊息」區塊（--- 之間）才是要分析的內容。"""
+
+# 不使用結構化輸出時的固定回答格式
+TEXT_ANALYSIS_FREE_TEXT_FORMAT = """
+請按照以下固定格式回答，每一行都必須包含：
+
+風險等級：[極高/高/中高/中/低/極低/無風險]
+詐騙類型：[具體的詐騙類型，如：釣魚網站、假交友詐騙、投資詐騙等]
+說明：[用簡單易懂的話解釋為什麼有風險或沒有風險，像鄰居朋友在聊天的語氣，避免複雜術語]
+建議：[用emoji符號（🚫🔍🌐🛡️💡⚠️等）代替數字編號，給出簡單明確的防範建議]
+新興手法：[是/否]"""
+
+# 近似重複確認：只需回答是／否
+NEAR_DUPLICATE_CONFIRM_PROMPT = "使用者會提供先前判定過的詐騙訊息資訊與一則新訊息。請判斷新訊息是否屬於同一種詐騙手法，只回答「是」或「否」。"
+
 # ===== 檔案路徑配置 =====
 SAFE_DOMAINS_FILE = 'safe_domains.json'
 FRAUD_PREVENTION_GAME_QUESTIONS_FILE = 'fraud_detection_questions.json'
 FRAUD_TACTICS_FILE = 'fraud_tactics.json'
+BENIGN_MESSAGES_FILE = 'benign_messages.json'  # 一般訊息語料（本地風險評分門檻調整用）
+TEXT_CLASSIFIER_MODEL_FILE = os.environ.get('TEXT_CLASSIFIER_MODEL_FILE', 'fraud_text_classifier.npz')  # 詐騙文字分類模型
+TYPOSQUAT_TABLE_FILE = os.environ.get('TYPOSQUAT_TABLE_FILE', 'typosquat_permutations.json')  # 預先產生的變形網域查詢表
+BLOCKLIST_PATH = os.environ.get('BLOCKLIST_PATH', 'domain_blocklist.bin')  # 本地詐騙網域黑名單
 
 # ===== API 配置 =====
 FRAUD_ANALYSIS_MAX_TOKENS = 1000
+FRAUD_ANALYSIS_STRUCTURED_OUTPUT = os.environ.get('FRAUD_ANALYSIS_STRUCTURED_OUTPUT', 'true').lower() in ('1', 'true', 'yes')  # 文字與圖片分析使用 JSON Schema 結構化輸出
+FRAUD_ANALYSIS_STRUCTURED_MAX_TOKENS = 500  # 結構化輸出不含格式標籤，回應上限可以較低
+IMAGE_SINGLE_CALL_ANALYSIS = os.environ.get('IMAGE_SINGLE_CALL_ANALYSIS', 'true').lower() in ('1', 'true', 'yes')  # 截圖以一次 Vision 呼叫同時取得文字、QR 碼與判斷（需要結構化輸出）
+IMAGE_MAX_SIZE = 1024  # 送給 Vision 的圖片最長邊
+IMAGE_ENCODE_FORMAT = os.environ.get('IMAGE_ENCODE_FORMAT', 'JPEG')  # JPEG 或 WEBP
+IMAGE_ENCODE_QUALITY = int(os.environ.get('IMAGE_ENCODE_QUALITY', '85'))  # 截圖文字在 85 仍清楚，檔案約為 PNG 的四分之一
 CHAT_MAX_TOKENS = 500
 FRAUD_ANALYSIS_TEMPERATURE = 0.2
 CHAT_TEMPERATURE = 0.7
+FRAUD_ANALYSIS_PROMPT_VERSION = '2026-10-6'  # 詐騙分析提示詞版本，修改提示詞、模型參數或解析方式時必須更新（分析結果快取鍵的一部分）
+
+# 各用途的提示詞與回應 token 預算（提示詞預算不含圖片本身）
+TOKEN_BUDGETS = {
+    'text_analysis': {'prompt': 1500, 'completion': FRAUD_ANALYSIS_STRUCTURED_MAX_TOKENS},
+    'chat': {'prompt': 800, 'completion': CHAT_MAX_TOKENS},
+    'vision': {'prompt': 1200, 'completion': FRAUD_ANALYSIS_STRUCTURED_MAX_TOKENS},
+    'ocr': {'prompt': 300, 'completion': 600},
+    'screenshot': {'prompt': 1200, 'completion': 1100},  # 單次呼叫同時回傳文字、QR 碼與判斷
+}
+TOKEN_BUDGET_LONG_URL_LENGTH = 60  # 超出預算時，長於此長度的網址只保留主機名稱
+
+# OpenAI 連線：逾時與重試次數不宜過大，上游異常時改由斷路器快速回覆初步結果
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '20'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '1'))
+
+# LLM 閘道：所有 OpenAI 呼叫共用一個連線池；各用途的模型、逾時、回應 token 上限與同時請求上限
+OPENAI_VISION_MODEL = os.environ.get('OPENAI_VISION_MODEL', OPENAI_MODEL)  # 圖片分析與 OCR 使用的模型
+LLM_POOL_CONNECTIONS = int(os.environ.get('LLM_POOL_CONNECTIONS', '20'))  # 連線池最大連線數
+LLM_ROUTES = {
+    'text_analysis': {'model': OPENAI_MODEL, 'timeout': 20.0, 'max_tokens': TOKEN_BUDGETS['text_analysis']['completion'], 'concurrency': 8},
+    'near_duplicate_confirm': {'model': OPENAI_MODEL, 'timeout': 5.0, 'max_tokens': 2, 'concurrency': 4},
+    'chat': {'model': OPENAI_MODEL, 'timeout': 20.0, 'max_tokens': TOKEN_BUDGETS['chat']['completion'], 'concurrency': 4},
+    'vision': {'model': OPENAI_VISION_MODEL, 'timeout': 30.0, 'max_tokens': TOKEN_BUDGETS['vision']['completion'], 'concurrency': 4},
+    'ocr': {'model': OPENAI_VISION_MODEL, 'timeout': 20.0, 'max_tokens': TOKEN_BUDGETS['ocr']['completion'], 'concurrency': 4},
+    'screenshot': {'model': OPENAI_VISION_MODEL, 'timeout': 30.0, 'max_tokens': TOKEN_BUDGETS['screenshot']['completion'], 'concurrency': 4},
+}
+
+# OpenAI 斷路器：每個用途各自一個，最近 CIRCUIT_BREAKER_WINDOW 次呼叫的錯誤率或 p95 延遲超過門檻時斷路
+CIRCUIT_BREAKER_WINDOW = 20
+CIRCUIT_BREAKER_MIN_CALLS = 5  # 呼叫次數少於此值時不判斷
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+CIRCUIT_BREAKER_P95_LATENCY = 12.0  # 秒（未設定延遲預算的用途）
+CIRCUIT_BREAKER_P95_LATENCY_FACTOR = 1.2  # 各用途的 p95 門檻為其延遲預算的倍數（文字分析 12 秒、圖片 24 秒）
+CIRCUIT_BREAKER_OPEN_SECONDS = 30  # 斷路多久後放行試探請求
+CIRCUIT_BREAKER_MAX_WORKERS = 16  # 執行 OpenAI 呼叫的背景執行緒數
+# 各用途最多等待的秒數，超過時先回覆本地規則的初步結果
+CIRCUIT_BREAKER_LATENCY_BUDGETS = {
+    'text_analysis': 10.0,
+    'near_duplicate_confirm': 3.0,
+    'chat': 10.0,
+    'vision': 20.0,
+    'ocr': 10.0,
+    'screenshot': 20.0,
+}
+
+# 批次重新分析（python batch_reanalysis.py）：以 OpenAI Batch API 重新標註歷史回報
+BATCH_REANALYSIS_COLLECTIONS = {  # 集合 -> 訊息欄位
+    'fraud_reports': 'message',
+    'emerging_fraud_reports': 'user_message_description',
+}
+BATCH_REANALYSIS_DIR = os.environ.get('BATCH_REANALYSIS_DIR', os.path.join('temp_files', 'batch_reanalysis'))
+BATCH_REANALYSIS_MAX_REQUESTS = 50000  # Batch API 每個輸入檔的請求數上限
+BATCH_REANALYSIS_POLL_SECONDS = 60
+FIRESTORE_PAGE_SIZE = 500  # 串流讀取時每頁的文件數
+FIRESTORE_BATCH_WRITE_SIZE = 500  # Firestore 每次批次寫入最多 500 筆
+
+# 本地風險評分：分數明確偏高或偏低時不呼叫 OpenAI（門檻以 python local_risk_scorer.py 依標註語料調整）
+LOCAL_RISK_SCORING = os.environ.get('LOCAL_RISK_SCORING', 'true').lower() in ('1', 'true', 'yes')
+LOCAL_RISK_HIGH_THRESHOLD = 5.5  # 語料中一般訊息誤判為高風險約 1%
+LOCAL_RISK_LOW_THRESHOLD = -0.5  # 另需沒有任何加分特徵才判為低風險；語料中沒有詐騙訊息被誤判為低風險
+
+# 詐騙文字分類器（python fraud_text_classifier.py train 產生模型檔），作為本地風險評分的訊號之一
+TEXT_CLASSIFIER_FEATURES = 2 ** 14  # 雜湊特徵維度
+TEXT_CLASSIFIER_NGRAMS = (2, 3)  # 字元 n-gram 長度
+TEXT_CLASSIFIER_FRAUD_PROBABILITY = 0.9  # 詐騙機率高於此值時加分
+TEXT_CLASSIFIER_BENIGN_PROBABILITY = 0.1  # 詐騙機率低於此值時減分
+
+# ===== 快取配置 =====
+BLOCKLIST_FALSE_POSITIVE_RATE = 0.001  # 黑名單 Bloom filter 目標誤判率
+# 公開後綴（任何人都能在底下註冊網域）：黑名單比對包含上層網域，來源檔裡單獨出現時會封鎖整個後綴，建置時略過
+BLOCKLIST_PUBLIC_SUFFIXES = frozenset({
+    'com.tw', 'net.tw', 'org.tw', 'gov.tw', 'edu.tw', 'idv.tw', 'mil.tw', 'game.tw', 'ebiz.tw', 'club.tw',
+    'com.hk', 'net.hk', 'org.hk', 'gov.hk', 'edu.hk', 'com.cn', 'net.cn', 'org.cn', 'gov.cn',
+    'co.jp', 'ne.jp', 'or.jp', 'co.kr', 'co.uk', 'org.uk', 'com.au', 'com.sg', 'com.my', 'com.vn', 'com.ph',
+    'github.io', 'gitlab.io', 'blogspot.com', 'herokuapp.com', 'firebaseapp.com', 'web.app', 'pages.dev',
+    'workers.dev', 'netlify.app', 'vercel.app', 'azurewebsites.net', 'cloudfront.net', 'appspot.com',
+})
+SPOOF_VERDICT_CACHE_SIZE = int(os.environ.get('SPOOF_VERDICT_CACHE_SIZE', '10000'))  # 網域變形檢測結果快取筆數
+
+SHORT_URL_CACHE_SIZE = int(os.environ.get('SHORT_URL_CACHE_SIZE', '5000'))  # 短網址展開結果快取筆數
+SHORT_URL_CACHE_SUCCESS_TTL = 24 * 60 * 60  # 展開成功的結果保存 24 小時
+SHORT_URL_CACHE_FAILURE_TTL = 5 * 60  # 展開失敗的結果只保存 5 分鐘
+SHORT_URL_CACHE_FILE = os.environ.get('SHORT_URL_CACHE_FILE', '')  # 設定後將短網址快取保存到本機檔案
+SHORT_URL_CACHE_PERSIST_INTERVAL = 60  # 短網址快取寫入檔案的最短間隔（秒）
+
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', '2000'))  # 詐騙分析結果快取筆數
+ANALYSIS_CACHE_TTL = 6 * 60 * 60  # 詐騙分析結果保存 6 小時
+ANALYSIS_CACHE_SHARED = os.environ.get('ANALYSIS_CACHE_SHARED', '').lower() in ('1', 'true', 'yes')  # 以 Firestore 作為共用快取
+NEAR_DUPLICATE_INDEX_SIZE = int(os.environ.get('NEAR_DUPLICATE_INDEX_SIZE', '5000'))  # 近似重複索引收錄的訊息數
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', '6'))  # 視為近似重複的 SimHash 漢明距離上限（64 位元）
+NEAR_DUPLICATE_MIN_LENGTH = 20  # 遮蔽可變資訊後少於此字數的訊息不做近似比對
+NEAR_DUPLICATE_RISK_LEVELS = ['極高', '極高風險', '高', '高風險']  # 只沿用這些風險等級的判定結果
+NEAR_DUPLICATE_MODE = os.environ.get('NEAR_DUPLICATE_MODE', 'confirm')  # reuse: 直接沿用；confirm: 以確認提示詞確認後沿用；off: 停用
+SCREENSHOT_CACHE_SIZE = int(os.environ.get('SCREENSHOT_CACHE_SIZE', '1000'))  # 截圖分析結果快取筆數
+SCREENSHOT_HASH_SIZE = 16  # dHash 邊長（16 → 256 位元）
+SCREENSHOT_CACHE_MAX_DISTANCE = int(os.environ.get('SCREENSHOT_CACHE_MAX_DISTANCE', '30'))  # 視為同一張截圖的 dHash 漢明距離上限（256 位元）
+SCREENSHOT_CACHE_RISK_LEVELS = NEAR_DUPLICATE_RISK_LEVELS  # 只沿用這些風險等級的截圖判定結果
+
+# ===== 短網址展開配置 =====
+SHORT_URL_REQUEST_TIMEOUT = 5  # 單一短網址展開的連線逾時（秒）
+SHORT_URL_EXPANSION_DEADLINE = 8  # 同一則訊息所有短網址展開的總期限（秒）
+SHORT_URL_MAX_WORKERS = 8  # 同時展開短網址的最大連線數
+SHORT_URL_PER_HOST_LIMIT = 2  # 對同一個短網址服務的同時連線數上限
+SHORT_URL_MAX_REDIRECTS = 10  # 追蹤轉址的最大跳數
+SHORT_URL_MAX_BODY_BYTES = 64 * 1024  # 每一跳最多讀取的網頁位元組數
+SHORT_URL_MAX_CHAIN_BYTES = 256 * 1024  # 整條轉址鏈最多讀取的位元組數
+SHORT_URL_CHAIN_TIMEOUT = 8  # 整條轉址鏈的時間上限（秒）
+SHORT_URL_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 
 # ===== LINE 訊息限制 =====
 LINE_MESSAGE_MAX_LENGTH = 5000
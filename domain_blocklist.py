@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地詐騙網域黑名單模組
+已確認的詐騙網域（165 反詐騙專線匯出、使用者回報等）預先建置成二進位檔，
+以 Bloom filter 加上排序過的 8 位元組雜湊精確比對，透過 mmap 直接從磁碟讀取，
+不需要網路連線，查詢只需數微秒。
+
+建置黑名單：
+    python domain_blocklist.py ingest feed1.txt feed2.csv
+    python domain_blocklist.py ingest new_reports.txt --merge
+查詢：
+    python domain_blocklist.py check evil-shop.com
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse
+
+from config import BLOCKLIST_PATH, BLOCKLIST_FALSE_POSITIVE_RATE, BLOCKLIST_PUBLIC_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+# 檔案格式：標頭 | Bloom filter 位元陣列 | 排序過的 uint64 雜湊
+_MAGIC = b'DBLKLST1'
+_HEADER = struct.Struct('<8sQQQI4x')  # magic, Bloom 位元數, 網域筆數, 建置時間, 雜湊函數數量
+_HASH = struct.Struct('<Q')
+
+_DOMAIN_PATTERN = re.compile(r'^[a-z0-9]([a-z0-9-]*[a-z0-9])?(\.[a-z0-9]([a-z0-9-]*[a-z0-9])?)+$')
+# 檢查多久重新確認一次檔案是否更新（秒）
+_RELOAD_CHECK_INTERVAL = 60
+
+
+def normalize_domain(value):
+    """
+    將網址或網域標準化成小寫、移除www前綴的 ASCII 網域
+
+    Returns:
+        str 或 None: 無法解析成有效網域時返回 None
+    """
+    value = value.strip().lower()
+    if not value:
+        return None
+    if '://' in value:
+        value = urlparse(value).netloc
+    else:
+        value = value.split('/')[0]
+    value = value.split('@')[-1].split(':')[0].rstrip('.')
+    if value.startswith('www.'):
+        value = value[4:]
+
+    if not value.isascii():
+        try:
+            value = value.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+
+    if not _DOMAIN_PATTERN.match(value):
+        return None
+    return value
+
+
+def _domain_hash(domain):
+    """網域的 64 位元雜湊，同時作為精確比對鍵與 Bloom filter 的雜湊來源"""
+    return int.from_bytes(hashlib.blake2b(domain.encode('ascii'), digest_size=8).digest(), 'little')
+
+
+def _bloom_positions(key, num_bits, num_hashes):
+    """以雙重雜湊（低 32 位元與高 32 位元）計算 Bloom filter 的位元位置"""
+    low, step = key & 0xFFFFFFFF, (key >> 32) | 1
+    return [(low + i * step) % num_bits for i in range(num_hashes)]
+
+
+def _default_blocklist_path():
+    """取得黑名單預設路徑（相對於模組所在目錄）"""
+    if os.path.isabs(BLOCKLIST_PATH):
+        return BLOCKLIST_PATH
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), BLOCKLIST_PATH)
+
+
+def _candidate_domains(domain):
+    """網域本身與其上層網域（至少保留兩層），例如 a.b.evil.com -> a.b.evil.com, b.evil.com, evil.com"""
+    labels = domain.split('.')
+    return ['.'.join(labels[i:]) for i in range(len(labels) - 1)]
+
+
+class DomainBlocklist:
+    """mmap 黑名單查詢器"""
+
+    def __init__(self, path=None):
+        self.path = path or _default_blocklist_path()
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+        self._mtime = None
+        self._last_check = 0.0
+        self.num_bits = 0
+        self.num_entries = 0
+        self.num_hashes = 0
+        self.created_at = 0
+        self._bloom_offset = _HEADER.size
+        self._store_offset = _HEADER.size
+        self.lookups = 0
+        self.bloom_rejects = 0
+        self.hits = 0
+        self.bloom_false_positives = 0
+
+    def _open(self):
+        """開啟並 mmap 黑名單檔案，檔案不存在或格式錯誤時保持未載入狀態"""
+        self._close()
+        try:
+            self._mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._mtime = None
+            return False
+
+        try:
+            self._file = open(self.path, 'rb')
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, num_bits, num_entries, created_at, num_hashes = _HEADER.unpack_from(self._mm, 0)
+            if magic != _MAGIC:
+                raise ValueError("檔案標頭不正確")
+            bloom_bytes = _bloom_byte_length(num_bits)
+            if len(self._mm) < _HEADER.size + bloom_bytes + num_entries * _HASH.size:
+                raise ValueError("檔案長度不足")
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"載入詐騙網域黑名單失敗: {e}")
+            self._close()
+            return False
+
+        self.num_bits = num_bits
+        self.num_entries = num_entries
+        self.num_hashes = num_hashes
+        self.created_at = created_at
+        self._store_offset = _HEADER.size + bloom_bytes
+        logger.info(f"已載入詐騙網域黑名單 {self.path}：{num_entries} 筆")
+        return True
+
+    def _close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.num_entries = 0
+
+    def _ensure_loaded(self):
+        """第一次查詢時載入，之後定期檢查檔案是否已重新建置"""
+        now = time.time()
+        if now - self._last_check < _RELOAD_CHECK_INTERVAL:
+            return self._mm is not None
+
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if self._mm is None or mtime != self._mtime:
+            self._open()
+        return self._mm is not None
+
+    def reload(self):
+        """強制重新載入黑名單檔案"""
+        with self._lock:
+            self._last_check = time.time()
+            return self._open()
+
+    def _contains_normalized(self, domain):
+        """查詢已標準化的網域（需持有鎖且已載入）"""
+        key = _domain_hash(domain)
+        bloom_offset = self._bloom_offset
+        mm = self._mm
+        for position in _bloom_positions(key, self.num_bits, self.num_hashes):
+            if not mm[bloom_offset + (position >> 3)] & (1 << (position & 7)):
+                self.bloom_rejects += 1
+                return False
+
+        # Bloom filter 可能誤判，以排序雜湊做二分搜尋確認
+        low, high = 0, self.num_entries
+        store_offset = self._store_offset
+        while low < high:
+            mid = (low + high) // 2
+            value = _HASH.unpack_from(mm, store_offset + mid * _HASH.size)[0]
+            if value < key:
+                low = mid + 1
+            elif value > key:
+                high = mid
+            else:
+                return True
+        self.bloom_false_positives += 1
+        return False
+
+    def match_host(self, url_or_host):
+        """
+        檢查網址或網域（含其上層網域）是否在黑名單中
+
+        Returns:
+            str 或 None: 命中的黑名單網域
+        """
+        domain = normalize_domain(url_or_host)
+        if not domain:
+            return None
+
+        with self._lock:
+            if not self._ensure_loaded():
+                return None
+            self.lookups += 1
+            for candidate in _candidate_domains(domain):
+                if self._contains_normalized(candidate):
+                    self.hits += 1
+                    return candidate
+        return None
+
+    def find_blocklisted_url(self, urls):
+        """
+        找出第一個命中黑名單的網址
+
+        Returns:
+            dict 或 None: {'url': 原始網址, 'blocked_domain': 命中的黑名單網域}
+        """
+        for url in urls:
+            if not url:
+                continue
+            blocked_domain = self.match_host(url)
+            if blocked_domain:
+                return {'url': url, 'blocked_domain': blocked_domain}
+        return None
+
+    def get_stats(self):
+        """取得黑名單統計"""
+        with self._lock:
+            return {
+                'loaded': self._mm is not None,
+                'path': self.path,
+                'entries': self.num_entries,
+                'bloom_bits': self.num_bits,
+                'bloom_hashes': self.num_hashes,
+                'created_at': self.created_at,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'bloom_rejects': self.bloom_rejects,
+                'bloom_false_positives': self.bloom_false_positives,
+            }
+
+
+def _bloom_byte_length(num_bits):
+    """Bloom filter 位元陣列長度（對齊 8 位元組）"""
+    return ((num_bits + 63) // 64) * 8
+
+
+def read_hashes(path):
+    """讀取既有黑名單檔案的精確雜湊（用於合併新資料）"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, num_bits, num_entries, _, _ = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError(f"{path} 不是黑名單檔案")
+    offset = _HEADER.size + _bloom_byte_length(num_bits)
+    return {_HASH.unpack_from(data, offset + i * _HASH.size)[0] for i in range(num_entries)}
+
+
+def build_blocklist(domains, output_path, false_positive_rate=None, existing_hashes=None):
+    """
+    建置黑名單檔案
+
+    Args:
+        domains: 已標準化的網域可迭代物件
+        output_path: 輸出檔案路徑（先寫入暫存檔再取代，執行中的服務不會讀到一半的檔案）
+        false_positive_rate: Bloom filter 目標誤判率
+        existing_hashes: 要合併的既有精確雜湊
+
+    Returns:
+        int: 黑名單筆數
+    """
+    false_positive_rate = false_positive_rate or BLOCKLIST_FALSE_POSITIVE_RATE
+    hashes = set(existing_hashes or ())
+    hashes.update(_domain_hash(domain) for domain in domains)
+
+    num_entries = len(hashes)
+    num_bits = max(64, int(math.ceil(-num_entries * math.log(false_positive_rate) / (math.log(2) ** 2))))
+    num_hashes = max(1, int(round(num_bits / max(num_entries, 1) * math.log(2))))
+
+    bloom = bytearray(_bloom_byte_length(num_bits))
+    for key in hashes:
+        for position in _bloom_positions(key, num_bits, num_hashes):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, num_bits, num_entries, int(time.time()), num_hashes))
+        f.write(bloom)
+        for key in sorted(hashes):
+            f.write(_HASH.pack(key))
+    os.replace(temp_path, output_path)
+    return num_entries
+
+
+def iter_feed_domains(path):
+    """
+    逐行讀取黑名單來源檔（純文字或 CSV），產生標準化的網域
+
+    每行可以是網域或網址；CSV 取第一個能解析成網域的欄位；# 開頭為註解。
+    """
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for field in line.split(','):
+                domain = normalize_domain(field.strip().strip('"'))
+                if domain:
+                    yield domain
+                    break
+
+
+def load_whitelist_domains(path=None):
+    """載入 safe_domains.json 的標準化網域，建置時排除白名單網域及其子網域"""
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'safe_domains.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    whitelist = set()
+    for domains in data['safe_domains'].values():
+        if isinstance(domains, dict):
+            for domain in domains:
+                normalized = normalize_domain(domain)
+                if normalized:
+                    whitelist.add(normalized)
+    return whitelist
+
+
+def _is_whitelisted(domain, whitelist):
+    """網域本身或其上層網域在白名單中"""
+    return any(candidate in whitelist for candidate in _candidate_domains(domain))
+
+
+def ingest_feeds(feed_paths, output_path=None, merge=False, false_positive_rate=None, whitelist=None,
+                 public_suffixes=BLOCKLIST_PUBLIC_SUFFIXES):
+    """
+    匯入黑名單來源檔並建置黑名單
+
+    白名單網域（及其子網域）與單獨出現的公開後綴（例如 com.tw）不會寫入黑名單；
+    合併既有黑名單時，既有檔案中的這些項目也會一併移除。
+
+    Args:
+        feed_paths: 來源檔路徑列表
+        output_path: 輸出檔案（省略時使用設定檔的路徑）
+        merge: 是否與既有黑名單合併
+        false_positive_rate: Bloom filter 目標誤判率
+        whitelist: 要排除的白名單網域集合（省略時載入 safe_domains.json）
+        public_suffixes: 要排除的公開後綴集合
+
+    Returns:
+        dict: 匯入統計
+    """
+    output_path = output_path or _default_blocklist_path()
+    whitelist = load_whitelist_domains() if whitelist is None else whitelist
+
+    domains = set()
+    skipped_whitelisted = 0
+    skipped_public_suffixes = 0
+    for feed_path in feed_paths:
+        for domain in iter_feed_domains(feed_path):
+            if domain in public_suffixes:
+                skipped_public_suffixes += 1
+                continue
+            if _is_whitelisted(domain, whitelist):
+                skipped_whitelisted += 1
+                continue
+            domains.add(domain)
+
+    existing_hashes = None
+    if merge and os.path.exists(output_path):
+        existing_hashes = read_hashes(output_path)
+        existing_hashes -= {_domain_hash(domain) for domain in set(public_suffixes) | set(whitelist)}
+    total = build_blocklist(domains, output_path, false_positive_rate, existing_hashes)
+    return {
+        'ingested_domains': len(domains),
+        'skipped_whitelisted': skipped_whitelisted,
+        'skipped_public_suffixes': skipped_public_suffixes,
+        'total_entries': total,
+        'file_bytes': os.path.getsize(output_path),
+    }
+
+
+# 全域黑名單實例
+domain_blocklist = DomainBlocklist()
+
+
+def find_blocklisted_url(urls):
+    """找出第一個命中黑名單的網址的便捷函數"""
+    return domain_blocklist.find_blocklisted_url(urls)
+
+
+def get_blocklist_stats():
+    """取得黑名單統計的便捷函數"""
+    return domain_blocklist.get_stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地詐騙網域黑名單")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help="匯入來源檔並建置黑名單")
+    ingest_parser.add_argument('feeds', nargs='+', help="來源檔（每行一個網域或網址，或 CSV）")
+    ingest_parser.add_argument('--output', default=None, help="輸出檔案")
+    ingest_parser.add_argument('--merge', action='store_true', help="與既有黑名單合併")
+    ingest_parser.add_argument('--fp-rate', type=float, default=BLOCKLIST_FALSE_POSITIVE_RATE, help="Bloom filter 目標誤判率")
+
+    check_parser = subparsers.add_parser('check', help="查詢網域或網址")
+    check_parser.add_argument('hosts', nargs='+')
+    check_parser.add_argument('--blocklist', default=None, help="黑名單檔案")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        start = time.time()
+        stats = ingest_feeds(args.feeds, args.output, args.merge, args.fp_rate)
+        print(f"✅ 匯入 {stats['ingested_domains']} 個網域（略過白名單 {stats['skipped_whitelisted']} 個、"
+              f"公開後綴 {stats['skipped_public_suffixes']} 個），"
+              f"黑名單共 {stats['total_entries']} 筆，檔案 {stats['file_bytes'] / 1024:.1f} KB，"
+              f"耗時 {time.time() - start:.1f} 秒")
+        return 0
+
+    blocklist = DomainBlocklist(args.blocklist)
+    for host in args.hosts:
+        start = time.perf_counter()
+        blocked_domain = blocklist.match_host(host)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        status = f"🚨 命中黑名單（{blocked_domain}）" if blocked_domain else "✅ 不在黑名單"
+        print(f"{host}: {status}  {elapsed_us:.1f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
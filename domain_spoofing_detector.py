@@ -4,12 +4,344 @@
 """
 
 import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
 from urllib.parse import urlparse
 
+from config import SPOOF_VERDICT_CACHE_SIZE
+from typosquat_permutations import load_permutation_table
+
+logger = logging.getLogger(__name__)
+
+# 提取URL用的正則表達式（模組載入時編譯一次）
+_URL_PATTERN = re.compile(r'https?://[^\s]+|www\.[^\s]+|[a-zA-Z0-9][a-zA-Z0-9-]*\.[a-zA-Z]{2,}[^\s]*')
+
+
+class SpoofVerdictCache:
+    """
+    網域變形檢測結果的LRU快取
+    
+    以「標準化主機名稱」為鍵保存每個網域的檢測結果，並記錄白名單版本；
+    白名單內容改變（版本不同）時會自動清空，避免沿用舊白名單的判斷。
+    """
+    
+    def __init__(self, max_size: int = SPOOF_VERDICT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._registry_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _sync_version(self, registry_version):
+        """白名單版本改變時清空快取（呼叫前需持有鎖）"""
+        if registry_version != self._registry_version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"白名單版本改變，清空 {len(self._entries)} 筆網域檢測快取")
+            self._entries.clear()
+            self._registry_version = registry_version
+    
+    def get(self, host, registry_version):
+        """取得快取的檢測結果，沒有命中時返回 None"""
+        with self._lock:
+            self._sync_version(registry_version)
+            verdict = self._entries.get(host)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(host)
+            self.hits += 1
+            return verdict
+    
+    def put(self, host, registry_version, verdict):
+        """保存檢測結果，超過容量時淘汰最久未使用的項目"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._sync_version(registry_version)
+            self._entries[host] = verdict
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """清空快取（不重置統計數據）"""
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self):
+        """取得快取命中率等統計數據"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'registry_version': self._registry_version
+            }
+
+
+# 全域共用的檢測結果快取（文字分析與圖片分析共用）
+spoof_verdict_cache = SpoofVerdictCache()
+
+# 白名單版本快取：{id(safe_domains): (safe_domains, 長度, 版本)}
+# 保留字典本身的參考，避免物件被回收後 id 被重複使用
+_registry_versions = {}
+_registry_versions_lock = threading.Lock()
+
+
+def get_safe_domains_version(safe_domains):
+    """
+    計算白名單的內容版本（網域與說明的雜湊值）
+    
+    同一個字典物件只在長度改變時重新計算；若就地修改內容但長度不變，
+    請呼叫 invalidate_safe_domains_version() 強制重新計算。
+    """
+    key = id(safe_domains)
+    with _registry_versions_lock:
+        cached = _registry_versions.get(key)
+        if cached and cached[0] is safe_domains and cached[1] == len(safe_domains):
+            return cached[2]
+    
+    digest = hashlib.sha1()
+    for domain in sorted(safe_domains.keys(), key=str.lower):
+        digest.update(domain.lower().encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(str(safe_domains[domain]).encode('utf-8'))
+        digest.update(b'\x01')
+    version = digest.hexdigest()[:16]
+    
+    with _registry_versions_lock:
+        if len(_registry_versions) >= 16:
+            _registry_versions.clear()
+        _registry_versions[key] = (safe_domains, len(safe_domains), version)
+    return version
+
+
+def invalidate_safe_domains_version(safe_domains=None):
+    """清除白名單版本快取，下次檢測時重新計算版本"""
+    with _registry_versions_lock:
+        if safe_domains is None:
+            _registry_versions.clear()
+        else:
+            _registry_versions.pop(id(safe_domains), None)
+
+
+# 易混淆字元對應表（參考 Unicode UTS #39 confusables，只保留網域中常見的字元）
+# 每個易混淆字元對應到它所模仿的拉丁字母
+_CONFUSABLE_CHARS = {
+    # 數字與符號
+    '0': 'o', '1': 'l', '3': 'e', '5': 's', '6': 'b', '7': 't', '9': 'g',
+    '@': 'a', '$': 's', '!': 'i', '|': 'l',
+    # 希臘字母
+    'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'μ': 'm',
+    'ν': 'v', 'ο': 'o', 'ρ': 'p', 'τ': 't', 'υ': 'u', 'ω': 'w', 'χ': 'x',
+    'ζ': 'z', 'ϲ': 'c', 'ϳ': 'j',
+    # 西里爾字母
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'һ': 'h', 'і': 'i', 'ї': 'i',
+    'ј': 'j', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p', 'с': 'c',
+    'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w',
+    'ӏ': 'l', 'ɡ': 'g', 'ɩ': 'i', 'ı': 'i', 'ȷ': 'j',
+    # 其他拉丁變形（無法以分解去除附加符號者）
+    'ł': 'l', 'ø': 'o', 'ð': 'd', 'ħ': 'h', 'ƒ': 'f', 'ß': 'ss', 'æ': 'ae',
+    '©': 'c', '×': 'x',
+}
+
+# 多字元的視覺混淆（如 rn 看起來像 m）
+_CONFUSABLE_SEQUENCES = (('rn', 'm'), ('vv', 'w'), ('cl', 'd'))
+
+# 白名單索引快取：{白名單版本: _SafeDomainIndex}
+_safe_domain_indexes = {}
+_safe_domain_indexes_lock = threading.Lock()
+
+
+def _decode_idna_host(host):
+    """將 xn-- 開頭的 punycode 標籤解碼為 Unicode，解碼失敗時保留原樣"""
+    if 'xn--' not in host:
+        return host
+    labels = []
+    for label in host.split('.'):
+        if label.startswith('xn--'):
+            try:
+                label = label[4:].encode('ascii').decode('punycode')
+            except (UnicodeError, ValueError):
+                pass
+        labels.append(label)
+    return '.'.join(labels)
+
+
+def _confusable_skeleton(text):
+    """
+    計算字串的易混淆骨架（UTS #39 skeleton 的簡化版）
+    
+    先做相容分解並移除附加符號，再把易混淆字元換成它模仿的拉丁字母，
+    外觀相同的網域會得到相同的骨架。
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    chars = []
+    for char in decomposed:
+        if unicodedata.combining(char):
+            continue
+        chars.append(_CONFUSABLE_CHARS.get(char, char))
+    skeleton = ''.join(chars)
+    for sequence, replacement in _CONFUSABLE_SEQUENCES:
+        skeleton = skeleton.replace(sequence, replacement)
+    return skeleton
+
+
+class _SafeDomainIndex:
+    """
+    白名單的預先計算索引
+    
+    標準化網域集合、基礎網域對照與易混淆骨架只在白名單版本改變時建立一次，
+    所有網域檢測共用，不需要每個網址重新整理白名單。
+    """
+    
+    def __init__(self, safe_domains, registry_version):
+        self.safe_domains = safe_domains
+        self.registry_version = registry_version
+        # 標準化的安全網域集合（包含www和非www版本）
+        self.normalized = set()
+        # (原始網域, 小寫網域, 去除www的網域, 基礎網域名稱)
+        self.entries = []
+        # {基礎網域名稱: [entries 中的項目, ...]}
+        self.by_base = {}
+        # {骨架: [entries 中的項目, ...]}
+        self.by_skeleton = {}
+        # 預先產生的變形網域查詢表（由 typosquat_permutations 建置）
+        self.permutations = None
+        
+        for safe_domain in safe_domains.keys():
+            safe_domain_lower = safe_domain.lower()
+            safe_domain_without_www = safe_domain_lower[4:] if safe_domain_lower.startswith('www.') else safe_domain_lower
+            
+            self.normalized.add(safe_domain_lower)
+            if safe_domain_lower.startswith('www.'):
+                self.normalized.add(safe_domain_lower[4:])
+            else:
+                self.normalized.add('www.' + safe_domain_lower)
+            
+            # 處理 www 前綴：如果第一部分是 www，取第二部分作為基礎網域
+            safe_parts = safe_domain_lower.split('.')
+            safe_base = safe_parts[0]
+            if safe_base == 'www' and len(safe_parts) > 1:
+                safe_base = safe_parts[1]
+            
+            entry = (safe_domain, safe_domain_lower, safe_domain_without_www, safe_base)
+            self.entries.append(entry)
+            self.by_base.setdefault(safe_base, []).append(entry)
+            self.by_skeleton.setdefault(_confusable_skeleton(safe_domain_without_www), []).append(entry)
+    
+    def describe(self, safe_domain):
+        """取得白名單網域的說明"""
+        return self.safe_domains.get(safe_domain, "知名網站")
+
+
+def _get_safe_domain_index(safe_domains):
+    """取得（必要時建立）目前白名單版本的索引"""
+    registry_version = get_safe_domains_version(safe_domains)
+    with _safe_domain_indexes_lock:
+        index = _safe_domain_indexes.get(registry_version)
+    if index is not None:
+        return index
+    
+    index = _SafeDomainIndex(safe_domains, registry_version)
+    index.permutations = load_permutation_table(registry_version)
+    with _safe_domain_indexes_lock:
+        if len(_safe_domain_indexes) >= 4:
+            _safe_domain_indexes.clear()
+        _safe_domain_indexes[registry_version] = index
+    return index
+
+
+def _detect_homograph_spoofing(domain, domain_without_www, index):
+    """
+    以骨架索引檢測相似字元攻擊（含 punycode 國際化網域）
+    
+    Returns:
+        dict 或 None: 檢測到攻擊時返回檢測結果，否則返回 None
+    """
+    decoded_domain = _decode_idna_host(domain_without_www)
+    skeleton = _confusable_skeleton(decoded_domain)
+    
+    for safe_domain, _, safe_domain_without_www, _ in index.by_skeleton.get(skeleton, []):
+        if decoded_domain == safe_domain_without_www:
+            continue
+        
+        site_description = index.describe(safe_domain)
+        idn_note = ""
+        if decoded_domain != domain_without_www:
+            idn_note = f"\n\n這個網址實際顯示為「{decoded_domain}」，使用了外觀幾乎一樣的特殊文字，肉眼很難分辨。"
+        return {
+            'is_spoofed': True,
+            'original_domain': safe_domain,
+            'spoofed_domain': domain,
+            'spoofing_type': "相似字元攻擊",
+            'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {safe_domain} ({site_description})。{idn_note}\n\n詐騙集團常用這種手法製作假網站來騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
+        }
+    
+    return None
+
+
+def _extract_host(url):
+    """從網址或網域字串取出小寫的主機名稱，無法解析時返回空字串"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    try:
+        return urlparse(url).netloc.lower()
+    except Exception:
+        return ''
+
+
+def _get_host_verdict(domain, index):
+    """取得單一主機的檢測結果（優先使用快取），檢測失敗時返回 None"""
+    verdict = spoof_verdict_cache.get(domain, index.registry_version)
+    if verdict is None:
+        try:
+            verdict = _detect_host_spoofing(domain, index)
+        except Exception as e:
+            logger.debug(f"檢測網域 {domain} 時發生錯誤: {e}")
+            return None
+        spoof_verdict_cache.put(domain, index.registry_version, verdict)
+    return verdict
+
+
+def get_permutation_table_stats(safe_domains):
+    """取得目前白名單版本的變形網域查詢表統計，未載入查詢表時返回 None"""
+    index = _get_safe_domain_index(safe_domains)
+    if index.permutations is None:
+        return None
+    return index.permutations.get_stats()
+
+
+def get_spoof_cache_stats():
+    """取得網域變形檢測快取的統計數據"""
+    return spoof_verdict_cache.get_stats()
+
+
+def extract_urls(message):
+    """從訊息中提取所有可能的網址或網域字串"""
+    return _URL_PATTERN.findall(message)
+
+
 def detect_domain_spoofing(url_or_message, safe_domains):
     """
     檢測網域變形攻擊 - 識別模仿白名單網域的可疑網址
     
+    每個網域的檢測結果會以白名單版本為條件保存在 LRU 快取中，
+    重複出現的網域不需要重新計算。
+    
     Args:
         url_or_message: 要檢測的URL或包含URL的訊息
         safe_domains: 白名單網域字典
@@ -24,233 +356,248 @@ def detect_domain_spoofing(url_or_message, safe_domains):
         }
     """
     # 提取URL
-    url_pattern = re.compile(r'https?://[^\s]+|www\.[^\s]+|[a-zA-Z0-9][a-zA-Z0-9-]*\.[a-zA-Z]{2,}[^\s]*')
-    urls = url_pattern.findall(url_or_message)
+    urls = extract_urls(url_or_message)
     
     if not urls:
         return {'is_spoofed': False}
     
+    index = _get_safe_domain_index(safe_domains)
+    
     for url in urls:
-        # 標準化URL
-        if not url.startswith(('http://', 'https://')):
-            if url.startswith('www.'):
-                url = 'https://' + url
-            else:
-                url = 'https://' + url
+        domain = _extract_host(url)
+        if not domain:
+            # URL解析失敗，繼續檢查下一個
+            continue
         
-        try:
-            parsed = urlparse(url)
-            domain = parsed.netloc.lower()
-            
-            # 移除 www. 前綴進行比較
-            domain_without_www = domain[4:] if domain.startswith('www.') else domain
-            
-            # 🚨 新增：專門檢測政府網域變形攻擊
-            gov_spoofing_result = _detect_government_domain_spoofing(domain_without_www)
-            if gov_spoofing_result['is_spoofed']:
-                return gov_spoofing_result
-            
-            # 創建標準化的安全網域列表（包含www和非www版本）
-            normalized_safe_domains = set()
-            for safe_domain in safe_domains.keys():
-                safe_domain_lower = safe_domain.lower()
-                normalized_safe_domains.add(safe_domain_lower)
-                
-                # 添加www和非www版本
-                if safe_domain_lower.startswith('www.'):
-                    normalized_safe_domains.add(safe_domain_lower[4:])
-                else:
-                    normalized_safe_domains.add('www.' + safe_domain_lower)
-            
-            # 檢查是否本身就是白名單網域（包含www變體）
-            if domain in normalized_safe_domains or domain_without_www in normalized_safe_domains:
-                continue  # 這是正常的白名單網域，跳過
-            
-            # 🚨 新增：優先檢查基礎域名相似度（如 cht.tw 與 cht.com.tw）
-            domain_parts = domain_without_www.split('.')
-            base_domain = domain_parts[0]
-            
-            # 檢查是否有相同基礎域名的白名單網域
-            similar_domains = []
-            legitimate_variant_found = False
-            
-            for safe_domain in safe_domains.keys():
-                safe_domain_lower = safe_domain.lower()
-                safe_parts = safe_domain_lower.split('.')
-                safe_base = safe_parts[0]
-                
-                # 處理 www 前綴：如果第一部分是 www，取第二部分作為基礎網域
-                if safe_base == 'www' and len(safe_parts) > 1:
-                    safe_base = safe_parts[1]
-                
-                # 如果基礎域名相同，檢查是否為合法的變體
-                if base_domain == safe_base:
-                    # 檢查是否為合法的域名變體（如 cht.tw 是 cht.com.tw 的變體）
-                    if _is_legitimate_domain_variant(domain_without_www, safe_domain_lower):
-                        legitimate_variant_found = True
-                        continue  # 這是合法的域名變體，跳過
-                    else:
-                        # 基礎域名相同但不是合法變體，記錄為相似域名
-                        site_description = safe_domains.get(safe_domain, "知名網站")
-                        similar_domains.append({
-                            'domain': safe_domain,
-                            'description': site_description,
-                            'type': '基礎域名相同'
-                        })
-            
-            # 如果找到合法變體，跳過檢測
-            if legitimate_variant_found:
-                continue
-            
-            # 如果找到多個相似域名，提供多重警告
-            if len(similar_domains) > 0:
-                if len(similar_domains) == 1:
-                    # 單一相似域名
-                    similar_domain = similar_domains[0]
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': similar_domain['domain'],
-                        'spoofed_domain': domain,
-                        'spoofing_type': "基礎域名變形攻擊",
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {similar_domain['domain']} ({similar_domain['description']})。\n\n詐騙集團使用相同的基礎域名但不同的後綴來製作假網站。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
-                else:
-                    # 多重相似域名 - 限制最多顯示3個
-                    domain_list = []
-                    # 只取前3個相似域名
-                    for similar in similar_domains[:3]:
-                        domain_list.append(f"{similar['domain']}({similar['description']})")
-                    
-                    # 如果還有更多相似域名，添加提示
-                    if len(similar_domains) > 3:
-                        domain_list.append(f"...等共{len(similar_domains)}個相似網域")
-                    
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': 'multiple',
-                        'spoofed_domain': domain,
-                        'spoofing_type': "多重基礎域名變形攻擊",
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 可能模仿多個正牌網域：\n\n" + "\n".join([f"• {d}" for d in domain_list]) + f"\n\n這是個可疑的網域，詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
-            
-            # 快速檢測：特別檢查-tw和-taiwan後綴域名（高風險）
-            for safe_domain in safe_domains.keys():
-                safe_domain_lower = safe_domain.lower()
-                safe_parts = safe_domain_lower.split('.')
-                safe_base = safe_parts[0]
-                
-                # 處理 www 前綴：如果第一部分是 www，取第二部分作為基礎網域
-                if safe_base == 'www' and len(safe_parts) > 1:
-                    safe_base = safe_parts[1]
-                
-                # 檢查是否為基礎域名加上-tw或-taiwan（直接判定為高風險）
-                if base_domain == safe_base + '-tw' or base_domain == safe_base + '-taiwan':
-                    site_description = safe_domains.get(safe_domain, "知名網站")
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': safe_domain,
-                        'spoofed_domain': domain,
-                        'spoofing_type': "插入額外字元攻擊",
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {safe_domain} ({site_description})。\n\n詐騙集團常使用添加'-tw'或'-taiwan'字樣的手法製作假網站來騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
-                
-                # 新增：檢查明顯的網域名稱變形攻擊（如 fetc-nete 模仿 fetc）
-                # 檢查是否為基礎域名的變形（插入字元、替換字元等）
-                if _is_obvious_domain_spoofing(base_domain, safe_base):
-                    site_description = safe_domains.get(safe_domain, "知名網站")
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': safe_domain,
-                        'spoofed_domain': domain,
-                        'spoofing_type': "網域名稱變形攻擊",
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {safe_domain} ({site_description})。\n\n詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
-            
-            # 檢查每個白名單網域是否有相似性
-            similar_domains_advanced = []
+        verdict = _get_host_verdict(domain, index)
+        if verdict and verdict['is_spoofed']:
+            # 返回副本，避免呼叫端修改到快取內容
+            return dict(verdict)
+    
+    return {'is_spoofed': False}
+
+
+def detect_domain_spoofing_many(hosts, safe_domains):
+    """
+    批次檢測多個網域，返回每個網域的檢測結果（不會在第一個變形網域就停止）
+    
+    重複的網域只檢測一次，白名單索引與快取在整批檢測中共用。
+    
+    Args:
+        hosts: 網域或網址的可迭代物件
+        safe_domains: 白名單網域字典
+        
+    Returns:
+        dict: {標準化主機名稱: 檢測結果}，順序與第一次出現的順序相同；
+              無法解析的項目不會出現在結果中
+    """
+    index = _get_safe_domain_index(safe_domains)
+    verdicts = {}
+    
+    for host in hosts:
+        if not host:
+            continue
+        domain = _extract_host(host.strip())
+        if not domain or domain in verdicts:
+            continue
+        
+        verdict = _get_host_verdict(domain, index)
+        if verdict is not None:
+            verdicts[domain] = dict(verdict)
+    
+    return verdicts
+
+
+# 單一目標變形類型對應的風險說明
+_SPOOF_TYPE_NOTES = {
+    "基礎域名變形攻擊": "詐騙集團使用相同的基礎域名但不同的後綴來製作假網站。",
+    "插入額外字元攻擊": "詐騙集團常使用添加'-tw'或'-taiwan'字樣的手法製作假網站來騙取個人資料或信用卡資訊。",
+    "網域名稱變形攻擊": "詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。",
+    "字元替換": "詐騙集團常用這種手法製作假網站來騙取個人資料或信用卡資訊。",
+    "插入額外字元": "詐騙集團常用這種手法製作假網站來騙取個人資料或信用卡資訊。",
+}
+
+
+def _build_spoof_verdict(domain, safe_domain, site_description, spoofing_type):
+    """建立模仿單一白名單網域的檢測結果"""
+    note = _SPOOF_TYPE_NOTES[spoofing_type]
+    return {
+        'is_spoofed': True,
+        'original_domain': safe_domain,
+        'spoofed_domain': domain,
+        'spoofing_type': spoofing_type,
+        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {safe_domain} ({site_description})。\n\n{note}\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
+    }
+
+
+def _detect_host_spoofing(domain, index):
+    """
+    檢測單一主機名稱是否為網域變形攻擊
+    
+    Args:
+        domain: 小寫的主機名稱（可能包含 www. 前綴）
+        index: 白名單索引（_SafeDomainIndex）
+        
+    Returns:
+        dict: 與 detect_domain_spoofing 相同格式的檢測結果
+    """
+    if not domain:
+        return {'is_spoofed': False}
+    
+    # 移除 www. 前綴進行比較
+    domain_without_www = domain[4:] if domain.startswith('www.') else domain
+    
+    # 🚨 新增：專門檢測政府網域變形攻擊
+    gov_spoofing_result = _detect_government_domain_spoofing(domain_without_www)
+    if gov_spoofing_result['is_spoofed']:
+        return gov_spoofing_result
+    
+    # 檢查是否本身就是白名單網域（包含www變體）
+    if domain in index.normalized or domain_without_www in index.normalized:
+        return {'is_spoofed': False}  # 這是正常的白名單網域，跳過
+    
+    # 預先產生的常見變形網域：一次查表即可判定，不必進行模糊比對
+    if index.permutations is not None:
+        permutation_hit = index.permutations.lookup(domain_without_www)
+        if permutation_hit:
+            safe_domain, spoofing_type = permutation_hit
+            return _build_spoof_verdict(domain, safe_domain, index.describe(safe_domain), spoofing_type)
+    
+    # 相似字元攻擊：解碼 punycode 後以骨架索引一次查表
+    homograph_result = _detect_homograph_spoofing(domain, domain_without_www, index)
+    if homograph_result:
+        return homograph_result
+    
+    # 🚨 新增：優先檢查基礎域名相似度（如 cht.tw 與 cht.com.tw）
+    domain_parts = domain_without_www.split('.')
+    base_domain = domain_parts[0]
+    
+    # 檢查是否有相同基礎域名的白名單網域
+    similar_domains = []
+    legitimate_variant_found = False
+    
+    for safe_domain, safe_domain_lower, _, _ in index.by_base.get(base_domain, []):
+        # 基礎域名相同，檢查是否為合法的域名變體（如 cht.tw 是 cht.com.tw 的變體）
+        if _is_legitimate_domain_variant(domain_without_www, safe_domain_lower):
+            legitimate_variant_found = True
+            continue  # 這是合法的域名變體，跳過
+        else:
+            # 基礎域名相同但不是合法變體，記錄為相似域名
+            similar_domains.append({
+                'domain': safe_domain,
+                'description': index.describe(safe_domain),
+                'type': '基礎域名相同'
+            })
+    
+    # 如果找到合法變體，跳過檢測
+    if legitimate_variant_found:
+        return {'is_spoofed': False}
+    
+    # 如果找到多個相似域名，提供多重警告
+    if len(similar_domains) > 0:
+        if len(similar_domains) == 1:
+            # 單一相似域名
+            similar_domain = similar_domains[0]
+            return _build_spoof_verdict(domain, similar_domain['domain'], similar_domain['description'], "基礎域名變形攻擊")
+        else:
+            # 多重相似域名 - 限制最多顯示3個
+            domain_list = []
+            # 只取前3個相似域名
+            for similar in similar_domains[:3]:
+                domain_list.append(f"{similar['domain']}({similar['description']})")
             
-            for safe_domain in safe_domains.keys():
-                safe_domain_lower = safe_domain.lower()
-                safe_domain_without_www = safe_domain_lower[4:] if safe_domain_lower.startswith('www.') else safe_domain_lower
-                
-                # 跳過完全相同的網域（包含www變體）
-                if (domain == safe_domain_lower or 
-                    domain == safe_domain_without_www or 
-                    domain_without_www == safe_domain_lower or 
-                    domain_without_www == safe_domain_without_www):
-                    continue
-                
-                # 只檢測高相似度的變形（避免誤報）
-                # 需要域名長度相近（差距不超過2個字符）且有高度相似性
-                length_diff = abs(len(domain_without_www) - len(safe_domain_without_www))
-                if length_diff > 2:
-                    continue  # 長度差距太大，跳過
-                
-                # 額外檢查：網域名稱必須有足夠的相似性
-                if not _has_sufficient_similarity(domain_without_www, safe_domain_without_www):
-                    continue  # 相似度不足，跳過
-                
-                # 只檢測非常相似的網域
-                spoofing_detected = False
-                spoofing_type = ""
-                
-                # 1. 字元替換攻擊（只檢測1個字符的差異）
-                if _is_character_substitution(domain_without_www, safe_domain_without_www, max_substitutions=1):
-                    spoofing_detected = True
-                    spoofing_type = "字元替換"
-                
-                # 2. 插入額外字元（只檢測1個字符的插入）
-                elif _is_character_insertion(domain_without_www, safe_domain_without_www, max_insertions=1):
-                    spoofing_detected = True
-                    spoofing_type = "插入額外字元"
-                
-                # 3. 相似字元攻擊（國際化域名攻擊）
-                elif _is_homograph_attack(domain_without_www, safe_domain_without_www):
-                    spoofing_detected = True
-                    spoofing_type = "相似字元攻擊"
-                
-                if spoofing_detected:
-                    site_description = safe_domains.get(safe_domain, "知名網站")
-                    similar_domains_advanced.append({
-                        'domain': safe_domain,
-                        'description': site_description,
-                        'type': spoofing_type
-                    })
+            # 如果還有更多相似域名，添加提示
+            if len(similar_domains) > 3:
+                domain_list.append(f"...等共{len(similar_domains)}個相似網域")
             
-            # 如果找到多個相似域名，提供多重警告
-            if len(similar_domains_advanced) > 0:
-                if len(similar_domains_advanced) == 1:
-                    # 單一相似域名
-                    similar_domain = similar_domains_advanced[0]
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': similar_domain['domain'],
-                        'spoofed_domain': domain,
-                        'spoofing_type': similar_domain['type'],
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 疑似模仿正牌的 {similar_domain['domain']} ({similar_domain['description']})。\n\n詐騙集團常用這種手法製作假網站來騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
-                else:
-                    # 多重相似域名 - 限制最多顯示3個
-                    domain_list = []
-                    # 只取前3個相似域名
-                    for similar in similar_domains_advanced[:3]:
-                        domain_list.append(f"{similar['domain']}({similar['description']})")
-                    
-                    # 如果還有更多相似域名，添加提示
-                    if len(similar_domains_advanced) > 3:
-                        domain_list.append(f"...等共{len(similar_domains_advanced)}個相似網域")
-                    
-                    return {
-                        'is_spoofed': True,
-                        'original_domain': 'multiple',
-                        'spoofed_domain': domain,
-                        'spoofing_type': "多重變形攻擊",
-                        'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 可能模仿多個正牌網域：\n\n" + "\n".join([f"• {d}" for d in domain_list]) + f"\n\n這是個可疑的網域，詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
-                    }
+            return {
+                'is_spoofed': True,
+                'original_domain': 'multiple',
+                'spoofed_domain': domain,
+                'spoofing_type': "多重基礎域名變形攻擊",
+                'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 可能模仿多個正牌網域：\n\n" + "\n".join([f"• {d}" for d in domain_list]) + f"\n\n這是個可疑的網域，詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
+            }
+    
+    # 快速檢測：特別檢查-tw和-taiwan後綴域名（高風險）
+    for safe_domain, _, _, safe_base in index.entries:
+        # 檢查是否為基礎域名加上-tw或-taiwan（直接判定為高風險）
+        if base_domain == safe_base + '-tw' or base_domain == safe_base + '-taiwan':
+            return _build_spoof_verdict(domain, safe_domain, index.describe(safe_domain), "插入額外字元攻擊")
         
-        except Exception as e:
-            # URL解析失敗，繼續檢查下一個
+        # 新增：檢查明顯的網域名稱變形攻擊（如 fetc-nete 模仿 fetc）
+        # 檢查是否為基礎域名的變形（插入字元、替換字元等）
+        if _is_obvious_domain_spoofing(base_domain, safe_base):
+            return _build_spoof_verdict(domain, safe_domain, index.describe(safe_domain), "網域名稱變形攻擊")
+    
+    # 檢查每個白名單網域是否有相似性
+    similar_domains_advanced = []
+    
+    for safe_domain, safe_domain_lower, safe_domain_without_www, _ in index.entries:
+        # 跳過完全相同的網域（包含www變體）
+        if (domain == safe_domain_lower or 
+            domain == safe_domain_without_www or 
+            domain_without_www == safe_domain_lower or 
+            domain_without_www == safe_domain_without_www):
             continue
+        
+        # 只檢測高相似度的變形（避免誤報）
+        # 需要域名長度相近（差距不超過2個字符）且有高度相似性
+        length_diff = abs(len(domain_without_www) - len(safe_domain_without_www))
+        if length_diff > 2:
+            continue  # 長度差距太大，跳過
+        
+        # 額外檢查：網域名稱必須有足夠的相似性
+        if not _has_sufficient_similarity(domain_without_www, safe_domain_without_www):
+            continue  # 相似度不足，跳過
+        
+        # 只檢測非常相似的網域
+        spoofing_detected = False
+        spoofing_type = ""
+        
+        # 1. 字元替換攻擊（只檢測1個字符的差異）
+        if _is_character_substitution(domain_without_www, safe_domain_without_www, max_substitutions=1):
+            spoofing_detected = True
+            spoofing_type = "字元替換"
+        
+        # 2. 插入額外字元（只檢測1個字符的插入）
+        elif _is_character_insertion(domain_without_www, safe_domain_without_www, max_insertions=1):
+            spoofing_detected = True
+            spoofing_type = "插入額外字元"
+        
+        # 相似字元攻擊已在前面以骨架索引檢測
+        
+        if spoofing_detected:
+            site_description = index.describe(safe_domain)
+            similar_domains_advanced.append({
+                'domain': safe_domain,
+                'description': site_description,
+                'type': spoofing_type
+            })
+    
+    # 如果找到多個相似域名，提供多重警告
+    if len(similar_domains_advanced) > 0:
+        if len(similar_domains_advanced) == 1:
+            # 單一相似域名
+            similar_domain = similar_domains_advanced[0]
+            return _build_spoof_verdict(domain, similar_domain['domain'], similar_domain['description'], similar_domain['type'])
+        else:
+            # 多重相似域名 - 限制最多顯示3個
+            domain_list = []
+            # 只取前3個相似域名
+            for similar in similar_domains_advanced[:3]:
+                domain_list.append(f"{similar['domain']}({similar['description']})")
+            
+            # 如果還有更多相似域名，添加提示
+            if len(similar_domains_advanced) > 3:
+                domain_list.append(f"...等共{len(similar_domains_advanced)}個相似網域")
+            
+            return {
+                'is_spoofed': True,
+                'original_domain': 'multiple',
+                'spoofed_domain': domain,
+                'spoofing_type': "多重變形攻擊",
+                'risk_explanation': f"⚠️ 高風險警告！\n\n這個網址 {domain} 可能模仿多個正牌網域：\n\n" + "\n".join([f"• {d}" for d in domain_list]) + f"\n\n這是個可疑的網域，詐騙集團常用相似的網域名稱來混淆視聽，製作假網站騙取個人資料或信用卡資訊。\n\n🚨 千萬不要在這個網站輸入任何個人資料、密碼或信用卡號碼！"
+            }
     
     return {'is_spoofed': False}
 
@@ -491,55 +838,6 @@ def _is_domain_suffix_spoofing(suspicious_domain, safe_domain):
     
     return False
 
-def _is_homograph_attack(suspicious_domain, safe_domain):
-    """檢測同音字或相似字元攻擊 - 改進版"""
-    # 擴展的字元替換對應表
-    homograph_map = {
-        'o': ['0', 'ο', 'о', 'ø', 'ö', 'ò', 'ó', 'ô', 'õ'],  # 英文o及各種變形
-        'a': ['а', 'α', 'à', 'á', 'â', 'ã', 'ä', 'å', '@'],  # 英文a及各種變形
-        'e': ['е', 'ε', 'è', 'é', 'ê', 'ë', '3'],  # 英文e及各種變形
-        'i': ['1', 'l', 'і', 'ι', 'ì', 'í', 'î', 'ï', '!', '|'],  # 英文i及各種變形
-        'l': ['1', 'i', 'ι', '|', 'ł'],  # 英文l及各種變形
-        'n': ['η', 'ñ'],  # 英文n及各種變形
-        'p': ['ρ'],  # 英文p及各種變形
-        'c': ['с', 'ç', '©'],  # 英文c及各種變形
-        'x': ['х', '×'],  # 英文x及各種變形
-        'u': ['υ', 'ù', 'ú', 'û', 'ü'],  # 英文u及各種變形
-        's': ['$', '5', 'ş'],  # 英文s及各種變形
-        'g': ['9', 'ğ'],  # 英文g及各種變形
-        't': ['7', 'ţ'],  # 英文t及各種變形
-        'b': ['6', 'β'],  # 英文b及各種變形
-        'd': ['ð'],  # 英文d及各種變形
-        'f': ['ƒ'],  # 英文f及各種變形
-        'h': ['ħ'],  # 英文h及各種變形
-        'k': ['κ'],  # 英文k及各種變形
-        'm': ['μ'],  # 英文m及各種變形
-        'r': ['ρ', 'ř'],  # 英文r及各種變形
-        'v': ['ν'],  # 英文v及各種變形
-        'w': ['ω'],  # 英文w及各種變形
-        'y': ['ý', 'ÿ'],  # 英文y及各種變形
-        'z': ['ζ', 'ž'],  # 英文z及各種變形
-    }
-    
-    # 檢查每個字元是否被替換
-    if len(suspicious_domain) != len(safe_domain):
-        return False
-    
-    substitution_count = 0
-    for i, (sus_char, safe_char) in enumerate(zip(suspicious_domain, safe_domain)):
-        if sus_char != safe_char:
-            # 檢查是否為已知的相似字元替換
-            if safe_char.lower() in homograph_map:
-                if sus_char in homograph_map[safe_char.lower()]:
-                    substitution_count += 1
-                else:
-                    return False  # 不是已知的相似字元替換
-            else:
-                return False  # 字元不在替換表中
-    
-    # 如果有1-3個字元被替換，認為是相似字元攻擊
-    return 1 <= substitution_count <= 3
-
 def _is_obvious_domain_spoofing(suspicious_base, safe_base):
     """檢查明顯的網域名稱變形攻擊"""
     # 如果完全相同，不是變形攻擊
@@ -2,7 +2,7 @@ import os
 import json
 import logging
 import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator
 import firebase_admin
 from firebase_admin import credentials, firestore
 import random
@@ -266,6 +266,98 @@ class FirebaseManager:
             logger.error(f"獲取詐騙統計數據失敗: {e}")
             return {}
 
+    def get_fraud_report_messages(self, risk_levels=('極高', '高'), limit: int = 5000) -> List[Dict[str, Any]]:
+        """
+        獲取高風險的詐騙回報訊息（詐騙文字分類器訓練用）
+        
+        Args:
+            risk_levels: 要包含的風險等級
+            limit: 最大讀取記錄數
+            
+        Returns:
+            回報列表（message、fraud_type）
+        """
+        if not self.db:
+            logger.error("Firebase未初始化，無法獲取數據")
+            return []
+        
+        try:
+            query = (self.db.collection('fraud_reports')
+                    .order_by('timestamp', direction=firestore.Query.DESCENDING)
+                    .limit(limit))
+            
+            results = []
+            for doc in query.stream():
+                report = doc.to_dict()
+                message = report.get('message')
+                # 風險等級可能存成「高」或「高風險」
+                risk_level = (report.get('risk_level') or '').replace('風險', '')
+                if isinstance(message, str) and message.strip() and risk_level in risk_levels:
+                    results.append({'message': message, 'fraud_type': report.get('fraud_type', '')})
+            return results
+        
+        except Exception as e:
+            logger.error(f"獲取詐騙回報訊息失敗: {e}")
+            return []
+
+    def stream_collection(self, collection: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        逐頁串流讀取整個集合（依文件ID分頁，不會一次載入全部文件）
+        
+        Args:
+            collection: 集合名稱
+            page_size: 每頁讀取的文件數
+            
+        Returns:
+            文件資料的迭代器，每份文件包含ID
+        """
+        if not self.db:
+            logger.error("Firebase未初始化，無法讀取數據")
+            return
+        
+        last_doc = None
+        while True:
+            query = self.db.collection(collection).order_by('__name__').limit(page_size)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            docs = list(query.stream())
+            for doc in docs:
+                data = doc.to_dict()
+                data['id'] = doc.id
+                yield data
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def batch_update_documents(self, collection: str, updates: Dict[str, Dict[str, Any]], batch_size: int = 500) -> int:
+        """
+        以批次寫入更新多份文件
+        
+        Args:
+            collection: 集合名稱
+            updates: 文件ID -> 要更新的欄位
+            batch_size: 每批寫入的文件數（Firestore 上限為 500）
+            
+        Returns:
+            成功更新的文件數
+        """
+        if not self.db:
+            logger.error("Firebase未初始化，無法更新數據")
+            return 0
+        
+        items = list(updates.items())
+        written = 0
+        try:
+            for start in range(0, len(items), batch_size):
+                batch = self.db.batch()
+                for doc_id, data in items[start:start + batch_size]:
+                    batch.update(self.db.collection(collection).document(doc_id), data)
+                batch.commit()
+                written += len(items[start:start + batch_size])
+        except Exception as e:
+            logger.error(f"批次更新 {collection} 失敗（已更新 {written} 筆）: {e}")
+        return written
+
     def get_random_fraud_report_for_game(self) -> Optional[Dict[str, Any]]:
         """
         從 'fraud_reports' 隨機獲取一份報告用於遊戲題目
@@ -603,6 +695,39 @@ class FirebaseManager:
             logger.error(f"獲取用戶狀態失敗: {e}")
             return {}
     
+    def get_analysis_cache_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        獲取共用的詐騙分析結果快取項目
+        
+        Args:
+            key: 快取鍵
+            
+        Returns:
+            快取項目（result、raw_result、expires_at），不存在時返回None
+        """
+        if not self.db:
+            return None
+        
+        doc = self.db.collection('analysis_cache').document(key).get()
+        return doc.to_dict() if doc.exists else None
+    
+    def set_analysis_cache_entry(self, key: str, entry: Dict[str, Any]) -> bool:
+        """
+        保存共用的詐騙分析結果快取項目
+        
+        Args:
+            key: 快取鍵
+            entry: 快取項目（result、raw_result、expires_at）
+            
+        Returns:
+            操作是否成功
+        """
+        if not self.db:
+            return False
+        
+        self.db.collection('analysis_cache').document(key).set(dict(entry, updated_at=datetime.datetime.now()))
+        return True
+    
     def get_user_analysis_credits(self, user_id: str) -> int:
         """
         获取用户剩余的分析次数
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+詐騙文字分類器
+以字元 n-gram 的雜湊特徵訓練線性模型（邏輯迴歸），離線訓練後存成 .npz 陣列檔，
+啟動時載入，推論只需要 NumPy，單則訊息在 1 毫秒內就能算出詐騙機率與可能的詐騙類型。
+
+訓練資料：fraud_detection_questions.json 的詐騙訊息為正例，
+benign_messages.json 的一般訊息與題目中的防詐提醒為負例，
+可選擇加入 Firestore fraud_reports 中高風險的回報訊息。
+
+    python fraud_text_classifier.py train [--include-reports]
+    python fraud_text_classifier.py predict "訊息內容"
+
+未安裝 NumPy 或模型檔不存在時分類器不啟用，predict() 返回 None。
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import logging
+import argparse
+import threading
+
+from config import (
+    TEXT_CLASSIFIER_MODEL_FILE, TEXT_CLASSIFIER_FEATURES, TEXT_CLASSIFIER_NGRAMS,
+    FRAUD_PREVENTION_GAME_QUESTIONS_FILE
+)
+from analysis_cache import normalize_message, mask_entities
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # 選用套件
+    np = None
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 題目的 fraud_type 幾乎每題都不同，訓練前依關鍵字歸成較粗的類型（依序比對，都不符合時為「假冒機構詐騙」）
+_FRAUD_TYPE_GROUPS = [
+    ('投資詐騙', re.compile(r'投資|飆股|股票|理專|區塊鏈|虛擬|代操|養老')),
+    ('交友詐騙', re.compile(r'交友|軍官|軍醫|工程師|感情')),
+    ('假親友詐騙', re.compile(r'親友|子女|孫|同學|老友|親戚|鄰居')),
+    ('假檢警詐騙', re.compile(r'檢警|檢察|法院|警|洗錢')),
+    ('中獎詐騙', re.compile(r'中獎|彩券|抽籤|回饋|點數|獎勵|活動')),
+    ('網購詐騙', re.compile(r'網購|購物|代購|電商|蝦皮|一頁式|保健品|廣告')),
+    ('釣魚簡訊詐騙', re.compile(
+        r'Netflix|Google|Apple|Microsoft|LINE|Facebook|ETC|停車|郵局|宅配|物流|雲端|訂房|Agoda|航空|影音|送餐|Uber|求職|求才|釣魚|交友軟體|技術支援|客服',
+        re.I)),
+    ('假冒銀行詐騙', re.compile(r'銀行|信用卡|網銀|貸款|保險|金融|銀樓')),
+    ('假冒政府補助詐騙', re.compile(r'補助|福利|勞保|健保|衛福|國稅|稅務|公所|戶政|地政|社會局|里長|禮金|退休金|公家機關')),
+]
+_DEFAULT_FRAUD_TYPE = '假冒機構詐騙'
+
+
+def fraud_type_group(fraud_type):
+    """將題目的詳細詐騙類型歸成分類器使用的類型"""
+    for group, pattern in _FRAUD_TYPE_GROUPS:
+        if pattern.search(fraud_type or ''):
+            return group
+    return _DEFAULT_FRAUD_TYPE
+
+
+def extract_features(message, n_features=TEXT_CLASSIFIER_FEATURES, ngrams=TEXT_CLASSIFIER_NGRAMS):
+    """
+    計算訊息的雜湊字元 n-gram 特徵
+
+    先正規化並遮蔽電話、帳號、金額與網址，讓只換了這些內容的訊息得到相同的特徵。
+    特徵值為 1 + log(次數)，再做 L2 正規化。
+
+    Returns:
+        dict: {特徵索引: 特徵值}
+    """
+    text = mask_entities(normalize_message(message)).lower()
+    counts = {}
+    for n in ngrams:
+        for i in range(len(text) - n + 1):
+            index = zlib.crc32(text[i:i + n].encode('utf-8')) % n_features
+            counts[index] = counts.get(index, 0) + 1
+    if not counts:
+        return {}
+
+    values = {index: 1.0 + math.log(count) for index, count in counts.items()}
+    norm = sum(value * value for value in values.values()) ** 0.5
+    return {index: value / norm for index, value in values.items()}
+
+
+def _feature_matrix(messages, n_features, ngrams):
+    """將訊息列表轉成稠密特徵矩陣（僅供訓練使用）"""
+    matrix = np.zeros((len(messages), n_features), dtype=np.float32)
+    for row, message in enumerate(messages):
+        for index, value in extract_features(message, n_features, ngrams).items():
+            matrix[row, index] = value
+    return matrix
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def train_model(messages, labels, fraud_types, n_features=TEXT_CLASSIFIER_FEATURES, ngrams=TEXT_CLASSIFIER_NGRAMS,
+                epochs=300, learning_rate=2.0, l2=1e-4):
+    """
+    以批次梯度下降訓練模型
+
+    Args:
+        messages: 訊息列表
+        labels: 是否為詐騙（1 / 0）
+        fraud_types: 詐騙訊息的類型（一般訊息填 None）
+
+    Returns:
+        dict: 模型陣列（可直接以 np.savez_compressed 儲存）
+    """
+    X = _feature_matrix(messages, n_features, ngrams)
+    y = np.asarray(labels, dtype=np.float32)
+
+    # 詐騙 / 一般訊息：二元邏輯迴歸（依類別數量加權，避免偏向多數類別）
+    sample_weight = np.where(y == 1, 0.5 / max(y.sum(), 1), 0.5 / max((1 - y).sum(), 1)).astype(np.float32)
+    weights = np.zeros(n_features, dtype=np.float32)
+    bias = 0.0
+    for _ in range(epochs):
+        probability = 1.0 / (1.0 + np.exp(-(X @ weights + bias)))
+        error = (probability - y) * sample_weight
+        weights -= learning_rate * (X.T @ error + l2 * weights)
+        bias -= learning_rate * float(error.sum())
+
+    # 詐騙類型：只用詐騙訊息訓練多類別邏輯迴歸
+    fraud_rows = [i for i, label in enumerate(labels) if label]
+    type_labels = sorted({fraud_types[i] for i in fraud_rows})
+    X_fraud = X[fraud_rows]
+    Y = np.zeros((len(fraud_rows), len(type_labels)), dtype=np.float32)
+    for row, i in enumerate(fraud_rows):
+        Y[row, type_labels.index(fraud_types[i])] = 1.0
+    type_weights = np.zeros((len(type_labels), n_features), dtype=np.float32)
+    type_bias = np.zeros(len(type_labels), dtype=np.float32)
+    for _ in range(epochs):
+        error = (_softmax(X_fraud @ type_weights.T + type_bias) - Y) / len(fraud_rows)
+        type_weights -= learning_rate * (error.T @ X_fraud + l2 * type_weights)
+        type_bias -= learning_rate * error.sum(axis=0)
+
+    return {
+        'weights': weights,
+        'bias': np.float32(bias),
+        'type_weights': type_weights,
+        'type_bias': type_bias,
+        'type_labels': np.array(type_labels),
+        'ngrams': np.array(ngrams, dtype=np.int32),
+    }
+
+
+class FraudTextClassifier:
+    """載入離線訓練的模型並以 NumPy 推論"""
+
+    def __init__(self, model=None):
+        self._lock = threading.Lock()
+        self.predictions = 0
+        self.total_latency = 0.0
+        self.model = None
+        if model is not None:
+            self._set_model(model)
+
+    def _set_model(self, model):
+        self.model = model
+        self.weights = model['weights']
+        self.bias = float(model['bias'])
+        self.type_weights = model['type_weights']
+        self.type_bias = model['type_bias']
+        self.type_labels = [str(label) for label in model['type_labels']]
+        self.ngrams = tuple(int(n) for n in model['ngrams'])
+        self.n_features = len(self.weights)
+
+    @classmethod
+    def load(cls, path=None):
+        """從 .npz 檔載入模型；未安裝 NumPy 或檔案不存在時返回未啟用的分類器"""
+        classifier = cls()
+        path = path or os.path.join(_BASE_DIR, TEXT_CLASSIFIER_MODEL_FILE)
+        if np is None:
+            logger.info("未安裝 NumPy，詐騙文字分類器不啟用")
+            return classifier
+        if not os.path.exists(path):
+            logger.info(f"找不到詐騙文字分類模型 {path}，分類器不啟用")
+            return classifier
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                classifier._set_model({key: data[key] for key in data.files})
+            logger.info(f"已載入詐騙文字分類模型: {path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"載入詐騙文字分類模型失敗: {e}")
+        return classifier
+
+    @property
+    def available(self):
+        return self.model is not None
+
+    def predict(self, message):
+        """
+        預測訊息是詐騙的機率與可能的詐騙類型
+
+        Returns:
+            dict 或 None: {'fraud_probability', 'fraud_type', 'type_probability'}；分類器未啟用時返回 None
+        """
+        if self.model is None or not message:
+            return None
+        start = time.perf_counter()
+        features = extract_features(message, self.n_features, self.ngrams)
+        if features:
+            indices = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+            values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+            score = float(self.weights[indices] @ values) + self.bias
+            type_scores = self.type_weights[:, indices] @ values + self.type_bias
+        else:
+            score = self.bias
+            type_scores = self.type_bias
+        type_probabilities = _softmax(type_scores)
+        best = int(type_probabilities.argmax())
+        result = {
+            'fraud_probability': round(1.0 / (1.0 + float(np.exp(-score))), 4),
+            'fraud_type': self.type_labels[best],
+            'type_probability': round(float(type_probabilities[best]), 4),
+        }
+        with self._lock:
+            self.predictions += 1
+            self.total_latency += time.perf_counter() - start
+        return result
+
+    def get_stats(self):
+        """取得分類器狀態與平均推論時間"""
+        with self._lock:
+            return {
+                'available': self.available,
+                'n_features': self.n_features if self.available else 0,
+                'fraud_types': self.type_labels if self.available else [],
+                'predictions': self.predictions,
+                'avg_latency_ms': round(self.total_latency / self.predictions * 1000, 4) if self.predictions else 0.0,
+            }
+
+
+def load_training_data(include_reports=False):
+    """
+    載入訓練資料
+
+    Returns:
+        tuple: (訊息列表, 標籤列表, 詐騙類型列表)
+    """
+    from local_risk_scorer import load_labeled_corpus
+
+    with open(os.path.join(_BASE_DIR, FRAUD_PREVENTION_GAME_QUESTIONS_FILE), 'r', encoding='utf-8') as f:
+        questions = [q for q in json.load(f)['questions'] if isinstance(q, dict)]
+    fraud = [(q['fraud_message'], fraud_type_group(q['fraud_type'])) for q in questions]
+
+    if include_reports:
+        from firebase_manager import FirebaseManager
+        reports = FirebaseManager.get_instance().get_fraud_report_messages()
+        fraud.extend((report['message'], fraud_type_group(report['fraud_type'])) for report in reports)
+        logger.info(f"加入 {len(reports)} 則高風險回報訊息")
+
+    _, benign = load_labeled_corpus()
+    messages = [message for message, _ in fraud] + benign
+    labels = [1] * len(fraud) + [0] * len(benign)
+    fraud_types = [fraud_type for _, fraud_type in fraud] + [None] * len(benign)
+    return messages, labels, fraud_types
+
+
+def cross_validate(messages, labels, fraud_types, folds=5, **train_kwargs):
+    """
+    交叉驗證：每則訊息的詐騙機率都由沒看過它的模型算出
+
+    Returns:
+        list: 每則訊息的 predict() 結果
+    """
+    predictions = [None] * len(messages)
+    for fold in range(folds):
+        train_rows = [i for i in range(len(messages)) if i % folds != fold]
+        classifier = FraudTextClassifier(train_model(
+            [messages[i] for i in train_rows], [labels[i] for i in train_rows],
+            [fraud_types[i] for i in train_rows], **train_kwargs
+        ))
+        for i in range(fold, len(messages), folds):
+            predictions[i] = classifier.predict(messages[i])
+    return predictions
+
+
+def main(argv=None):
+    """訓練或試用詐騙文字分類器"""
+    parser = argparse.ArgumentParser(description="詐騙文字分類器")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help="以標註語料訓練模型")
+    train_parser.add_argument('--output', default=os.path.join(_BASE_DIR, TEXT_CLASSIFIER_MODEL_FILE))
+    train_parser.add_argument('--include-reports', action='store_true', help="加入 Firestore 中高風險的回報訊息")
+    train_parser.add_argument('--folds', type=int, default=5, help="交叉驗證折數（0 表示不驗證）")
+    predict_parser = subparsers.add_parser('predict', help="預測訊息")
+    predict_parser.add_argument('message')
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("❌ 需要安裝 NumPy")
+        return 1
+
+    if args.command == 'predict':
+        classifier = FraudTextClassifier.load()
+        print(json.dumps(classifier.predict(args.message), ensure_ascii=False))
+        return 0
+
+    messages, labels, fraud_types = load_training_data(args.include_reports)
+    print(f"📚 訓練資料：詐騙 {sum(labels)} 則，一般訊息與防詐提醒 {len(labels) - sum(labels)} 則")
+    if args.folds:
+        predictions = cross_validate(messages, labels, fraud_types, args.folds)
+        correct = sum((p['fraud_probability'] >= 0.5) == bool(label) for p, label in zip(predictions, labels))
+        type_correct = sum(p['fraud_type'] == t for p, t in zip(predictions, fraud_types) if t)
+        print(f"📊 {args.folds} 折交叉驗證：準確率 {correct / len(labels):.3f}，"
+              f"詐騙類型準確率 {type_correct / sum(labels):.3f}")
+
+    model = train_model(messages, labels, fraud_types)
+    np.savez_compressed(args.output, **model)
+    classifier = FraudTextClassifier.load(args.output)
+    for message in messages[:200]:
+        classifier.predict(message)
+    print(f"💾 已儲存模型 {args.output}（{os.path.getsize(args.output) / 1024:.1f} KB），"
+          f"平均推論時間 {classifier.get_stats()['avg_latency_ms']} ms")
+    return 0
+
+
+# 全域詐騙文字分類器（啟動時載入模型）
+fraud_text_classifier = FraudTextClassifier.load()
+
+
+def get_text_classifier_stats():
+    """取得詐騙文字分類器統計"""
+    return fraud_text_classifier.get_stats()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,12 +10,21 @@ import logging
 import re
 import requests
 from typing import Dict, List, Optional, Any, Tuple
-import base64
-from io import BytesIO
-from PIL import Image
-from openai import OpenAI
+from openai import BadRequestError
 from dotenv import load_dotenv
 
+from config import FRAUD_ANALYSIS_STRUCTURED_OUTPUT
+from circuit_breaker import CircuitOpenError, LatencyBudgetExceeded
+from llm_gateway import llm_gateway
+from local_risk_scorer import local_risk_scorer, PRELIMINARY_RESULT_MARKER
+from qr_decoder import qr_decoder
+from image_preprocessor import prepare_image
+from token_budget import token_budget
+from structured_analysis import (
+    IMAGE_ANALYSIS_FIELDS, IMAGE_ANALYSIS_SCHEMA, SCREENSHOT_ANALYSIS_FIELDS, SCREENSHOT_ANALYSIS_SCHEMA,
+    build_response_format, parse_structured_analysis
+)
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -34,38 +43,23 @@ ANALYSIS_TYPES = {
 class ImageAnalysisService:
     """圖片分析服務類"""
     
-    def __init__(self):
-        """初始化圖片分析服務"""
-        self.openai_api_key = os.environ.get("OPENAI_API_KEY")
-        self.client = None
-        
-        if self.openai_api_key:
-            try:
-                self.client = OpenAI(
-                    api_key=self.openai_api_key,
-                    timeout=30.0,  # 設置超時
-                    max_retries=3   # 設置重試次數
-                )
-                logger.info("OpenAI API 初始化成功")
-            except Exception as e:
-                logger.error(f"OpenAI API 初始化失敗: {e}")
-                self.client = None
-        else:
-            logger.warning("OpenAI API 初始化失敗：缺少 API 金鑰")
+    def __init__(self, gateway=None):
+        """初始化圖片分析服務（OpenAI 呼叫都經過 LLM 閘道）"""
+        self.gateway = gateway or llm_gateway
     
     def analyze_image(self, image_content: bytes, analysis_type: str = "GENERAL", context_message: str = "") -> Dict:
         """
         分析圖片，檢測詐騙相關內容
         
         Args:
-            image_content: 圖片二進制內容
+            image_content: 圖片二進制內容，或 prepare_image() 前處理過的圖片
             analysis_type: 分析類型，可選：GENERAL, PHISHING, DOCUMENT, SOCIAL_MEDIA
             context_message: 用戶提供的上下文信息
             
         Returns:
             Dict: 分析結果
         """
-        if not self.client:
+        if not self.gateway.available:
             return {
                 "success": False,
                 "message": "OpenAI API 未初始化，無法分析圖片",
@@ -76,42 +70,34 @@ class ImageAnalysisService:
             }
         
         try:
-            # 將圖片轉換為 base64 編碼
-            image = Image.open(BytesIO(image_content))
-            # 壓縮圖片以減少API請求大小
-            image = self._resize_image_if_needed(image)
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            
-            # 根據分析類型選擇提示語
-            prompt = self._get_analysis_prompt(analysis_type, context_message)
-            
-            # 調用 OpenAI API 進行圖片分析
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "請分析這張圖片是否含有詐騙內容？" + (f"\n用戶提供的上下文: {context_message}" if context_message else "")},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            }
-                        ]
+            # 解碼、縮小並編碼一次（已前處理過的圖片直接沿用）
+            prepared = prepare_image(image_content)
+            
+            # 用戶提供的上下文過長時壓縮或截斷，讓提示語不超過預算
+            if context_message:
+                context_message = token_budget.fit(
+                    "vision", context_message, fixed_prompt=self._get_analysis_prompt(analysis_type, context_message)
+                )
+            user_content = [
+                {"type": "text", "text": "請分析這張圖片是否含有詐騙內容？" + (f"\n用戶提供的上下文: {context_message}" if context_message else "")},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": prepared.data_url
                     }
-                ],
-                max_tokens=1200
-            )
+                }
+            ]
             
-            result = response.choices[0].message.content
+            # OpenAI 斷路中或超過延遲預算時，先回覆初步結果
+            try:
+                response = self.gateway.call(
+                    "vision", self._request_image_analysis, analysis_type, context_message, user_content
+                )
+            except (CircuitOpenError, LatencyBudgetExceeded) as e:
+                logger.warning(f"圖片分析暫時無法完成，回覆初步結果: {e}")
+                return self._create_preliminary_result(context_message, e)
+            
+            result = response.choices[0].message.content or ""
             logger.info(f"圖片分析結果 (部分): {result[:100]}...")
             
             # 解析分析結果
@@ -135,6 +121,145 @@ class ImageAnalysisService:
                 "suggestions": "建議您手動檢查此圖片是否存在可疑內容。"
             }
     
+    def _request_image_analysis(self, analysis_type: str, context_message: str, user_content: List) -> Any:
+        """
+        呼叫 OpenAI 分析圖片，優先使用結構化輸出
+
+        Returns:
+            OpenAI 回應
+        """
+        if FRAUD_ANALYSIS_STRUCTURED_OUTPUT:
+            try:
+                return self.gateway.complete(
+                    "vision",
+                    [
+                        {"role": "system", "content": self._get_analysis_prompt(analysis_type, context_message, structured=True)},
+                        {"role": "user", "content": user_content}
+                    ],
+                    response_format=build_response_format("image_fraud_analysis", IMAGE_ANALYSIS_SCHEMA)
+                )
+            except BadRequestError as e:
+                logger.warning(f"圖片分析結構化輸出請求失敗，改用文字格式: {e}")
+        
+        return self.gateway.complete(
+            "vision",
+            [
+                {"role": "system", "content": self._get_analysis_prompt(analysis_type, context_message)},
+                {"role": "user", "content": user_content}
+            ],
+            max_tokens=1200
+        )
+    
+    def _create_preliminary_result(self, context_message: str, reason: Exception) -> Dict:
+        """
+        OpenAI 暫時無法使用時的初步結果：有用戶提供的文字時以本地規則評分，否則標示為無法判定
+        """
+        if context_message:
+            result = local_risk_scorer.build_preliminary_result(local_risk_scorer.score(context_message))
+        else:
+            result = {
+                "risk_level": "無法判定",
+                "fraud_type": "未知",
+                "explanation": f"{PRELIMINARY_RESULT_MARKER}\n目前無法看懂圖片內容，請先不要依照圖片裡的指示轉帳、掃碼或提供資料。",
+                "suggestions": "🔍 不確定的話先問家人或撥165查證\n⏳ 稍後再傳一次圖片取得完整分析",
+                "is_preliminary": True
+            }
+        return {
+            "success": True,
+            "message": "初步結果",
+            "raw_result": f"初步結果：{reason}",
+            **result
+        }
+    
+    def analyze_screenshot(self, image_content: bytes, analysis_type: str = "GENERAL", context_message: str = "") -> Optional[Dict]:
+        """
+        以一次 Vision 呼叫同時取得圖片文字、QR 碼資訊與詐騙判斷（取代 OCR、QR 碼、圖片分析三次呼叫）
+        
+        Args:
+            image_content: 圖片二進制內容，或 prepare_image() 前處理過的圖片
+            analysis_type: 分析類型
+            context_message: 用戶提供的上下文信息
+            
+        Returns:
+            Dict 或 None: 與 analyze_image 相同欄位的分析結果，另含 extracted_text 與 qr_result
+            （欄位與 detect_qr_code 相同）；未啟用結構化輸出、模型不支援或回應無法解析時返回 None，
+            由呼叫端改用分開的三次呼叫
+        """
+        if not (FRAUD_ANALYSIS_STRUCTURED_OUTPUT and self.gateway.available):
+            return None
+        
+        try:
+            prepared = prepare_image(image_content)
+            
+            system_prompt = self._get_screenshot_prompt(analysis_type)
+            if context_message:
+                context_message = token_budget.fit("screenshot", context_message, fixed_prompt=system_prompt)
+            user_content = [
+                {"type": "text", "text": "請抄錄並分析這張圖片是否含有詐騙內容？" + (f"\n用戶提供的上下文: {context_message}" if context_message else "")},
+                {"type": "image_url", "image_url": {"url": prepared.data_url}}
+            ]
+            
+            try:
+                response = self.gateway.hedged_complete(
+                    "screenshot",
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_content}
+                    ],
+                    response_format=build_response_format("screenshot_fraud_analysis", SCREENSHOT_ANALYSIS_SCHEMA)
+                )
+            except (CircuitOpenError, LatencyBudgetExceeded) as e:
+                logger.warning(f"截圖分析暫時無法完成，回覆初步結果: {e}")
+                result = self._create_preliminary_result(context_message, e)
+                result["extracted_text"] = ""
+                result["qr_result"] = {"success": False, "contains_qr_code": False, "risk_level": "無法判定"}
+                return result
+            
+            result = response.choices[0].message.content or ""
+            screenshot = parse_structured_analysis(result, SCREENSHOT_ANALYSIS_FIELDS)
+            if screenshot is None:
+                logger.warning("截圖分析結果無法解析，改用分開的呼叫")
+                return None
+            logger.info(f"截圖分析結果 (部分): {result[:100]}...")
+            
+            return {
+                "success": True,
+                "message": "圖片分析完成",
+                "raw_result": result,
+                **self._parse_analysis_result(result),
+                "extracted_text": screenshot["extracted_text"],
+                "qr_result": {
+                    "success": True,
+                    "contains_qr_code": bool(screenshot["contains_qr_code"]),
+                    "content": screenshot["qr_content"],
+                    "risk_level": screenshot["qr_risk_level"],
+                    "explanation": screenshot["qr_content"],
+                },
+            }
+        
+        except BadRequestError as e:
+            logger.warning(f"截圖單次分析請求失敗，改用分開的呼叫: {e}")
+            return None
+        except Exception as e:
+            logger.exception(f"截圖分析時發生錯誤: {e}")
+            return {
+                "success": False,
+                "message": f"分析圖片時發生錯誤: {str(e)}",
+                "risk_level": "無法判定",
+                "fraud_type": "未知",
+                "explanation": "處理圖片時發生技術錯誤。",
+                "suggestions": "建議您手動檢查此圖片是否存在可疑內容。",
+                "extracted_text": "",
+                "qr_result": {"success": False, "contains_qr_code": False, "risk_level": "無法判定"}
+            }
+    
+    def _get_screenshot_prompt(self, analysis_type: str) -> str:
+        """截圖單次分析的系統提示（圖片分析提示語加上文字抄錄與 QR 碼的要求）"""
+        return self._get_analysis_prompt(analysis_type, "", structured=True) + """
+另外請完整抄錄圖片中的所有文字（text 欄位，保持原始排列），
+並說明圖片中是否有 QR 碼或條碼、看得出的內容或用途，以及從詐騙風險角度的可疑程度（qr、qr_content、qr_risk 欄位）。
+"""
+    
     def analyze_image_from_url(self, image_url: str, analysis_type: str = "GENERAL", context_message: str = "") -> Dict:
         """
         從URL下載並分析圖片
@@ -294,52 +419,32 @@ class ImageAnalysisService:
             logger.error(f"處理圖片URL時發生錯誤: {e}")
             return image_url
     
-    def _resize_image_if_needed(self, image: Image.Image, max_size: int = 1024) -> Image.Image:
-        """
-        如果圖片太大，調整其大小以減少API請求大小
-        
-        Args:
-            image: PIL圖片對象
-            max_size: 最大寬度或高度
-            
-        Returns:
-            Image.Image: 調整大小後的圖片
-        """
-        width, height = image.size
-        
-        if width <= max_size and height <= max_size:
-            return image
-        
-        # 計算新尺寸，保持原始寬高比
-        if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
-        else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
-        
-        # 調整圖片大小
-        return image.resize((new_width, new_height), Image.LANCZOS)
-    
-    def _get_analysis_prompt(self, analysis_type: str, context_message: str) -> str:
+    def _get_analysis_prompt(self, analysis_type: str, context_message: str, structured: bool = False) -> str:
         """
         根據分析類型獲取適當的提示語
         
         Args:
             analysis_type: 分析類型
             context_message: 用戶提供的上下文信息
+            structured: 是否使用結構化輸出（欄位格式由 JSON Schema 規定，提示語不再重複）
             
         Returns:
-            str: 適合該分析類型的提示語
+            str: 適合該分析類型的提示語（共用的固定內容在前，依類型與輸出方式不同的部分在後，以利提示詞前綴快取）
         """
-        base_prompt = """你是一位專門幫助50-60歲中老年人識別詐騙的AI助手，專注於分析圖片中可能的詐騙風險。
-
-請仔細分析圖片中的文字內容、視覺元素和整體設計，然後按照以下固定格式回答：
+        if structured:
+            output_format = "\n請依指定的 JSON 欄位回答。\n"
+        else:
+            output_format = """
+請按照以下固定格式回答：
 
 風險等級：[極高/高/中高/中/低/極低/無風險]
 詐騙類型：[具體的詐騙類型，如：釣魚網站、假交友詐騙、投資詐騙等]
 分析說明：[針對圖片中實際識別到的內容進行分析，用40字以內單句解釋為什麼要小心，像鄰居朋友在聊天的語氣，避免技術術語]
 土豆建議：[用emoji符號（🚫🔍🌐🛡️💡⚠️等）開頭，給出3個以內的簡單明確防範建議]
+"""
+        base_prompt = """你是一位專門幫助50-60歲中老年人識別詐騙的AI助手，專注於分析圖片中可能的詐騙風險。
+
+請仔細分析圖片中的文字內容、視覺元素和整體設計。
 
 重要分析要求：
 1. 仔細閱讀圖片中的所有文字內容
@@ -390,7 +495,7 @@ class ImageAnalysisService:
 - 檢查是否有投資、賺錢等相關內容
 """
         
-        return base_prompt
+        return base_prompt + output_format
     
     def _parse_analysis_result(self, result: str) -> Dict:
         """
@@ -403,7 +508,6 @@ class ImageAnalysisService:
             Dict: 結構化的分析結果
         """
         try:
-            lines = result.strip().split('\n')
             parsed_result = {
                 "risk_level": "中風險",  # 預設值
                 "fraud_type": "未知",
@@ -411,6 +515,12 @@ class ImageAnalysisService:
                 "suggestions": "建議謹慎處理。"
             }
             
+            # 結構化輸出直接取用欄位，其餘情況沿用逐行解析
+            structured = parse_structured_analysis(result, IMAGE_ANALYSIS_FIELDS)
+            if structured:
+                parsed_result.update({field: value for field, value in structured.items() if value})
+            lines = [] if structured else result.strip().split('\n')
+            
             for line in lines:
                 line = line.strip()
                 if line.startswith("風險等級：") or line.startswith("風險等級:"):
@@ -470,79 +580,34 @@ class ImageAnalysisService:
     
     def detect_qr_code(self, image_content: bytes) -> Dict:
         """
-        檢測圖片中的QR碼並分析其風險
+        在本地解碼圖片中的QR碼（不呼叫 OpenAI）
         
         Args:
-            image_content: 圖片二進制內容
+            image_content: 圖片二進制內容，或 prepare_image() 前處理過的圖片
             
         Returns:
-            Dict: 分析結果，包含是否發現QR碼、QR碼内容和風險評估
+            Dict: 是否發現QR碼、QR碼內容（codes）與其中的網址（urls）；網址的風險由呼叫端以網址檢查流程判斷
         """
+        if not qr_decoder.available:
+            return {
+                "success": False,
+                "contains_qr_code": False,
+                "codes": [],
+                "urls": [],
+                "message": "未安裝QR碼解碼套件",
+                "risk_level": "無法判定"
+            }
+        
         try:
-            # 如果安裝了pyzbar庫，可以直接解析QR碼
-            # 但由於環境限制，這裡使用OpenAI Vision API來協助檢測
-            image = Image.open(BytesIO(image_content))
-            image = self._resize_image_if_needed(image)
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            
-            prompt = """請仔細檢查圖片中是否包含QR碼或條形碼。如果有，請告訴我：
-1. 碼的類型（QR碼、條形碼等）
-2. 碼在圖片中的位置
-3. 如果你能看出，請告訴我這個碼可能連接到什麼（URL、付款等）
-4. 從詐騙風險角度評估這個碼的可疑程度
-
-請按以下格式回答：
-包含碼：[是/否]
-碼類型：[QR碼/條形碼/其他]
-位置：[描述在圖片中的位置]
-內容：[如果可見，描述內容]
-風險評估：[高/中/低] - [簡短說明]"""
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一位專門分析圖片中QR碼和條形碼的安全專家，請用中文回答。"
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=600
-            )
-            
-            result = response.choices[0].message.content
-            logger.info(f"QR碼分析結果: {result[:100]}...")
-            
-            # 解析QR碼結果
-            contains_code = "是" in result.split("包含碼：")[-1].split("\n")[0]
-            risk_level = "低"
-            
-            if "風險評估：" in result:
-                risk_part = result.split("風險評估：")[-1].strip()
-                if "高" in risk_part.split(" ")[0]:
-                    risk_level = "高"
-                elif "中" in risk_part.split(" ")[0]:
-                    risk_level = "中"
-            
+            # 以原始解析度解碼（前處理時保留），縮小後的小型QR碼可能解不出來
+            decoded = qr_decoder.decode(prepare_image(image_content).image)
             return {
                 "success": True,
-                "contains_qr_code": contains_code,
-                "raw_result": result,
-                "risk_level": risk_level,
-                "explanation": result
+                "contains_qr_code": bool(decoded["codes"]),
+                "codes": decoded["codes"],
+                "urls": decoded["urls"],
+                "risk_level": "低",
+                "explanation": "\n".join(decoded["codes"])
             }
             
         except Exception as e:
@@ -550,6 +615,8 @@ class ImageAnalysisService:
             return {
                 "success": False,
                 "contains_qr_code": False,
+                "codes": [],
+                "urls": [],
                 "message": f"檢測QR碼時發生錯誤: {str(e)}",
                 "risk_level": "無法判定",
                 "explanation": "處理圖片時發生技術錯誤。"
@@ -560,22 +627,18 @@ class ImageAnalysisService:
         從圖片中提取文字
         
         Args:
-            image_content: 圖片二進制內容
+            image_content: 圖片二進制內容，或 prepare_image() 前處理過的圖片
             
         Returns:
             str: 提取的文字
         """
         try:
             # 使用OpenAI Vision API提取文字
-            image = Image.open(BytesIO(image_content))
-            image = self._resize_image_if_needed(image)
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
+            prepared = prepare_image(image_content)
+            
+            response = self.gateway.hedged_complete(
+                "ocr",
+                [
                     {
                         "role": "system",
                         "content": "你是一位專門從圖片中提取文字的助手。請僅返回圖片中的文字內容，不要添加任何評論或分析。如果圖片中沒有文字，請回答「圖片中沒有可辨識的文字」。"
@@ -587,13 +650,12 @@ class ImageAnalysisService:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
+                                    "url": prepared.data_url
                                 }
                             }
                         ]
                     }
-                ],
-                max_tokens=600
+                ]
             )
             
             result = response.choices[0].message.content
@@ -618,8 +680,12 @@ def analyze_image_from_url(image_url: str, analysis_type: str = "GENERAL", conte
     """從URL下載並分析圖片，檢測詐騙風險"""
     return image_analysis_service.analyze_image_from_url(image_url, analysis_type, context_message)
 
+def analyze_screenshot(image_content: bytes, analysis_type: str = "GENERAL", context_message: str = "") -> Optional[Dict]:
+    """以一次呼叫取得圖片文字、QR 碼資訊與詐騙判斷"""
+    return image_analysis_service.analyze_screenshot(image_content, analysis_type, context_message)
+
 def detect_qr_code(image_content: bytes) -> Dict:
-    """檢測圖片中的QR碼並分析其風險"""
+    """在本地解碼圖片中的QR碼"""
     return image_analysis_service.detect_qr_code(image_content)
 
 def extract_text_from_image(image_content: bytes) -> str:
@@ -16,16 +16,20 @@ from linebot.models import (
 )
 
 from image_analysis_service import (
-    analyze_image, analyze_image_from_url, 
+    analyze_image, analyze_image_from_url, analyze_screenshot,
     detect_qr_code, extract_text_from_image, 
     ANALYSIS_TYPES
 )
+from image_preprocessor import prepare_image
+from screenshot_cache import screenshot_cache
+from config import IMAGE_SINGLE_CALL_ANALYSIS
 
 # 導入統一的 Flex Message 服務
 from flex_message_service import create_analysis_flex_message
 
 # 導入網域變形檢測
-from domain_spoofing_detector import detect_domain_spoofing
+from domain_spoofing_detector import detect_domain_spoofing_many
+from url_checker import check_message_urls
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -120,8 +124,57 @@ class ImageHandler:
         Returns:
             Dict: 分析結果
         """
-        # 首先提取文字以判斷是否需要特殊分析
-        extracted_text = extract_text_from_image(image_content)
+        # 只解碼、縮小並編碼一次，之後的 OCR、QR 碼解碼與圖片分析共用同一份結果
+        try:
+            image_content = prepare_image(image_content)
+        except Exception as e:
+            logger.exception(f"無法讀取圖片: {e}")
+            return {
+                "success": False,
+                "message": f"無法讀取圖片: {str(e)}",
+                "risk_level": "無法判定",
+                "fraud_type": "未知",
+                "explanation": "這張圖片打不開，可能已損毀或不是支援的圖片格式。",
+                "suggestions": "📷 請重新截圖後再傳一次"
+            }
+        
+        # 在本地解碼QR碼（不呼叫 OpenAI），解出的內容也是截圖快取的比對條件
+        qr_result = detect_qr_code(image_content)
+        
+        # 同一張截圖被轉傳時（重新壓縮、縮放或稍微裁切）沿用先前的分析結果，不再呼叫 Vision
+        fingerprint = screenshot_cache.fingerprint(image_content.image)
+        qr_codes = qr_result.get("codes", [])
+        cached = screenshot_cache.get(fingerprint, analysis_type, context_message, qr_codes)
+        if cached is not None:
+            result, distance = cached
+            logger.info(f"截圖快取命中（漢明距離 {distance}），沿用先前的分析結果")
+            result["image_cache_distance"] = distance
+            return result
+        
+        result = self._analyze_prepared_image(image_content, qr_result, context_message, analysis_type)
+        screenshot_cache.put(fingerprint, analysis_type, context_message, qr_codes, result)
+        return result
+    
+    def _analyze_prepared_image(self, image_content, qr_result: Dict, context_message: str, analysis_type: str) -> Dict:
+        """
+        分析前處理過的圖片（未命中截圖快取時）
+        
+        Args:
+            image_content: prepare_image() 前處理過的圖片
+            qr_result: 本地QR碼解碼結果
+            context_message: 用戶提供的上下文信息
+            analysis_type: 分析類型
+            
+        Returns:
+            Dict: 分析結果
+        """
+        # 啟用單次分析時，一次呼叫同時取得文字、QR 碼與判斷，以下的本地檢查改用該次回傳的文字
+        screenshot_result = analyze_screenshot(image_content, analysis_type, context_message) if IMAGE_SINGLE_CALL_ANALYSIS else None
+        if screenshot_result is not None:
+            extracted_text = screenshot_result.pop("extracted_text")
+        else:
+            # 首先提取文字以判斷是否需要特殊分析
+            extracted_text = extract_text_from_image(image_content)
         
         # 檢查是否為土豆防詐機器人相關內容
         if self._is_potato_antifraud_content(extracted_text):
@@ -197,11 +250,28 @@ class ImageHandler:
                 "spoofing_details": domain_spoofing_result
             }
         
-        # 檢查是否包含QR碼
-        qr_result = detect_qr_code(image_content)
+        # 本地解出的網址走與文字訊息相同的網址檢查流程
+        visual_qr_result = screenshot_result.pop("qr_result") if screenshot_result is not None else None
+        qr_url_result = self._check_qr_urls(qr_result.get("urls", []))
+        if qr_url_result and self._is_high_risk(qr_url_result.get("risk_level", "")):
+            logger.info(f"QR碼網址為高風險: {qr_url_result['url']}")
+            return {
+                "success": True,
+                "risk_level": "極高風險" if qr_url_result["risk_level"].startswith("極高") else "高風險",
+                "fraud_type": "可疑QR碼詐騙",
+                "explanation": f"圖片中的QR碼會連到「{qr_url_result['url']}」。{qr_url_result.get('explanation', '')}",
+                "suggestions": f"🚫 請勿掃描圖片中的QR碼\n{qr_url_result.get('suggestions', '')}",
+                "extracted_text": extracted_text,
+                "qr_codes": qr_result["codes"],
+                "qr_url_analysis": qr_url_result,
+                "analysis_source": "QR碼網址檢查"
+            }
         
-        # 進行一般詐騙分析
-        analysis_result = analyze_image(image_content, analysis_type, context_message)
+        if screenshot_result is not None:
+            analysis_result = screenshot_result
+        else:
+            # 進行一般詐騙分析
+            analysis_result = analyze_image(image_content, analysis_type, context_message)
         
         # 如果檢測到網域變形攻擊且是郵件內容，將此信息添加到分析結果中
         if domain_spoofing_result.get("is_spoofing", False) and self._contains_email_keywords(extracted_text):
@@ -213,21 +283,54 @@ class ImageHandler:
             if analysis_result.get("risk_level") in ["低風險", "中風險"]:
                 analysis_result["risk_level"] = "高風險"
         
-        # 如果發現QR碼且風險等級高，更新分析結果
-        if qr_result.get("success", False) and qr_result.get("contains_qr_code", False):
-            if qr_result.get("risk_level") == "高":
+        # 將QR碼的內容與網址檢查結果加入分析結果
+        if qr_url_result:
+            analysis_result["explanation"] = f"{analysis_result.get('explanation', '')}\n\n此外，圖片中的QR碼會連到「{qr_url_result['url']}」，" \
+                                             f"網址檢查結果為{qr_url_result.get('risk_level', '未知')}：{qr_url_result.get('explanation', '')}"
+            analysis_result["qr_url_analysis"] = qr_url_result
+        elif qr_result.get("contains_qr_code", False):
+            analysis_result["explanation"] = f"{analysis_result.get('explanation', '')}\n\n此外，圖片中包含QR碼，內容是「{qr_result['codes'][0]}」。"
+        elif visual_qr_result and visual_qr_result.get("success", False) and visual_qr_result.get("contains_qr_code", False):
+            # 本地解不出內容時，沿用單次分析時模型看到的QR碼資訊
+            if visual_qr_result.get("risk_level") == "高":
                 analysis_result["risk_level"] = "高風險"
                 analysis_result["fraud_type"] = "可疑QR碼詐騙"
                 analysis_result["explanation"] = f"{analysis_result.get('explanation', '')}\n\n此外，圖片中包含高風險QR碼，可能導向惡意網站或詐騙內容。"
                 analysis_result["suggestions"] = f"{analysis_result.get('suggestions', '')}\n🚫 請勿掃描圖片中的QR碼\n🔍 不要點擊來路不明的QR碼鏈接"
             else:
-                analysis_result["explanation"] = f"{analysis_result.get('explanation', '')}\n\n此外，圖片中包含QR碼，但風險評估為{qr_result.get('risk_level', '未知')}。"
+                analysis_result["explanation"] = f"{analysis_result.get('explanation', '')}\n\n此外，圖片中包含QR碼，但風險評估為{visual_qr_result.get('risk_level', '未知')}。"
+        if qr_result.get("codes"):
+            analysis_result["qr_codes"] = qr_result["codes"]
         
         # 添加提取的文字到分析結果中
         analysis_result["extracted_text"] = extracted_text
         
         return analysis_result
     
+    def _check_qr_urls(self, urls: List[str]) -> Optional[Dict]:
+        """
+        以文字訊息的網址檢查流程（黑名單、短網址展開、網域變形、白名單）檢查QR碼解出的網址
+        
+        只使用本地檢查，不呼叫 OpenAI（圖片本身已經由 Vision 分析過）。
+        
+        Returns:
+            Optional[Dict]: 檢查結果（含 url 欄位），沒有網址、沒有命中任何檢查或檢查失敗時返回 None
+        """
+        if not urls:
+            return None
+        try:
+            url_check = check_message_urls("\n".join(urls), self.safe_domains)
+        except Exception as e:
+            logger.error(f"QR碼網址檢查失敗: {e}")
+            return None
+        if not url_check["result"]:
+            return None
+        return dict(url_check["result"]["result"], url=urls[0])
+    
+    def _is_high_risk(self, risk_level: str) -> bool:
+        """風險等級是否為高或極高（相容「高」與「高風險」兩種寫法）"""
+        return risk_level.replace("風險", "") in ("極高", "高")
+    
     def _contains_email_keywords(self, text: str) -> bool:
         """檢查文字是否包含郵件相關關鍵詞"""
         # 強郵件特徵關鍵詞（必須包含這些才認為是郵件）
@@ -415,52 +518,65 @@ class ImageHandler:
         
         logger.info(f"從圖片文字中提取到的網址: {cleaned_urls}")
         
-        # 檢查每個網址是否為網域變形攻擊
+        # 提取每個網址的網域部分
+        url_by_domain = {}
         for url in cleaned_urls:
-            # 提取網域部分
-            domain = url
             if '://' in url:
                 domain = url.split('://')[1].split('/')[0]
-            elif url.startswith('www.'):
-                domain = url.split('/')[0]
             else:
-                # 如果不是完整URL，假設是網域
+                # www 開頭或不是完整URL，假設是網域
                 domain = url.split('/')[0]
+            url_by_domain.setdefault(domain.lower(), url)
+        
+        # 一次檢測所有網域，回報每一個變形網域
+        verdicts = detect_domain_spoofing_many(url_by_domain.keys(), self.safe_domains)
+        spoofed_domains = []
+        for domain, spoofing_result in verdicts.items():
+            if not spoofing_result.get("is_spoofed", False):
+                continue
+            logger.info(f"檢測到網域變形攻擊: {domain} -> {spoofing_result}")
+            spoofing_result["detected_url"] = url_by_domain.get(domain, domain)
+            spoofed_domains.append(spoofing_result)
+        
+        if spoofed_domains:
+            first_result = spoofed_domains[0]
             
-            # 進行網域變形檢測
-            spoofing_result = detect_domain_spoofing(domain, self.safe_domains)
+            # 生成詳細的說明
+            spoofed_domain = first_result.get("spoofed_domain", "")
+            original_domain = first_result.get("original_domain", "未知")
+            attack_type = first_result.get("spoofing_type", "網域變形")
+            risk_explanation = first_result.get("risk_explanation", "")
             
-            if spoofing_result.get("is_spoofed", False):
-                logger.info(f"檢測到網域變形攻擊: {domain} -> {spoofing_result}")
-                
-                # 生成詳細的說明
-                spoofed_domain = spoofing_result.get("spoofed_domain", domain)
-                original_domain = spoofing_result.get("original_domain", "未知")
-                attack_type = spoofing_result.get("spoofing_type", "網域變形")
-                risk_explanation = spoofing_result.get("risk_explanation", "")
-                
-                # 使用原有的風險說明，或生成新的
-                if risk_explanation:
-                    explanation = risk_explanation
-                else:
-                    explanation = f"這個網址「{spoofed_domain}」是假冒「{original_domain}」的詐騙網站！" \
-                                f"詐騙集團故意把網址改得很像真的，想騙取您的個人資料或金錢。" \
-                                f"攻擊類型：{attack_type}。"
-                
-                suggestions = f"🚫 立即停止使用此網站\n" \
-                            f"🔍 正確網址應該是：{original_domain}\n" \
-                            f"🛡️ 如已輸入資料請立即更改密碼\n" \
-                            f"💳 檢查信用卡及銀行帳戶是否有異常"
-                
-                return {
-                    "is_spoofing": True,
-                    "spoofed_domain": spoofed_domain,
-                    "original_domain": original_domain,
-                    "spoofing_type": attack_type,
-                    "explanation": explanation,
-                    "suggestions": suggestions,
-                    "detected_url": url
-                }
+            # 使用原有的風險說明，或生成新的
+            if risk_explanation:
+                explanation = risk_explanation
+            else:
+                explanation = f"這個網址「{spoofed_domain}」是假冒「{original_domain}」的詐騙網站！" \
+                            f"詐騙集團故意把網址改得很像真的，想騙取您的個人資料或金錢。" \
+                            f"攻擊類型：{attack_type}。"
+            
+            if len(spoofed_domains) > 1:
+                other_domains = "\n".join(
+                    f"• {result.get('spoofed_domain', '')}（疑似假冒 {result.get('original_domain', '未知')}）"
+                    for result in spoofed_domains[1:]
+                )
+                explanation += f"\n\n圖片中還有其他可疑的假網址：\n{other_domains}"
+            
+            suggestions = f"🚫 立即停止使用此網站\n" \
+                        f"🔍 正確網址應該是：{original_domain}\n" \
+                        f"🛡️ 如已輸入資料請立即更改密碼\n" \
+                        f"💳 檢查信用卡及銀行帳戶是否有異常"
+            
+            return {
+                "is_spoofing": True,
+                "spoofed_domain": spoofed_domain,
+                "original_domain": original_domain,
+                "spoofing_type": attack_type,
+                "explanation": explanation,
+                "suggestions": suggestions,
+                "detected_url": first_result["detected_url"],
+                "spoofed_domains": spoofed_domains
+            }
         
         # 沒有檢測到網域變形攻擊
         return {
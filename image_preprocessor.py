@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+圖片前處理模組
+每張圖片只解碼、轉正、縮小、編碼各一次，產生的 data URL 由 OCR、圖片分析與截圖單次分析共用，
+本地 QR 碼解碼則使用解碼後的原始解析度圖片。
+
+預設編碼為 JPEG（品質 85）：LINE 的截圖多為 JPEG，原本每次重新存成 PNG 常比原始上傳檔還大，
+JPEG 約只有 PNG 的四分之一且編碼快；也可改用 WebP（檔案更小但編碼較慢）。
+圖片不需縮小、原始檔已是可直接送出的格式且比重新編碼小時，直接送出原始檔。
+
+每張圖片送出的位元組數與編碼時間會記錄在日誌與統計中。
+"""
+
+import time
+import base64
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from config import IMAGE_MAX_SIZE, IMAGE_ENCODE_FORMAT, IMAGE_ENCODE_QUALITY
+
+logger = logging.getLogger(__name__)
+
+_MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+class PreparedImage:
+    """前處理後的圖片：解碼後的原始圖片與要送出的 data URL"""
+
+    def __init__(self, image, data_url, original_bytes, encoded_bytes, encode_ms):
+        self.image = image  # 已轉正、原始解析度的 PIL 圖片
+        self.data_url = data_url
+        self.original_bytes = original_bytes
+        self.encoded_bytes = encoded_bytes
+        self.encode_ms = encode_ms
+
+
+def _resize(image, max_size):
+    """保持寬高比縮小到最長邊不超過 max_size"""
+    width, height = image.size
+    if width <= max_size and height <= max_size:
+        return image
+    scale = max_size / max(width, height)
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+
+def _flatten(image, fmt):
+    """轉成編碼格式支援的色彩模式（JPEG 不支援透明，以白色背景合成）"""
+    if fmt == 'JPEG':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, 'white')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return image if image.mode in ('RGB', 'L') else image.convert('RGB')
+    return image if image.mode in ('RGB', 'RGBA', 'L') else image.convert('RGBA')
+
+
+class ImagePreprocessor:
+    """解碼、縮小並編碼圖片一次"""
+
+    def __init__(self, max_size=IMAGE_MAX_SIZE, fmt=IMAGE_ENCODE_FORMAT, quality=IMAGE_ENCODE_QUALITY):
+        self.max_size = max_size
+        self.format = fmt.upper()
+        self.quality = quality
+        self._lock = threading.Lock()
+        self.stats = {'images': 0, 'original_bytes': 0, 'bytes_sent': 0, 'reused_original': 0, 'total_encode_ms': 0.0}
+
+    def prepare(self, image_content):
+        """
+        前處理圖片
+
+        Args:
+            image_content: 圖片二進制內容
+
+        Returns:
+            PreparedImage
+
+        Raises:
+            PIL 無法開啟圖片時拋出的例外
+        """
+        start = time.perf_counter()
+        source = Image.open(BytesIO(image_content))
+        source_format = source.format
+        # 手機照片常以 EXIF 標記旋轉方向，轉正後模型與 QR 碼解碼才看得到正確方向
+        image = ImageOps.exif_transpose(source) if source.getexif().get(0x0112, 1) != 1 else source
+        image.load()
+        resized = _resize(image, self.max_size)
+        unchanged = resized is source
+
+        if unchanged and source_format in _MIME_TYPES and source_format != 'PNG':
+            # 不需轉正或縮小的 JPEG／WebP 原始檔通常已經夠小，不再重新編碼
+            payload, mime_type, reused = image_content, _MIME_TYPES[source_format], True
+        else:
+            buffered = BytesIO()
+            options = {'quality': self.quality} if self.format in ('JPEG', 'WEBP') else {}
+            _flatten(resized, self.format).save(buffered, format=self.format, **options)
+            payload, mime_type, reused = buffered.getvalue(), _MIME_TYPES[self.format], False
+            if unchanged and source_format in _MIME_TYPES and len(image_content) < len(payload):
+                payload, mime_type, reused = image_content, _MIME_TYPES[source_format], True
+        encode_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.stats['images'] += 1
+            self.stats['original_bytes'] += len(image_content)
+            self.stats['bytes_sent'] += len(payload)
+            self.stats['reused_original'] += reused
+            self.stats['total_encode_ms'] += encode_ms
+        logger.info(f"圖片前處理：原始 {len(image_content)} bytes，送出 {len(payload)} bytes（{mime_type}），"
+                    f"{image.size[0]}x{image.size[1]} -> {resized.size[0]}x{resized.size[1]}，{encode_ms:.1f} ms")
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(payload).decode('utf-8')}"
+        return PreparedImage(image, data_url, len(image_content), len(payload), round(encode_ms, 2))
+
+    def get_stats(self):
+        """取得每張圖片平均送出的位元組數與編碼時間"""
+        with self._lock:
+            stats = dict(self.stats)
+        images = stats['images']
+        total_ms = stats.pop('total_encode_ms')
+        return dict(
+            stats,
+            format=self.format,
+            quality=self.quality,
+            avg_bytes_sent=round(stats['bytes_sent'] / images) if images else 0,
+            avg_encode_ms=round(total_ms / images, 2) if images else 0.0,
+            bytes_ratio=round(stats['bytes_sent'] / stats['original_bytes'], 3) if stats['original_bytes'] else 0.0,
+        )
+
+
+# 全域圖片前處理器
+image_preprocessor = ImagePreprocessor()
+
+
+def prepare_image(image):
+    """前處理圖片；已前處理過的圖片直接返回"""
+    if isinstance(image, PreparedImage):
+        return image
+    return image_preprocessor.prepare(image)
+
+
+def get_image_preprocessor_stats():
+    """取得圖片前處理統計"""
+    return image_preprocessor.get_stats()
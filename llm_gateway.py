@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 閘道模組
+所有 OpenAI 呼叫都經過這裡：共用一個 OpenAI 客戶端與 HTTP 連線池，
+依用途（route：text_analysis、near_duplicate_confirm、chat、vision、ocr、screenshot）套用 config.LLM_ROUTES
+的模型、逾時、回應 token 上限與同時請求上限，並記錄各用途的延遲與 token 分佈。
+
+提示詞前綴快取：回應 usage.prompt_tokens_details.cached_tokens 記錄命中快取的輸入 token 數，
+並分別統計有無命中快取的平均延遲，用來衡量固定提示詞前綴帶來的延遲與費用節省。
+
+需要延遲預算的呼叫以 call() / hedged_complete() 經過該用途自己的斷路器：圖片等較慢的用途
+正常的慢回應不會讓文字分析與聊天一起斷路。p95 門檻為各用途延遲預算的 CIRCUIT_BREAKER_P95_LATENCY_FACTOR 倍；
+等待同時請求名額的時間與逾時（LLMGatewayBusy）是本地壅塞，不計入斷路器。
+"""
+
+import time
+import logging
+import threading
+
+import httpx
+from openai import OpenAI, DefaultHttpxClient
+
+from config import (
+    OPENAI_API_KEY, OPENAI_TIMEOUT, OPENAI_MAX_RETRIES, LLM_ROUTES, LLM_POOL_CONNECTIONS,
+    CIRCUIT_BREAKER_LATENCY_BUDGETS, CIRCUIT_BREAKER_P95_LATENCY, CIRCUIT_BREAKER_P95_LATENCY_FACTOR
+)
+from circuit_breaker import CircuitBreaker, exclude_from_latency
+from structured_analysis import record_token_usage
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)  # 秒
+_TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class LLMGatewayUnavailable(Exception):
+    """OpenAI 客戶端未初始化"""
+
+
+class LLMGatewayBusy(Exception):
+    """用途的同時請求數已達上限，等待逾時"""
+
+
+class _Histogram:
+    """固定分界的直方圖（各區間的次數，不累計）"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+
+    def to_dict(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        observations = sum(self.counts)
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'avg': round(self.total / observations, 3) if observations else 0.0,
+        }
+
+
+class _RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.busy = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.latency = _Histogram(_LATENCY_BUCKETS)
+        self.queue_wait = _Histogram(_LATENCY_BUCKETS)
+        self.prompt_tokens = _Histogram(_TOKEN_BUCKETS)
+        self.completion_tokens = _Histogram(_TOKEN_BUCKETS)
+        self.prompt_token_total = 0
+        self.cached_token_total = 0
+        self.cached_calls = 0
+        self.cached_latency_total = 0.0
+        self.uncached_calls = 0
+        self.uncached_latency_total = 0.0
+
+    def cache_stats(self):
+        """提示詞前綴快取的命中比例與有無命中的平均延遲"""
+        return {
+            'cached_tokens': self.cached_token_total,
+            'cached_token_ratio': round(self.cached_token_total / self.prompt_token_total, 4) if self.prompt_token_total else 0.0,
+            'cached_calls': self.cached_calls,
+            'avg_latency_cached': round(self.cached_latency_total / self.cached_calls, 3) if self.cached_calls else 0.0,
+            'avg_latency_uncached': round(self.uncached_latency_total / self.uncached_calls, 3) if self.uncached_calls else 0.0,
+        }
+
+
+def cached_prompt_tokens(usage):
+    """取得命中提示詞前綴快取的輸入 token 數（舊版 API 或模型不支援時為 0）"""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+
+
+def create_openai_client(api_key=OPENAI_API_KEY):
+    """建立共用連線池的 OpenAI 客戶端；沒有 API 金鑰或初始化失敗時返回 None"""
+    if not api_key:
+        logger.warning("OpenAI API 初始化失敗：缺少 API 金鑰")
+        return None
+    try:
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=LLM_POOL_CONNECTIONS, max_keepalive_connections=LLM_POOL_CONNECTIONS)
+        )
+        client = OpenAI(
+            api_key=api_key,
+            http_client=http_client,
+            timeout=OPENAI_TIMEOUT,  # 各用途的逾時在呼叫時另外指定
+            max_retries=OPENAI_MAX_RETRIES  # 上游異常時由斷路器處理，不長時間重試
+        )
+        logger.info("OpenAI API 初始化成功")
+        return client
+    except Exception as e:
+        logger.error(f"OpenAI API 初始化失敗: {e}")
+        return None
+
+
+class LLMGateway:
+    """統一管理 OpenAI 呼叫的閘道"""
+
+    def __init__(self, client=None, routes=None, breaker=None, latency_budgets=None):
+        """
+        Args:
+            breaker: 指定時所有用途共用這個斷路器（測試用）；省略時每個用途各建立一個
+        """
+        self.client = client
+        self.routes = routes if routes is not None else LLM_ROUTES
+        self.latency_budgets = latency_budgets if latency_budgets is not None else CIRCUIT_BREAKER_LATENCY_BUDGETS
+        self.breakers = {route: breaker if breaker is not None else self._create_breaker(route)
+                         for route in self.routes}
+        self._semaphores = {route: threading.BoundedSemaphore(settings['concurrency'])
+                            for route, settings in self.routes.items()}
+        self._lock = threading.Lock()
+        self._stats = {route: _RouteStats() for route in self.routes}
+
+    def _create_breaker(self, route):
+        budget = self.latency_budgets.get(route)
+        p95_latency = budget * CIRCUIT_BREAKER_P95_LATENCY_FACTOR if budget else CIRCUIT_BREAKER_P95_LATENCY
+        return CircuitBreaker(route, p95_latency=p95_latency)
+
+    @property
+    def available(self):
+        return self.client is not None
+
+    def model(self, route):
+        """取得用途使用的模型"""
+        return self.routes[route]['model']
+
+    def complete(self, route, messages, **kwargs):
+        """
+        以用途的設定呼叫 chat.completions.create
+
+        model、timeout 與 max_tokens 未指定時使用用途的設定；同時請求數達上限時最多等待用途的逾時秒數。
+
+        Raises:
+            LLMGatewayUnavailable: OpenAI 客戶端未初始化
+            LLMGatewayBusy: 等待同時請求名額逾時
+            OpenAI 客戶端拋出的例外
+        """
+        if self.client is None:
+            raise LLMGatewayUnavailable("OpenAI 客戶端未初始化")
+        settings = self.routes[route]
+        kwargs.setdefault('model', settings['model'])
+        kwargs.setdefault('timeout', settings['timeout'])
+        kwargs.setdefault('max_tokens', settings['max_tokens'])
+        stats = self._stats[route]
+
+        wait_start = time.monotonic()
+        if not self._semaphores[route].acquire(timeout=settings['timeout']):
+            with self._lock:
+                stats.busy += 1
+            raise LLMGatewayBusy(f"{route} 同時請求數已達上限 {settings['concurrency']}")
+        start = time.monotonic()
+        exclude_from_latency(start - wait_start)
+        with self._lock:
+            stats.queue_wait.observe(start - wait_start)
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+
+        response = None
+        try:
+            response = self.client.chat.completions.create(messages=messages, **kwargs)
+            return response
+        finally:
+            self._semaphores[route].release()
+            latency = time.monotonic() - start
+            usage = getattr(response, 'usage', None)
+            with self._lock:
+                stats.in_flight -= 1
+                stats.calls += 1
+                stats.errors += response is None
+                stats.latency.observe(latency)
+                if usage is not None:
+                    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+                    cached_tokens = cached_prompt_tokens(usage)
+                    stats.prompt_tokens.observe(prompt_tokens)
+                    stats.completion_tokens.observe(getattr(usage, 'completion_tokens', 0) or 0)
+                    stats.prompt_token_total += prompt_tokens
+                    stats.cached_token_total += cached_tokens
+                    if cached_tokens:
+                        stats.cached_calls += 1
+                        stats.cached_latency_total += latency
+                    else:
+                        stats.uncached_calls += 1
+                        stats.uncached_latency_total += latency
+            if response is not None:
+                record_token_usage(route, response, structured='response_format' in kwargs)
+
+    def call(self, route, func, *args, **kwargs):
+        """
+        以用途的延遲預算經過斷路器執行 func（func 內可呼叫多次 complete()）
+
+        Raises:
+            LLMGatewayUnavailable: OpenAI 客戶端未初始化（不計入斷路器）
+            LLMGatewayBusy: 等待同時請求名額逾時（不計入斷路器）
+            CircuitOpenError、LatencyBudgetExceeded（見 circuit_breaker）
+        """
+        if self.client is None:
+            raise LLMGatewayUnavailable("OpenAI 客戶端未初始化")
+        return self.breakers[route].call(func, *args, latency_budget=self.latency_budgets.get(route),
+                                         ignored_exceptions=(LLMGatewayBusy, LLMGatewayUnavailable), **kwargs)
+
+    def hedged_complete(self, route, messages, **kwargs):
+        """經過斷路器與延遲預算的 complete()"""
+        return self.call(route, self.complete, route, messages, **kwargs)
+
+    def get_breaker_stats(self):
+        """取得各用途斷路器的狀態、近期錯誤率與 p95 延遲（同一個斷路器只列一次）"""
+        stats = {}
+        for route, breaker in self.breakers.items():
+            stats.setdefault(breaker.name, breaker.get_stats())
+        return stats
+
+    def get_stats(self):
+        """取得各用途的設定、呼叫次數與延遲、token 分佈"""
+        with self._lock:
+            return {
+                'available': self.available,
+                'routes': {
+                    route: {
+                        'model': self.routes[route]['model'],
+                        'concurrency': self.routes[route]['concurrency'],
+                        'calls': stats.calls,
+                        'errors': stats.errors,
+                        'busy': stats.busy,
+                        'in_flight': stats.in_flight,
+                        'max_in_flight': stats.max_in_flight,
+                        'latency_seconds': stats.latency.to_dict(),
+                        'queue_wait_seconds': stats.queue_wait.to_dict(),
+                        'prompt_tokens': stats.prompt_tokens.to_dict(),
+                        'completion_tokens': stats.completion_tokens.to_dict(),
+                        'prompt_cache': stats.cache_stats(),
+                    }
+                    for route, stats in self._stats.items() if stats.calls or stats.busy
+                },
+            }
+
+
+# 全域 LLM 閘道實例
+llm_gateway = LLMGateway(create_openai_client())
+
+
+def get_llm_gateway_stats():
+    """取得 LLM 閘道統計"""
+    return llm_gateway.get_stats()
+
+
+def get_circuit_breaker_stats():
+    """取得各用途的 OpenAI 斷路器統計"""
+    return llm_gateway.get_breaker_stats()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地風險評分模組
+結合本地就能判斷的訊號（網址狀況、詐騙關鍵詞、fraud_tactics.json 常見話術、
+LINE 帳號與電話等聯絡方式、金額、催促與索取個資的用語，以及詐騙文字分類器的機率）計算風險分數，
+分數明確偏高或偏低的訊息直接以範本說明回覆，只有中間不確定的訊息才交給 OpenAI 分析。
+
+詐騙訊息也常夾帶「詐騙、165、查證、小心」等防詐用語（例如冒充 165 專線或檢察官），
+因此只要有任何加分的特徵，防詐用語就不能把訊息抵銷成低風險，一律交給 OpenAI 分析。
+
+家人之間轉帳、繳費的訊息也會同時出現「轉帳、金額、帳號末三碼」，分類器也容易認為像詐騙，
+因此只有這類交易用語時不在本地判為高風險：還需要至少一個其他的詐騙手法
+（加 LINE、催促、冒充機關、保證獲利、保密、已知話術或可疑網址）。
+
+白名單與網域變形檢測在評分前就已處理（命中時不會進到評分）。
+
+高低兩個門檻以標註語料（fraud_detection_questions.json 的詐騙訊息為正例，
+benign_messages.json 的一般訊息與題目中的防詐提醒為負例）調整：
+    python local_risk_scorer.py
+"""
+
+import os
+import re
+import json
+import logging
+import argparse
+import threading
+
+from config import (
+    FRAUD_TACTICS_FILE, LOCAL_RISK_HIGH_THRESHOLD, LOCAL_RISK_LOW_THRESHOLD, BENIGN_MESSAGES_FILE,
+    FRAUD_PREVENTION_GAME_QUESTIONS_FILE, TEXT_CLASSIFIER_FRAUD_PROBABILITY, TEXT_CLASSIFIER_BENIGN_PROBABILITY
+)
+from fraud_knowledge import analyze_fraud_keywords
+from fraud_text_classifier import fraud_text_classifier
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (名稱, 權重, 樣式, 說明)：說明用於範本回覆
+_PATTERN_SIGNALS = [
+    ('contact_request', 2.0,
+     re.compile(r'加\s*(?:line|賴|好友)|line\s*(?:id)?\s*[:：@]|私訊|專員|客服.{0,6}(?:line|賴)|@[a-z0-9._-]{3,}', re.I),
+     "要你加 LINE 或私下聯絡「客服、專員」"),
+    ('transfer_request', 1.5,
+     re.compile(r'轉帳|匯款|匯入|轉入|儲值|買點數|遊戲點數|保證金|手續費|稅金|操作\s*atm|atm\s*操作|網銀|安全帳戶', re.I),
+     "要求轉帳、匯款、儲值或繳手續費"),
+    ('credential_request', 1.5,
+     re.compile(r'驗證碼|密碼|身分證(?:字號|號)|卡號|背面三碼|背三碼|末三碼|效期|存摺|印章|提款卡|個資|核對.{0,4}資料|更新.{0,4}資料', re.I),
+     "要你提供密碼、驗證碼、卡號或個人資料"),
+    ('urgency', 1.0,
+     re.compile(r'\d+\s*(?:小時|分鐘|天)內|立即|立刻|盡快|儘快|馬上|逾期|限時|今天內|最後期限|否則|將(?:停用|停話|凍結|取消|失效|鎖)|已(?:凍結|暫停|鎖|監管)'),
+     "用「限時、逾期、凍結」催你馬上處理"),
+    ('authority', 1.0,
+     re.compile(r'地檢署|檢察官|法院|警察|警局|刑事|健保署|國稅局|財政部|勞保局|監理|戶政|衛福部|公所|郵局|電信|銀行|客服中心|官方'),
+     "自稱政府機關、銀行或官方客服"),
+    ('money_amount', 0.5,
+     re.compile(r'(?:nt\$|\$)\s*\d|\d[\d,]*\s*(?:元|萬|塊)', re.I),
+     "提到具體金額"),
+    ('phone_number', 0.5,
+     re.compile(r'(?:\+?886[\s-]?|0)\d{1,3}[\s-]?[\dx]{3,4}[\s-]?[\dx]{3,4}', re.I),
+     "附上要你回撥的電話"),
+    ('too_good', 1.5,
+     re.compile(r'保證|穩賺|無風險|零風險|高報酬|高回報|飆股|免費(?:升級|領取|贈送)|中獎|補助|退稅|退款|回饋'),
+     "提出保證獲利、中獎、補助或退款等好處"),
+]
+# 一般轉帳、繳費訊息也會出現的特徵：只有這些特徵時不足以在本地判為高風險
+_TRANSACTION_SIGNALS = frozenset({'transfer_request', 'credential_request', 'money_amount', 'phone_number', 'text_classifier'})
+_SECRECY_PATTERN = re.compile(r'別告訴|不要告訴|勿告訴|勿透露|保密')
+# 防詐提醒、反詐宣導常見的用語（詐騙訊息本身幾乎不會出現）
+_ADVISORY_PATTERN = re.compile(r'詐騙|165|反詐|防詐|請勿(?:提供|告訴|相信)|不會(?:以|用|透過|要求|主動)|小心|謹慎|查證|官方(?:App|網站|管道)', re.I)
+
+# 範本回覆的防範建議
+_HIGH_RISK_SUGGESTIONS = "🚫 不要點連結、不要轉帳或提供任何資料\n🔍 直接打給官方客服或撥165查證\n🛡️ 不要加對方提供的LINE或回撥訊息裡的電話"
+_LOW_RISK_SUGGESTIONS = "💡 目前看起來是一般訊息，如果之後對方要求匯款、提供資料或點連結，再請土豆幫你看看"
+
+# AI 分析暫時無法完成時，範本回覆開頭的標示
+PRELIMINARY_RESULT_MARKER = "⏳ 初步結果：AI 詳細分析暫時無法完成，以下是依本地規則的初步判斷，請稍後再傳一次取得完整分析。"
+
+
+def _load_tactic_phrases(path=None):
+    """從 fraud_tactics.json 的常見話術切出可比對的短句（依詐騙類型分組）"""
+    path = path or os.path.join(_BASE_DIR, FRAUD_TACTICS_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            tactics = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"載入詐騙話術失敗: {e}")
+        return {}
+
+    phrases = {}
+    for category, subtypes in tactics.items():
+        if not isinstance(subtypes, dict):
+            continue
+        for subtype in subtypes.values():
+            if not isinstance(subtype, dict):
+                continue
+            for script in subtype.get('常見話術', []):
+                for segment in re.split(r'[，。、！？；：,.!?/／()（）【】「」\s]|OO', script):
+                    if 4 <= len(segment) <= 12:
+                        phrases[segment] = category
+    return phrases
+
+
+def _has_suspicious_signal(scored):
+    """是否有任何加分的特徵（防詐用語等減分特徵不能抵銷這些特徵）"""
+    return any(weight > 0 for _, weight, _ in scored['signals'])
+
+
+def _has_scam_tactic(scored):
+    """是否有交易用語以外的詐騙手法或網址特徵"""
+    return any(weight > 0 and name not in _TRANSACTION_SIGNALS for name, weight, _ in scored['signals'])
+
+
+class LocalRiskScorer:
+    """
+    本地風險評分
+
+    分數大於等於 high_threshold、且有交易用語以外的詐騙手法時判定為高風險；小於等於 low_threshold、沒有任何加分的特徵、
+    且訊息中沒有非白名單網址時判定為低風險；其餘交給 OpenAI 分析。有提供 classifier（FraudTextClassifier）時，詐騙機率明確偏高或偏低也會計入分數。
+    """
+
+    def __init__(self, high_threshold=LOCAL_RISK_HIGH_THRESHOLD, low_threshold=LOCAL_RISK_LOW_THRESHOLD,
+                 tactic_phrases=None, classifier=None):
+        self.high_threshold = high_threshold
+        self.low_threshold = low_threshold
+        self.tactic_phrases = tactic_phrases if tactic_phrases is not None else _load_tactic_phrases()
+        self.classifier = classifier
+        self._lock = threading.Lock()
+        self.counts = {'high': 0, 'low': 0, 'uncertain': 0}
+
+    def score(self, message, url_signals=None, prediction=None):
+        """
+        計算訊息的本地風險分數
+
+        Args:
+            message: 訊息內容
+            url_signals: 網址狀況 {'unlisted_urls': 非白名單網址數, 'short_url': 是否為短網址,
+                         'short_url_expanded': 短網址是否成功展開}
+            prediction: 詐騙文字分類器的預測結果；未提供時以 classifier 預測
+
+        Returns:
+            dict: {'score', 'signals': [(名稱, 權重, 說明)], 'fraud_type'}
+        """
+        url_signals = url_signals or {}
+        signals = []
+
+        for name, weight, pattern, description in _PATTERN_SIGNALS:
+            if pattern.search(message):
+                signals.append((name, weight, description))
+
+        keyword_types = analyze_fraud_keywords(message)
+        if keyword_types:
+            signals.append(('fraud_keywords', min(len(keyword_types), 2) * 1.0,
+                            f"出現{'、'.join(keyword_types)}常見的關鍵詞"))
+
+        tactic_hits = [(phrase, category) for phrase, category in self.tactic_phrases.items() if phrase in message]
+        if tactic_hits:
+            signals.append(('tactic_phrases', 2.0, f"和已知的{tactic_hits[0][1]}話術相同（「{tactic_hits[0][0]}」）"))
+
+        if _SECRECY_PATTERN.search(message):
+            signals.append(('secrecy', 1.5, "要你保密、不要告訴家人"))
+
+        if url_signals.get('short_url') and not url_signals.get('short_url_expanded'):
+            signals.append(('unexpanded_short_url', 1.5, "用短網址藏住真正的網站，而且無法展開"))
+        elif url_signals.get('unlisted_urls'):
+            signals.append(('unlisted_url', 1.0, "附上不在常見可信網站名單中的連結"))
+
+        if _ADVISORY_PATTERN.search(message):
+            signals.append(('advisory_wording', -3.0, "內容像是防詐提醒"))
+
+        if prediction is None and self.classifier is not None:
+            prediction = self.classifier.predict(message)
+        likely_fraud = prediction is not None and prediction['fraud_probability'] >= TEXT_CLASSIFIER_FRAUD_PROBABILITY
+        if likely_fraud:
+            signals.append(('text_classifier', 2.0, "用字和已知的詐騙訊息很像"))
+        elif prediction is not None and prediction['fraud_probability'] <= TEXT_CLASSIFIER_BENIGN_PROBABILITY:
+            signals.append(('text_classifier', -1.0, "用字和一般訊息相近"))
+
+        fraud_type = None
+        if tactic_hits:
+            fraud_type = tactic_hits[0][1]
+        elif likely_fraud:
+            fraud_type = prediction['fraud_type']
+        elif keyword_types:
+            fraud_type = keyword_types[0]
+
+        return {
+            'score': round(sum(weight for _, weight, _ in signals), 2),
+            'signals': signals,
+            'fraud_type': fraud_type,
+        }
+
+    def _is_high_risk(self, scored):
+        return scored['score'] >= self.high_threshold and _has_scam_tactic(scored)
+
+    def classify(self, message, url_signals=None, prediction=None):
+        """
+        本地分級
+
+        Returns:
+            tuple: (等級 'high' / 'low' / 'uncertain', score() 的結果)
+        """
+        scored = self.score(message, url_signals, prediction)
+        if self._is_high_risk(scored):
+            tier = 'high'
+        elif (scored['score'] <= self.low_threshold and not _has_suspicious_signal(scored)
+              and not (url_signals or {}).get('unlisted_urls')):
+            tier = 'low'
+        else:
+            tier = 'uncertain'
+        with self._lock:
+            self.counts[tier] += 1
+        return tier, scored
+
+    def build_result(self, tier, scored):
+        """以範本產生與 parse_fraud_analysis 相同欄位的分析結果"""
+        if tier == 'high':
+            reasons = "\n".join(f"• {description}" for _, weight, description in scored['signals'] if weight > 0)
+            return {
+                "risk_level": "高風險",
+                "fraud_type": scored['fraud_type'] or "可疑詐騙訊息",
+                "explanation": f"這則訊息有好幾個詐騙常見的特徵：\n{reasons}\n正常的機關、銀行和商家不會這樣要求你。",
+                "suggestions": _HIGH_RISK_SUGGESTIONS,
+                "is_emerging": False,
+            }
+        return {
+            "risk_level": "低風險",
+            "fraud_type": "非詐騙相關",
+            "explanation": "這則訊息沒有看到要求匯款、提供資料、加陌生LINE或點可疑連結等詐騙常見的特徵。",
+            "suggestions": _LOW_RISK_SUGGESTIONS,
+            "is_emerging": False,
+        }
+
+    def build_preliminary_result(self, scored):
+        """
+        OpenAI 暫時無法使用（斷路中或超過延遲預算）時，依本地分數產生標示為「初步結果」的分析結果
+
+        未達高門檻但有任何可疑特徵時判為中風險（防詐用語不抵銷），寧可多提醒一次。
+        """
+        if self._is_high_risk(scored):
+            result = self.build_result('high', scored)
+        elif _has_suspicious_signal(scored):
+            reasons = "\n".join(f"• {description}" for _, weight, description in scored['signals'] if weight > 0)
+            result = {
+                "risk_level": "中風險",
+                "fraud_type": scored['fraud_type'] or "可疑訊息",
+                "explanation": f"這則訊息有一些需要留意的地方：\n{reasons}",
+                "suggestions": _HIGH_RISK_SUGGESTIONS,
+                "is_emerging": False,
+            }
+        else:
+            result = self.build_result('low', scored)
+        result["explanation"] = f"{PRELIMINARY_RESULT_MARKER}\n{result['explanation']}"
+        result["is_preliminary"] = True
+        return result
+
+    def get_stats(self):
+        """取得分級統計"""
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                'high_threshold': self.high_threshold,
+                'low_threshold': self.low_threshold,
+                'tactic_phrases': len(self.tactic_phrases),
+                'text_classifier': self.classifier is not None and self.classifier.available,
+                'counts': dict(self.counts),
+                'local_rate': round((self.counts['high'] + self.counts['low']) / total, 4) if total else 0.0,
+            }
+
+
+def load_labeled_corpus():
+    """
+    載入標註語料
+
+    Returns:
+        tuple: (詐騙訊息列表, 一般訊息列表)
+    """
+    with open(os.path.join(_BASE_DIR, FRAUD_PREVENTION_GAME_QUESTIONS_FILE), 'r', encoding='utf-8') as f:
+        questions = [q for q in json.load(f)['questions'] if isinstance(q, dict)]
+    with open(os.path.join(_BASE_DIR, BENIGN_MESSAGES_FILE), 'r', encoding='utf-8') as f:
+        benign = json.load(f)['messages']
+
+    fraud = [q['fraud_message'] for q in questions]
+    fraud_set = set(fraud)
+    # 題目中的其他選項是防詐提醒，內容常提到詐騙關鍵詞，是很好的困難負例
+    advisories = sorted({
+        option['text'] for q in questions for option in q['options']
+        if option['id'] != q['correct_option'] and option['text'] not in fraud_set
+    })
+    return fraud, benign + advisories
+
+
+def tune_thresholds(fraud_scores, benign_scores, max_false_positive_rate=0.01, max_missed_fraud_rate=0.01):
+    """
+    依標註語料選擇門檻
+
+    高門檻：一般訊息被判為高風險的比例不超過 max_false_positive_rate 的最低分數；
+    低門檻：詐騙訊息被判為低風險的比例不超過 max_missed_fraud_rate 的最高分數。
+
+    Returns:
+        tuple: (high_threshold, low_threshold)
+    """
+    candidates = sorted(set(fraud_scores) | set(benign_scores))
+    high = max(candidates) + 0.5
+    for threshold in candidates:
+        if sum(score >= threshold for score in benign_scores) <= max_false_positive_rate * len(benign_scores):
+            high = threshold
+            break
+    low = min(candidates) - 0.5
+    for threshold in candidates:
+        if sum(score <= threshold for score in fraud_scores) <= max_missed_fraud_rate * len(fraud_scores):
+            low = threshold
+        else:
+            break
+    return high, min(low, high - 0.5)
+
+
+def evaluate(scorer, fraud, benign, predictions=None):
+    """
+    以語料評估分級結果
+
+    Args:
+        predictions: 每則訊息（詐騙在前、一般訊息在後）的分類器預測；未提供時由 scorer 自行預測
+    """
+    predictions = predictions or [None] * (len(fraud) + len(benign))
+    report = {}
+    for label, messages, offset in (('fraud', fraud, 0), ('benign', benign, len(fraud))):
+        tiers = {'high': 0, 'low': 0, 'uncertain': 0}
+        for i, message in enumerate(messages):
+            tiers[scorer.classify(message, prediction=predictions[offset + i])[0]] += 1
+        report[label] = tiers
+    high_total = report['fraud']['high'] + report['benign']['high']
+    low_total = report['fraud']['low'] + report['benign']['low']
+    report['high_precision'] = round(report['fraud']['high'] / high_total, 4) if high_total else 1.0
+    report['low_precision'] = round(report['benign']['low'] / low_total, 4) if low_total else 1.0
+    report['local_rate'] = round((high_total + low_total) / (len(fraud) + len(benign)), 4)
+    return report
+
+
+def main(argv=None):
+    """以標註語料調整並評估門檻"""
+    parser = argparse.ArgumentParser(description="以標註語料調整本地風險評分門檻")
+    parser.add_argument('--max-false-positive-rate', type=float, default=0.01)
+    parser.add_argument('--max-missed-fraud-rate', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    fraud, benign = load_labeled_corpus()
+    classifier = fraud_text_classifier if fraud_text_classifier.available else None
+    predictions = [None] * (len(fraud) + len(benign))
+    if classifier is not None:
+        # 分類器以同一份語料訓練，調整門檻時改用交叉驗證的預測，避免高估分類器的效果
+        from fraud_text_classifier import load_training_data, cross_validate
+        messages, labels, fraud_types = load_training_data()
+        by_message = dict(zip(messages, cross_validate(messages, labels, fraud_types)))
+        predictions = [by_message[message] for message in fraud + benign]
+
+    scorer = LocalRiskScorer(classifier=classifier)
+    scores = [scorer.score(message, prediction=prediction)['score']
+              for message, prediction in zip(fraud + benign, predictions)]
+    high, low = tune_thresholds(scores[:len(fraud)], scores[len(fraud):],
+                                args.max_false_positive_rate, args.max_missed_fraud_rate)
+
+    print(f"📚 語料：詐騙 {len(fraud)} 則，一般訊息與防詐提醒 {len(benign)} 則，"
+          f"詐騙文字分類器{'已啟用' if classifier else '未啟用'}")
+    print(f"🎯 建議門檻：LOCAL_RISK_HIGH_THRESHOLD = {high}，LOCAL_RISK_LOW_THRESHOLD = {low}")
+    for name, current in (('目前設定', LocalRiskScorer(classifier=classifier)),
+                          ('建議門檻', LocalRiskScorer(high, low, classifier=classifier))):
+        print(f"📊 {name}：{json.dumps(evaluate(current, fraud, benign, predictions), ensure_ascii=False)}")
+
+
+# 全域本地風險評分實例
+local_risk_scorer = LocalRiskScorer(classifier=fraud_text_classifier)
+
+
+def get_local_risk_stats():
+    """取得本地風險分級統計"""
+    return local_risk_scorer.get_stats()
+
+
+if __name__ == "__main__":
+    main()
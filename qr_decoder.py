@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 QR 碼解碼模組
+在本機直接解出圖片中 QR 碼（與條碼）的實際內容，不再請 Vision 模型猜測，也不花費任何 API 呼叫。
+解出的網址交給文字訊息相同的網址檢查流程（黑名單、短網址展開、網域變形與白名單）。
+
+解碼套件為選用：優先使用 OpenCV 的 QRCodeDetector（opencv-python-headless），
+其次使用 pyzbar（另需系統的 zbar 函式庫，可解條碼）；都未安裝時不解碼。
+"""
+
+import re
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # 選用套件
+    np = None
+
+try:
+    import cv2
+except ImportError:  # 選用套件
+    cv2 = None
+
+try:
+    from pyzbar import pyzbar
+except (ImportError, OSError):  # 選用套件（缺少 zbar 函式庫時為 OSError）
+    pyzbar = None
+
+_URL_PATTERN = re.compile(r'^(https?://|www\.)\S+$', re.IGNORECASE)
+
+
+def _decode_with_opencv(image):
+    gray = np.asarray(image.convert('L'))
+    detector = cv2.QRCodeDetector()
+    found, decoded, _, _ = detector.detectAndDecodeMulti(gray)
+    return [text for text in decoded if text] if found else []
+
+
+def _decode_with_pyzbar(image):
+    return [symbol.data.decode('utf-8', errors='replace') for symbol in pyzbar.decode(image.convert('L'))]
+
+
+def _default_backend():
+    if cv2 is not None and np is not None:
+        return 'opencv', _decode_with_opencv
+    if pyzbar is not None:
+        return 'pyzbar', _decode_with_pyzbar
+    return None, None
+
+
+class QRCodeDecoder:
+    """本地 QR 碼解碼器"""
+
+    def __init__(self, backend=None, backend_name=None):
+        if backend is None:
+            backend_name, backend = _default_backend()
+        self.backend_name = backend_name or ('custom' if backend else None)
+        self._backend = backend
+        self._lock = threading.Lock()
+        self.stats = {'images': 0, 'with_codes': 0, 'codes': 0, 'urls': 0, 'errors': 0, 'total_ms': 0.0}
+
+    @property
+    def available(self):
+        return self._backend is not None
+
+    def decode(self, image):
+        """
+        解出圖片中所有 QR 碼的內容
+
+        Args:
+            image: 已解碼的 PIL 圖片（請用原始解析度，縮小後的圖片可能解不出來）
+
+        Returns:
+            dict: codes（所有內容）與 urls（其中的網址）；解碼套件未安裝時兩者皆為空
+        """
+        if not self.available:
+            return {'codes': [], 'urls': []}
+        start = time.perf_counter()
+        try:
+            codes = list(dict.fromkeys(code.strip() for code in self._backend(image) if code and code.strip()))
+            error = False
+        except Exception as e:
+            logger.warning(f"QR 碼解碼失敗: {e}")
+            codes, error = [], True
+        urls = [code for code in codes if _URL_PATTERN.match(code)]
+        with self._lock:
+            self.stats['images'] += 1
+            self.stats['with_codes'] += bool(codes)
+            self.stats['codes'] += len(codes)
+            self.stats['urls'] += len(urls)
+            self.stats['errors'] += error
+            self.stats['total_ms'] += (time.perf_counter() - start) * 1000
+        if codes:
+            logger.info(f"本地解出 QR 碼內容: {codes}")
+        return {'codes': codes, 'urls': urls}
+
+    def get_stats(self):
+        """取得解碼統計"""
+        with self._lock:
+            stats = dict(self.stats)
+        images = stats.pop('images')
+        total_ms = stats.pop('total_ms')
+        return dict(stats, backend=self.backend_name, images=images,
+                    avg_decode_ms=round(total_ms / images, 2) if images else 0.0)
+
+
+# 全域 QR 碼解碼器
+qr_decoder = QRCodeDecoder()
+if not qr_decoder.available:
+    logger.warning("未安裝 opencv-python-headless 或 pyzbar，無法在本地解碼 QR 碼")
+
+
+def get_qr_decoder_stats():
+    """取得 QR 碼解碼統計"""
+    return qr_decoder.get_stats()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+短網址轉址模擬伺服器
+在本機模擬短網址服務的各種轉址方式（HTTP 30x、meta refresh、JavaScript、隱藏欄位）、
+緩慢回應與超大網頁，讓短網址展開的測試與效能量測不需要連線到真正的短網址服務。
+
+使用方式：
+    python redirect_standin_server.py --port 8765
+"""
+
+import time
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_routes():
+    """
+    預設的轉址路由
+
+    每個路由是 {路徑: 設定}，設定的 type 可以是：
+        redirect: HTTP 轉址（status、location）
+        meta: meta refresh 轉址（location）
+        js: JavaScript 轉址（location）
+        hidden: 隱藏欄位轉址，cht.tw 使用的方式（location、title）
+        page: 一般網頁（title、size 附加的填充位元組數）
+        slow: 延遲 delay 秒後回應 then 指定的設定
+    """
+    return {
+        # 多層 HTTP 轉址
+        '/s/chain': {'type': 'redirect', 'status': 301, 'location': '/s/chain2'},
+        '/s/chain2': {'type': 'redirect', 'status': 302, 'location': '/s/chain3'},
+        '/s/chain3': {'type': 'redirect', 'status': 307, 'location': '/final/chain'},
+        # 頁面內轉址：meta refresh -> JavaScript -> 隱藏欄位
+        '/s/meta': {'type': 'meta', 'location': '/s/js'},
+        '/s/js': {'type': 'js', 'location': '/s/hidden'},
+        '/s/hidden': {'type': 'hidden', 'location': '/final/in-page', 'title': '中華電信'},
+        # 轉址後的緩慢回應
+        '/s/slow': {'type': 'redirect', 'status': 302, 'location': '/s/slow-page'},
+        '/s/slow-page': {'type': 'slow', 'delay': 0.5, 'then': {'type': 'redirect', 'status': 302, 'location': '/final/slow'}},
+        # 超大網頁（轉址寫在內容最後面，讀取上限內看不到）
+        '/s/huge': {'type': 'page', 'title': 'huge', 'size': 4 * 1024 * 1024, 'trailer_location': '/final/never'},
+        # 轉址迴圈
+        '/s/loop-a': {'type': 'redirect', 'status': 302, 'location': '/s/loop-b'},
+        '/s/loop-b': {'type': 'redirect', 'status': 302, 'location': '/s/loop-a'},
+        # 不轉址的短網址（已失效）
+        '/s/dead': {'type': 'page', 'title': '網址不存在', 'size': 0},
+    }
+
+
+def default_scenarios():
+    """預設的量測情境：(名稱, 起始路徑, 預期最終路徑)"""
+    return [
+        ('http_chain', '/s/chain', '/final/chain'),
+        ('in_page_redirects', '/s/meta', '/final/in-page'),
+        ('slow_response', '/s/slow', '/final/slow'),
+        ('huge_body', '/s/huge', '/s/huge'),
+        ('redirect_loop', '/s/loop-a', '/s/loop-b'),
+        ('dead_link', '/s/dead', '/s/dead'),
+    ]
+
+
+def _render(route):
+    """依路由設定產生 (狀態碼, 標頭, 內容)"""
+    route_type = route['type']
+    if route_type == 'redirect':
+        return route.get('status', 302), {'Location': route['location']}, b''
+    if route_type == 'meta':
+        body = f'<html><head><meta http-equiv="refresh" content="0; url={route["location"]}"></head></html>'
+    elif route_type == 'js':
+        body = f'<html><script>window.location.href = "{route["location"]}";</script></html>'
+    elif route_type == 'hidden':
+        body = f'<html><head><title>{route.get("title", "")}</title></head><body><input type="hidden" id="target" value="{route["location"]}"></body></html>'
+    else:
+        body = f'<html><head><title>{route.get("title", "")}</title></head><body>' + 'x' * route.get('size', 0)
+        if route.get('trailer_location'):
+            body += f'<script>location = "{route["trailer_location"]}";</script>'
+        body += '</body></html>'
+    return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf-8')
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 標頭與內容分開送出，關閉 Nagle 避免每次回應多等 40ms 的延遲 ACK
+    disable_nagle_algorithm = True
+
+    def _respond(self, send_body):
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            server.active += 1
+        try:
+            self._send_route(server, send_body)
+        finally:
+            with server.stats_lock:
+                server.active -= 1
+                server.stats_lock.notify_all()
+
+    def _send_route(self, server, send_body):
+        route = server.routes.get(self.path.split('?')[0])
+        if route is None:
+            if self.path.startswith('/final/'):
+                route = {'type': 'page', 'title': 'final', 'size': 0}
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        if route['type'] == 'slow':
+            time.sleep(route.get('delay', 1))
+            route = route.get('then', {'type': 'page', 'title': 'slow', 'size': 0})
+
+        status, headers, body = _render(route)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not send_body or not body:
+            return
+        try:
+            # 分段送出，讓客戶端可以提早停止讀取
+            for offset in range(0, len(body), 16384):
+                chunk = body[offset:offset + 16384]
+                self.wfile.write(chunk)
+                with server.stats_lock:
+                    server.bytes_sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RedirectStandInServer:
+    """
+    本機轉址模擬伺服器
+
+    可作為 context manager 使用：
+        with RedirectStandInServer() as server:
+            url = server.url('/s/chain')
+    """
+
+    def __init__(self, routes=None, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _StandInHandler)
+        self._server.daemon_threads = True
+        self._server.routes = routes if routes is not None else default_routes()
+        # 統計數字與處理中的請求數共用一個 Condition，get_stats 可以等處理中的回應送完
+        self._server.stats_lock = threading.Condition()
+        self._server.requests = 0
+        self._server.active = 0
+        self._server.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def routes(self):
+        return self._server.routes
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def url(self, path):
+        return self.base_url + path
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_idle(self, timeout=5.0):
+        """
+        等待所有處理中的請求結束
+
+        客戶端讀到需要的內容就會關閉連線，伺服器端的處理執行緒可能還在送出剩下的內容，
+        量測伺服器送出的位元組數前要先等它們結束。
+
+        Returns:
+            bool: 是否在 timeout 秒內結束
+        """
+        with self._server.stats_lock:
+            return self._server.stats_lock.wait_for(lambda: self._server.active == 0, timeout)
+
+    def get_stats(self, wait_idle=False):
+        """取得請求數與送出的位元組數；wait_idle 為 True 時先等處理中的請求結束"""
+        if wait_idle:
+            self.wait_idle()
+        with self._server.stats_lock:
+            return {'requests': self._server.requests, 'bytes_sent': self._server.bytes_sent,
+                    'active': self._server.active}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="短網址轉址模擬伺服器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = RedirectStandInServer(host=args.host, port=args.port)
+    print(f"🚀 轉址模擬伺服器啟動於 {server.base_url}")
+    print(json.dumps(sorted(server.routes), ensure_ascii=False))
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截圖分析結果快取模組
+同一張詐騙截圖（假投資群組、假銀行簡訊）常被許多使用者轉傳，每一份都要花最多三次 Vision 呼叫。
+以本地計算的感知雜湊（dHash）為鍵保存分析結果，重新壓縮、縮放或稍微裁切過的同一張截圖
+雜湊值只差幾個位元，漢明距離在容許範圍內即沿用先前的分析結果。
+
+在 1080x2000 的合成聊天截圖上（256 位元 dHash）：重新壓縮約差 12 位元、上下各裁掉 2% 約差 26 位元，
+不同的截圖則差 80 位元以上。只換了網址的截圖只差約 6 位元，
+因此與文字的近似重複索引相同，只收錄高風險的判定結果，並要求本地解出的QR碼內容完全相同。
+"""
+
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from analysis_cache import normalize_message
+from config import (
+    ANALYSIS_CACHE_TTL, SCREENSHOT_CACHE_SIZE, SCREENSHOT_HASH_SIZE, SCREENSHOT_CACHE_MAX_DISTANCE,
+    SCREENSHOT_CACHE_RISK_LEVELS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def dhash(image, hash_size=SCREENSHOT_HASH_SIZE):
+    """
+    計算圖片的差異雜湊（dHash）：縮成 (hash_size + 1) x hash_size 的灰階圖，比較左右相鄰像素的亮度
+
+    Args:
+        image: PIL 圖片
+        hash_size: 雜湊邊長，位元數為 hash_size 的平方
+
+    Returns:
+        int: 指紋
+    """
+    width = hash_size + 1
+    # 先縮小再轉灰階，reducing_gap 讓大圖先以整數倍快速縮小，1080x2000 的截圖約 2.5 ms
+    pixels = list(image.resize((width, hash_size), Image.LANCZOS, reducing_gap=2.0).convert('L').getdata())
+    fingerprint = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * width + col]
+            fingerprint = fingerprint << 1 | (left > pixels[row * width + col + 1])
+    return fingerprint
+
+
+class ScreenshotResultCache:
+    """
+    截圖分析結果快取
+
+    以 LRU 保存，項目數與存活時間都有上限。查詢時逐一比對漢明距離（項目數上限不大，
+    每次比對只是整數 XOR），並且分析類型、使用者補充說明與本地解出的QR碼內容都必須相同。
+    """
+
+    def __init__(self, max_size=SCREENSHOT_CACHE_SIZE, max_distance=SCREENSHOT_CACHE_MAX_DISTANCE,
+                 ttl=ANALYSIS_CACHE_TTL, hash_size=SCREENSHOT_HASH_SIZE, risk_levels=SCREENSHOT_CACHE_RISK_LEVELS):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.hash_size = hash_size
+        self.risk_levels = frozenset(risk_levels)
+        self._entries = OrderedDict()  # 序號 -> (指紋, 比對條件, 分析結果, 到期時間)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+        self.skipped = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.total_hit_distance = 0
+        self.total_hash_ms = 0.0
+        self.hashed = 0
+
+    def fingerprint(self, image):
+        """計算截圖指紋（PIL 圖片，建議使用前處理保留的原始解析度圖片）"""
+        start = time.perf_counter()
+        fingerprint = dhash(image, self.hash_size)
+        with self._lock:
+            self.hashed += 1
+            self.total_hash_ms += (time.perf_counter() - start) * 1000
+        return fingerprint
+
+    @staticmethod
+    def _condition(analysis_type, context_message, qr_codes):
+        return analysis_type, normalize_message(context_message), tuple(qr_codes or ())
+
+    def get(self, fingerprint, analysis_type, context_message="", qr_codes=None):
+        """
+        取得相似截圖的分析結果
+
+        Returns:
+            tuple 或 None: (分析結果 dict, 漢明距離)
+        """
+        condition = self._condition(analysis_type, context_message, qr_codes)
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            best = None
+            for entry_id, (stored, stored_condition, _, expires_at) in list(self._entries.items()):
+                if expires_at <= now:
+                    del self._entries[entry_id]
+                    self.expirations += 1
+                    continue
+                if stored_condition != condition:
+                    continue
+                distance = bin(stored ^ fingerprint).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (entry_id, distance)
+
+            if best is None:
+                return None
+            entry_id, distance = best
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.total_hit_distance += distance
+            result = self._entries[entry_id][2]
+        return copy.deepcopy(result), distance
+
+    def put(self, fingerprint, analysis_type, context_message, qr_codes, result):
+        """保存截圖分析結果（僅限高風險判定）"""
+        if result.get("success") is False or result.get("risk_level") not in self.risk_levels:
+            with self._lock:
+                self.skipped += 1
+            return False
+        entry = (fingerprint, self._condition(analysis_type, context_message, qr_codes),
+                 copy.deepcopy(result), time.time() + self.ttl)
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            self.stored += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """取得快取統計"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hash_bits': self.hash_size ** 2,
+                'max_distance': self.max_distance,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': self.lookups - self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'avg_hit_distance': round(self.total_hit_distance / self.hits, 2) if self.hits else 0.0,
+                'avg_hash_ms': round(self.total_hash_ms / self.hashed, 2) if self.hashed else 0.0,
+                'stored': self.stored,
+                'skipped_low_risk': self.skipped,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+
+# 全域截圖分析結果快取
+screenshot_cache = ScreenshotResultCache()
+
+
+def get_screenshot_cache_stats():
+    """取得截圖分析結果快取統計"""
+    return screenshot_cache.get_stats()
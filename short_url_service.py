@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+短網址服務模組
+保存短網址展開結果的快取，避免詐騙活動反覆出現的同一個短網址每次都重新連線展開；
+並以共用的連線池同時展開訊息中的所有短網址。
+
+展開時逐跳追蹤 HTTP 30x、meta refresh、隱藏欄位與 JavaScript 轉址（cht.tw、bsms.tw 等服務需要），
+每一跳只串流讀取前幾 KB 並只解析一次，整條轉址鏈另有總位元組與時間上限。
+"""
+
+import os
+import re
+import json
+import html
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse, urljoin
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from config import (
+    SHORT_URL_DOMAINS, SHORT_URL_CACHE_SIZE, SHORT_URL_CACHE_SUCCESS_TTL, SHORT_URL_CACHE_FAILURE_TTL,
+    SHORT_URL_CACHE_FILE, SHORT_URL_CACHE_PERSIST_INTERVAL, SHORT_URL_REQUEST_TIMEOUT,
+    SHORT_URL_EXPANSION_DEADLINE, SHORT_URL_MAX_WORKERS, SHORT_URL_PER_HOST_LIMIT,
+    SHORT_URL_MAX_REDIRECTS, SHORT_URL_MAX_BODY_BYTES, SHORT_URL_MAX_CHAIN_BYTES,
+    SHORT_URL_CHAIN_TIMEOUT, SHORT_URL_USER_AGENT
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(url):
+    """短網址快取鍵：協定與主機名稱轉小寫，路徑保留大小寫（短網址代碼區分大小寫）"""
+    url = url.strip()
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return url
+    if not parsed.netloc:
+        return url
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower()).geturl()
+
+
+class ShortURLCache:
+    """
+    短網址展開結果快取
+
+    成功與失敗的結果使用不同的存活時間：成功的展開結果可以保存較久，
+    失敗（逾時、連線錯誤）只短暫保存，避免暫時性錯誤被記住太久。
+    可選擇保存到本機檔案，重新啟動後仍保留未過期的項目。
+    """
+
+    def __init__(self, max_size=SHORT_URL_CACHE_SIZE, success_ttl=SHORT_URL_CACHE_SUCCESS_TTL,
+                 failure_ttl=SHORT_URL_CACHE_FAILURE_TTL, persist_path=SHORT_URL_CACHE_FILE,
+                 persist_interval=SHORT_URL_CACHE_PERSIST_INTERVAL):
+        self.max_size = max_size
+        self.success_ttl = success_ttl
+        self.failure_ttl = failure_ttl
+        self.persist_path = persist_path or None
+        self.persist_interval = persist_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_persist = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+        if self.persist_path:
+            self._load()
+            atexit.register(self.persist)
+
+    def get(self, url):
+        """
+        取得未過期的展開結果
+
+        Returns:
+            dict 或 None: {'final_url', 'redirect_chain', 'success', 'page_title'}
+        """
+        key = _cache_key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires_at'] <= now:
+                del self._entries[key]
+                self._dirty = True
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {
+                'final_url': entry['final_url'],
+                'redirect_chain': list(entry['redirect_chain']),
+                'success': entry['success'],
+                'page_title': entry.get('page_title'),
+            }
+
+    def put(self, url, final_url, redirect_chain, success, page_title=None):
+        """保存展開結果"""
+        key = _cache_key(url)
+        ttl = self.success_ttl if success else self.failure_ttl
+        with self._lock:
+            self._entries[key] = {
+                'final_url': final_url,
+                'redirect_chain': list(redirect_chain or []),
+                'success': bool(success),
+                'page_title': page_title,
+                'expires_at': time.time() + ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+            should_persist = self.persist_path and time.time() - self._last_persist >= self.persist_interval
+
+        if should_persist:
+            self.persist()
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def _load(self):
+        """從本機檔案載入未過期的項目"""
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"載入短網址快取失敗: {e}")
+            return
+
+        now = time.time()
+        entries = sorted(
+            ((key, entry) for key, entry in data.get('entries', {}).items() if entry.get('expires_at', 0) > now),
+            key=lambda item: item[1].get('saved_order', 0)
+        )
+        for key, entry in entries[-self.max_size:]:
+            entry.pop('saved_order', None)
+            self._entries[key] = entry
+        logger.info(f"已載入 {len(self._entries)} 筆短網址快取")
+
+    def persist(self):
+        """將未過期的項目寫入本機檔案（先寫暫存檔再取代）"""
+        if not self.persist_path:
+            return
+        now = time.time()
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = {}
+            for order, (key, entry) in enumerate(self._entries.items()):
+                if entry['expires_at'] > now:
+                    entries[key] = dict(entry, saved_order=order)
+            self._dirty = False
+            self._last_persist = now
+
+        temp_path = self.persist_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'entries': entries}, f, ensure_ascii=False)
+            os.replace(temp_path, self.persist_path)
+        except OSError as e:
+            logger.warning(f"保存短網址快取失敗: {e}")
+
+    def get_stats(self):
+        """取得快取統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'persistent': bool(self.persist_path),
+            }
+
+
+# 全域短網址快取實例
+short_url_cache = ShortURLCache()
+
+
+# 短網址服務的主機名稱集合，以標籤後綴查詢（bit.ly 也涵蓋 x.bit.ly），不會把 shopeet.com 誤判為 t.co
+SHORT_URL_HOSTS = frozenset(domain.lower() for domain in SHORT_URL_DOMAINS)
+# 舊版子字串比對的等效規則，只用來統計避免了多少次不必要的展開
+_LEGACY_SHORT_URL_PATTERN = re.compile('|'.join(re.escape(domain) for domain in SHORT_URL_DOMAINS))
+
+
+def is_short_url_host(host, short_hosts=SHORT_URL_HOSTS):
+    """
+    檢查主機名稱是否為短網址服務（本身或其上層網域在 short_hosts 中）
+
+    Args:
+        host: 主機名稱（可包含連接埠）
+        short_hosts: 短網址服務主機名稱集合
+    """
+    labels = host.lower().split(':')[0].rstrip('.').split('.')
+    for i in range(len(labels) - 1):
+        if '.'.join(labels[i:]) in short_hosts:
+            return True
+    return False
+
+
+_REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+_JS_REDIRECT_PATTERNS = [
+    re.compile(r'window\.location\.href\s*=\s*["\']([^"\']+)["\']'),
+    re.compile(r'window\.location\s*=\s*["\']([^"\']+)["\']'),
+    re.compile(r'location\.href\s*=\s*["\']([^"\']+)["\']'),
+    re.compile(r'location\s*=\s*["\']([^"\']+)["\']'),
+]
+
+
+def _decode_body(body, declared_encoding):
+    """解碼部分讀取的網頁內容，沒有宣告編碼時依序嘗試 UTF-8 與 Big5"""
+    if declared_encoding:
+        try:
+            return body.decode(declared_encoding, errors='replace')
+        except LookupError:
+            pass
+    for encoding in ('utf-8', 'big5'):
+        try:
+            return body.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return body.decode('utf-8', errors='ignore')
+
+
+def parse_html_redirect(page_html, base_url):
+    """
+    解析一次網頁內容，取得頁面標題與頁面內的轉址目標
+
+    依序檢查 meta refresh、id/name 為 target 的隱藏欄位、JavaScript 轉址。
+
+    Returns:
+        tuple: (頁面標題或 None, 下一跳網址或 None)
+    """
+    soup = BeautifulSoup(page_html, 'html.parser')
+
+    page_title = None
+    title_tag = soup.find('title')
+    if title_tag:
+        page_title = html.unescape(title_tag.get_text().strip()) or None
+
+    meta_refresh = soup.find('meta', attrs={'http-equiv': lambda value: value and value.lower() == 'refresh'})
+    if meta_refresh:
+        url_match = re.search(r'url=(.+)', meta_refresh.get('content', ''), re.IGNORECASE)
+        if url_match:
+            return page_title, urljoin(base_url, url_match.group(1).strip().strip('\'"'))
+
+    target_input = soup.find('input', {'id': 'target'}) or soup.find('input', {'name': 'target'})
+    if target_input and target_input.get('value'):
+        return page_title, urljoin(base_url, html.unescape(target_input.get('value')))
+
+    for script in soup.find_all('script'):
+        if not script.string:
+            continue
+        for pattern in _JS_REDIRECT_PATTERNS:
+            match = pattern.search(script.string)
+            if match:
+                return page_title, urljoin(base_url, match.group(1))
+
+    return page_title, None
+
+
+class ShortURLExpander:
+    """
+    短網址展開器
+
+    使用長期保留的 requests.Session 連線池，不必每次展開都重新建立 TCP/TLS 連線。
+    同一則訊息中的短網址會同時展開並共用一個總期限；每個短網址服務另有同時連線數上限，
+    避免對同一個服務發出過多請求。
+    """
+
+    def __init__(self, cache=None, request_timeout=SHORT_URL_REQUEST_TIMEOUT,
+                 deadline=SHORT_URL_EXPANSION_DEADLINE, max_workers=SHORT_URL_MAX_WORKERS,
+                 per_host_limit=SHORT_URL_PER_HOST_LIMIT, max_redirects=SHORT_URL_MAX_REDIRECTS,
+                 max_body_bytes=SHORT_URL_MAX_BODY_BYTES, max_chain_bytes=SHORT_URL_MAX_CHAIN_BYTES,
+                 chain_timeout=SHORT_URL_CHAIN_TIMEOUT, short_hosts=SHORT_URL_HOSTS):
+        self.cache = cache
+        self.short_hosts = frozenset(short_hosts)
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.per_host_limit = per_host_limit
+        self.max_redirects = max_redirects
+        self.max_body_bytes = max_body_bytes
+        self.max_chain_bytes = max_chain_bytes
+        self.chain_timeout = chain_timeout
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': SHORT_URL_USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='short-url')
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+        self.expansions = 0
+        self.deadline_exceeded = 0
+        self.hops = 0
+        self.bytes_read = 0
+        self.avoided_expansions = 0
+        self.truncated_bodies = 0
+
+    def is_short_url(self, url):
+        """檢查網址是否為短網址服務"""
+        netloc = urlparse(url).netloc
+        if is_short_url_host(netloc, self.short_hosts):
+            return True
+        if _LEGACY_SHORT_URL_PATTERN.search(netloc):
+            # 舊版子字串比對會誤判並連線展開的網址
+            with self._lock:
+                self.avoided_expansions += 1
+        return False
+
+    def _host_semaphore(self, host):
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _read_body(self, response, budget, stop_at):
+        """
+        串流讀取回應內容，最多讀取 budget 位元組或到 stop_at 為止
+
+        Returns:
+            tuple: (內容, 是否因上限而截斷)
+        """
+        chunks = []
+        size = 0
+        truncated = False
+        for chunk in response.iter_content(chunk_size=8192):
+            if not chunk:
+                continue
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= budget or time.time() >= stop_at:
+                truncated = True
+                break
+        body = b''.join(chunks)[:budget]
+        if truncated:
+            with self._lock:
+                self.truncated_bodies += 1
+        return body, truncated
+
+    def follow_redirects(self, url, deadline_at=None, max_redirects=None):
+        """
+        逐跳追蹤轉址直到最終頁面
+
+        每一跳都使用串流 GET（不自動轉址），30x 直接讀取 Location；
+        HTML 頁面只讀取前 max_body_bytes 位元組並解析一次。
+        整條轉址鏈的讀取量與時間都有上限。
+
+        Returns:
+            dict: {'final_url', 'redirect_chain', 'success', 'page_title', 'bytes_read',
+                   'incomplete'（因本地的期限或讀取量上限而沒有追蹤完，並非遠端錯誤）}
+        """
+        start = time.time()
+        stop_at = start + self.chain_timeout
+        if deadline_at is not None:
+            stop_at = min(stop_at, deadline_at)
+
+        redirect_chain = [url]
+        current_url = url
+        page_title = None
+        bytes_read = 0
+        incomplete = False
+
+        for _ in range(max_redirects or self.max_redirects):
+            remaining = stop_at - time.time()
+            if remaining <= 0:
+                logger.warning(f"追蹤轉址超過時間上限: {url}")
+                incomplete = True
+                break
+
+            try:
+                response = self.session.get(current_url, allow_redirects=False, stream=True,
+                                            timeout=max(0.1, min(self.request_timeout, remaining)))
+            except Exception as e:
+                logger.warning(f"請求失敗: {current_url} ({e})")
+                # 逾時是因為剩餘期限比單次請求逾時短時，是本地期限造成的，不是遠端錯誤
+                incomplete = isinstance(e, requests.Timeout) and remaining < self.request_timeout
+                break
+
+            next_url = None
+            try:
+                with self._lock:
+                    self.hops += 1
+                if response.status_code in _REDIRECT_STATUS_CODES and response.headers.get('Location'):
+                    next_url = urljoin(current_url, response.headers['Location'])
+                elif response.status_code == 200 and 'html' in response.headers.get('Content-Type', 'text/html').lower():
+                    budget = min(self.max_body_bytes, self.max_chain_bytes - bytes_read)
+                    if budget > 0:
+                        body, truncated = self._read_body(response, budget, stop_at)
+                        bytes_read += len(body)
+                        page_title, next_url = parse_html_redirect(_decode_body(body, response.encoding), current_url)
+                        incomplete = truncated and not next_url
+                    else:
+                        incomplete = True
+            finally:
+                response.close()
+
+            if not next_url or next_url in redirect_chain:
+                break
+            current_url = next_url
+            redirect_chain.append(current_url)
+            logger.info(f"轉址到: {current_url}")
+
+        with self._lock:
+            self.bytes_read += bytes_read
+
+        final_url = redirect_chain[-1]
+        return {
+            'final_url': final_url,
+            'redirect_chain': redirect_chain,
+            'success': final_url != url,
+            'page_title': page_title,
+            'bytes_read': bytes_read,
+            'incomplete': incomplete,
+        }
+
+    def _fetch(self, url, deadline_at):
+        """實際連線展開短網址（在工作執行緒中執行）"""
+        remaining = deadline_at - time.time()
+        semaphore = self._host_semaphore(urlparse(url).netloc.lower())
+        if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+            return None  # 期限內沒有輪到，不保存結果
+
+        try:
+            with self._lock:
+                self.expansions += 1
+            result = self.follow_redirects(url, deadline_at)
+        except Exception as e:
+            logger.error(f"展開短網址時出錯: {e}")
+            result = {'final_url': url, 'redirect_chain': [url], 'success': False, 'page_title': None,
+                      'bytes_read': 0, 'incomplete': False}
+        finally:
+            semaphore.release()
+
+        if result['success']:
+            logger.info(f"成功展開短網址: {url} -> {result['final_url']}")
+        else:
+            logger.warning(f"URL可能不是短網址或無法展開: {url}")
+        # 因本地期限或讀取量上限沒追蹤完的結果不保存，下次重新展開
+        if self.cache is not None and not result['incomplete']:
+            self.cache.put(url, result['final_url'], result['redirect_chain'], result['success'], result['page_title'])
+        return result
+
+    def expand_all(self, urls, deadline=None):
+        """
+        同時展開多個網址中的短網址
+
+        Args:
+            urls: 網址列表（需包含 http:// 或 https://）
+            deadline: 整批展開的總期限（秒），省略時使用設定值
+
+        Returns:
+            list: 與輸入順序相同的結果 [{'original_url', 'final_url', 'is_short_url',
+                  'success', 'redirect_chain', 'page_title'}, ...]
+        """
+        deadline_at = time.time() + (self.deadline if deadline is None else deadline)
+        resolved = {}
+        pending = {}
+        short_flags = {}
+
+        for url in urls:
+            if url in short_flags:
+                continue
+            short_flags[url] = self.is_short_url(url)
+            if not short_flags[url]:
+                resolved[url] = {'final_url': url, 'redirect_chain': [url], 'success': False, 'page_title': None}
+                continue
+            cached = self.cache.get(url) if self.cache is not None else None
+            if cached is not None:
+                logger.info(f"短網址快取命中: {url} -> {cached['final_url']}")
+                resolved[url] = cached
+                continue
+            pending[url] = self._executor.submit(self._fetch, url, deadline_at)
+
+        if pending:
+            wait(pending.values(), timeout=max(0, deadline_at - time.time()))
+            for url, future in pending.items():
+                result = future.result() if future.done() else None
+                if result is None:
+                    future.cancel()
+                    with self._lock:
+                        self.deadline_exceeded += 1
+                    logger.warning(f"展開短網址超過期限: {url}")
+                    result = {'final_url': url, 'redirect_chain': [url], 'success': False, 'page_title': None}
+                resolved[url] = result
+
+        return [
+            {
+                'original_url': url,
+                'final_url': resolved[url]['final_url'],
+                'is_short_url': short_flags[url],
+                'success': resolved[url]['success'],
+                'redirect_chain': list(resolved[url]['redirect_chain']),
+                'page_title': resolved[url].get('page_title'),
+            }
+            for url in urls
+        ]
+
+    def expand(self, url, deadline=None):
+        """展開單一網址，結果格式與 expand_all 的項目相同"""
+        return self.expand_all([url], deadline)[0]
+
+    def get_stats(self):
+        """取得展開統計"""
+        with self._lock:
+            return {
+                'expansions': self.expansions,
+                'deadline_exceeded': self.deadline_exceeded,
+                'hops': self.hops,
+                'bytes_read': self.bytes_read,
+                'truncated_bodies': self.truncated_bodies,
+                'avoided_expansions': self.avoided_expansions,
+                'tracked_hosts': len(self._host_semaphores),
+            }
+
+
+# 全域短網址展開器實例（共用連線池與快取）
+short_url_expander = ShortURLExpander(cache=short_url_cache)
+
+
+def expand_short_urls(urls, deadline=None):
+    """同時展開多個短網址的便捷函數"""
+    return short_url_expander.expand_all(urls, deadline)
+
+
+def get_short_url_cache_stats():
+    """取得短網址快取統計的便捷函數"""
+    return short_url_cache.get_stats()
+
+
+def get_short_url_expander_stats():
+    """取得短網址展開統計的便捷函數"""
+    return short_url_expander.get_stats()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+結構化分析輸出模組
+以 JSON Schema（OpenAI structured outputs）要求模型直接回傳分析欄位，
+取代固定格式文字與逐行解析；欄位名稱刻意簡短以減少輸出 token。
+
+同時記錄每次呼叫的 token 用量，分別統計結構化輸出與舊版文字格式，
+可比較兩者每次呼叫平均使用的 token 數。
+"""
+
+import json
+import logging
+import threading
+
+from config import CHAT_SYSTEM_PROMPT, TEXT_ANALYSIS_INSTRUCTIONS, TEXT_ANALYSIS_FREE_TEXT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# 與舊版文字格式相同的風險等級
+RISK_LEVELS = ["極高", "高", "中高", "中", "低", "極低", "無風險"]
+
+# 文字訊息分析：JSON 欄位 -> 分析結果欄位
+TEXT_ANALYSIS_FIELDS = {
+    "risk": "risk_level",
+    "type": "fraud_type",
+    "reason": "explanation",
+    "advice": "suggestions",
+    "emerging": "is_emerging",
+}
+
+TEXT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "risk": {"type": "string", "enum": RISK_LEVELS},
+        "type": {"type": "string", "description": "具體詐騙類型，如釣魚網站、投資詐騙；非詐騙填「非詐騙相關」"},
+        "reason": {"type": "string", "description": "像鄰居朋友聊天的口語說明，不用專業術語"},
+        "advice": {"type": "string", "description": "簡單明確的建議，每點以emoji（🚫🔍🌐🛡️💡⚠️）開頭代替編號"},
+        "emerging": {"type": "boolean", "description": "是否為新興詐騙手法"},
+    },
+    "required": ["risk", "type", "reason", "advice", "emerging"],
+    "additionalProperties": False,
+}
+
+# 圖片分析：JSON 欄位 -> 分析結果欄位
+IMAGE_ANALYSIS_FIELDS = {
+    "risk": "risk_level",
+    "type": "fraud_type",
+    "reason": "explanation",
+    "advice": "suggestions",
+}
+
+IMAGE_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "risk": {"type": "string", "enum": RISK_LEVELS},
+        "type": {"type": "string", "description": "具體詐騙類型；非詐騙填「非詐騙相關」"},
+        "reason": {"type": "string", "description": "針對圖片實際內容，40字以內一句話說明為什麼要小心"},
+        "advice": {"type": "string", "description": "3個以內的建議，每點以emoji開頭"},
+    },
+    "required": ["risk", "type", "reason", "advice"],
+    "additionalProperties": False,
+}
+
+
+# 截圖單次分析：圖片分析欄位加上文字抄錄與 QR 碼資訊
+SCREENSHOT_ANALYSIS_FIELDS = dict(
+    IMAGE_ANALYSIS_FIELDS,
+    text="extracted_text",
+    qr="contains_qr_code",
+    qr_content="qr_content",
+    qr_risk="qr_risk_level",
+)
+
+SCREENSHOT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string", "description": "圖片中所有文字，保持原始排列；沒有文字填空字串"},
+        "qr": {"type": "boolean", "description": "圖片中是否有 QR 碼或條碼"},
+        "qr_content": {"type": "string", "description": "看得出的 QR 碼內容或用途；沒有 QR 碼填空字串"},
+        "qr_risk": {"type": "string", "enum": ["高", "中", "低"], "description": "QR 碼的詐騙風險；沒有 QR 碼填「低」"},
+        **IMAGE_ANALYSIS_SCHEMA["properties"],
+    },
+    "required": ["text", "qr", "qr_content", "qr_risk"] + IMAGE_ANALYSIS_SCHEMA["required"],
+    "additionalProperties": False,
+}
+
+
+def build_response_format(name, schema):
+    """產生 chat.completions 的 response_format 參數（strict JSON Schema）"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema},
+    }
+
+
+def text_analysis_system_prompt(structured=True):
+    """文字分析的系統提示（固定內容，以 CHAT_SYSTEM_PROMPT 開頭，可被提示詞前綴快取重複使用）"""
+    prompt = CHAT_SYSTEM_PROMPT + "\n" + TEXT_ANALYSIS_INSTRUCTIONS
+    return prompt if structured else prompt + "\n" + TEXT_ANALYSIS_FREE_TEXT_FORMAT
+
+
+def build_text_analysis_messages(analysis_message, special_notes="", structured=True):
+    """
+    產生文字分析的 messages（線上分析與批次重新分析共用）
+
+    固定的指示全部在系統提示，補充說明與訊息等可變內容只放在最後的使用者內容。
+    """
+    notes = f"補充說明：{special_notes}\n" if special_notes else ""
+    return [
+        {"role": "system", "content": text_analysis_system_prompt(structured)},
+        {"role": "user", "content": f"{notes}訊息：\n---\n{analysis_message}\n---"},
+    ]
+
+
+def parse_structured_analysis(content, fields):
+    """
+    解析結構化輸出
+
+    Args:
+        content: 模型回傳的 JSON 文字
+        fields: JSON 欄位與分析結果欄位的對應
+
+    Returns:
+        dict 或 None: 分析結果；不是合法 JSON 或缺少欄位時返回 None
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or any(key not in data for key in fields):
+        return None
+
+    result = {}
+    for key, field in fields.items():
+        value = data[key]
+        if isinstance(value, str):
+            value = value.strip()
+        result[field] = value
+    return result
+
+
+class TokenUsageTracker:
+    """依路由與輸出模式（structured / free_text）統計 token 用量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, usage, structured):
+        """
+        記錄一次呼叫的 token 用量
+
+        Args:
+            route: 呼叫用途（如 text_analysis、vision）
+            usage: OpenAI 回應的 usage 物件（可為 None）
+            structured: 是否使用結構化輸出
+        """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        mode = 'structured' if structured else 'free_text'
+        logger.info(f"{route} token 用量（{mode}）：輸入 {prompt_tokens}，輸出 {completion_tokens}")
+
+        with self._lock:
+            modes = self._routes.setdefault(route, {})
+            totals = modes.setdefault(mode, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+
+    def get_stats(self):
+        """取得各路由的平均用量，兩種模式都有資料時附上結構化輸出每次平均節省的 token 數"""
+        with self._lock:
+            stats = {}
+            for route, modes in self._routes.items():
+                route_stats = {}
+                for mode, totals in modes.items():
+                    calls = totals['calls']
+                    route_stats[mode] = dict(
+                        totals,
+                        avg_prompt_tokens=round(totals['prompt_tokens'] / calls, 1),
+                        avg_completion_tokens=round(totals['completion_tokens'] / calls, 1),
+                    )
+                if 'structured' in route_stats and 'free_text' in route_stats:
+                    structured, free_text = route_stats['structured'], route_stats['free_text']
+                    route_stats['avg_tokens_saved_per_call'] = round(
+                        free_text['avg_prompt_tokens'] + free_text['avg_completion_tokens']
+                        - structured['avg_prompt_tokens'] - structured['avg_completion_tokens'], 1
+                    )
+                stats[route] = route_stats
+            return stats
+
+
+# 全域 token 用量統計
+token_usage_tracker = TokenUsageTracker()
+
+
+def record_token_usage(route, response, structured):
+    """記錄 OpenAI 回應的 token 用量"""
+    token_usage_tracker.record(route, getattr(response, 'usage', None), structured)
+
+
+def get_token_usage_stats():
+    """取得 token 用量統計"""
+    return token_usage_tracker.get_stats()
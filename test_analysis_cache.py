@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試詐騙分析結果快取
+"""
+
+import os
+import sys
+import time
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analysis_cache import (
+    AnalysisResultCache, NearDuplicateIndex, make_analysis_cache_key, mask_entities, normalize_message
+)
+
+_PARCEL_SCAM = "【通知】您的包裹因地址不完整無法配送，請於24小時內點擊 https://t.ly/abcd 更新資料，客服LINE ID: abc123，運費補繳39元"
+_PARCEL_SCAM_VARIANT = "【通知】您的包裹因地址不完整無法配送，請於 12 小時內點擊 https://bit.ly/zzz 更新資料，客服LINE ID: kkk777 ，運費補繳 59 元"
+_UNRELATED = "阿姨好，明天早上十點社區活動中心有健康講座，會發放免費的口罩和衛生紙，記得帶健保卡來報到喔"
+
+
+class _DictBackend:
+    """以字典模擬 Firestore 共用快取"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get_analysis_cache_entry(self, key):
+        return self.entries.get(key)
+
+    def set_analysis_cache_entry(self, key, entry):
+        self.entries[key] = entry
+        return True
+
+
+def _result(display_name):
+    return {"risk_level": "高風險", "fraud_type": "投資詐騙", "explanation": "保證獲利", "display_name": display_name}
+
+
+def test_cache_key_normalization():
+    """測試轉傳造成的空白、全形與零寬字元差異不影響快取鍵，展開後的網址與提示詞版本會影響"""
+    assert normalize_message("  保證獲利\u200b  加LINE ") == "保證獲利 加LINE"
+    key = make_analysis_cache_key("保證獲利 加ＬＩＮＥ", ["https://a.example/x"], "v1", "gpt-4.1-mini")
+    assert key == make_analysis_cache_key(" 保證獲利\n加LINE\u200b", ["https://a.example/x"], "v1", "gpt-4.1-mini")
+    assert key != make_analysis_cache_key("保證獲利 加LINE", ["https://b.example/x"], "v1", "gpt-4.1-mini")
+    assert key != make_analysis_cache_key("保證獲利 加LINE", ["https://a.example/x"], "v2", "gpt-4.1-mini")
+    assert key != make_analysis_cache_key("保證獲利 加LINE", ["https://a.example/x"], "v1", "gpt-4o")
+
+
+def test_cache_personalizes_ttl_and_bound():
+    """測試命中時填入各自的使用者名稱、過期項目失效，以及快取筆數上限"""
+    cache = AnalysisResultCache(max_size=2, ttl=0.2)
+    cache.put("k1", _result("小明"), "原始回應")
+
+    result, raw_result = cache.get("k1", display_name="阿嬤")
+    assert result["display_name"] == "阿嬤"
+    assert raw_result == "原始回應"
+    # 取出的結果被修改不影響快取
+    result["explanation"] = "改過"
+    assert cache.get("k1")[0]["explanation"] == "保證獲利"
+    assert "display_name" not in cache.get("k1")[0]
+
+    cache.put("k2", _result("小明"), "")
+    cache.put("k3", _result("小明"), "")
+    assert cache.get_stats()["evictions"] == 1
+
+    time.sleep(0.25)
+    assert cache.get("k3") is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_cache_shared_backend():
+    """測試新的執行個體可以從共用快取取得其他執行個體的分析結果"""
+    backend = _DictBackend()
+    writer = AnalysisResultCache(shared_backend=backend)
+    writer.put("k", _result("小明"), "原始回應")
+    writer._writer.shutdown(wait=True)
+    assert "display_name" not in backend.entries["k"]["result"]
+
+    reader = AnalysisResultCache(shared_backend=backend)
+    result, _ = reader.get("k", display_name="阿公")
+    assert result["display_name"] == "阿公"
+    assert reader.get("k") is not None
+    stats = reader.get_stats()
+    assert stats["shared_hits"] == 1 and stats["hits"] == 1
+
+
+def test_near_duplicate_index():
+    """測試只換了電話、帳號、金額與網址的訊息會命中，無關訊息、過短訊息與低風險判定不會"""
+    assert mask_entities("加賴 scam_99 或撥 0912-345-678 領 5,000 元") == "<帳號> 或撥 <電話> 領 <數字>"
+
+    index = NearDuplicateIndex(max_distance=6)
+    fingerprint = index.fingerprint(_PARCEL_SCAM)
+    assert index.add(fingerprint, "scam-key", "高風險")
+    assert not index.add(index.fingerprint(_UNRELATED), "benign-key", "低風險")
+
+    assert index.find(index.fingerprint(_PARCEL_SCAM_VARIANT)) == ("scam-key", 0)
+    assert index.find(index.fingerprint(_UNRELATED)) is None
+    assert index.fingerprint("點擊 https://t.ly/x") is None
+
+    stats = index.get_stats()
+    assert stats["size"] == 1
+    assert stats["hits"] == 1 and stats["lookups"] == 2
+    assert stats["distance_counts"][0] == 1
+
+
+def test_detect_fraud_reuses_cached_analysis():
+    """測試重複與近似重複的詐騙訊息不再呼叫完整分析，並以各自的使用者名稱回覆"""
+    import anti_fraud_clean_app as app_module
+    from analysis_cache import analysis_cache, near_duplicate_index
+    from llm_gateway import LLMGateway
+
+    class _Completions:
+        def __init__(self):
+            self.prompts = []
+
+        def create(self, model, messages, **kwargs):
+            self.prompts.append(messages[-1]["content"])
+            if kwargs.get("max_tokens") == 2:
+                content = "是"
+            elif "response_format" in kwargs:
+                content = '{"risk": "高", "type": "假物流詐騙", "reason": "要你補繳運費", "advice": "🚫 不要點連結", "emerging": false}'
+            else:
+                content = "風險等級：高\n詐騙類型：假物流詐騙\n說明：要你補繳運費\n建議：🚫 不要點連結\n新興手法：否"
+            message = type("Message", (), {"content": content})()
+            return type("Response", (), {"choices": [type("Choice", (), {"message": message})()], "usage": None})()
+
+    completions = _Completions()
+    fake_client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    original_gateway, original_mode = app_module.llm_gateway, app_module.NEAR_DUPLICATE_MODE
+    original_local = app_module.LOCAL_RISK_SCORING
+    # 關閉本地評分，讓訊息一定會進到 OpenAI 分析
+    app_module.llm_gateway, app_module.NEAR_DUPLICATE_MODE = LLMGateway(client=fake_client), "confirm"
+    app_module.LOCAL_RISK_SCORING = False
+    analysis_cache.clear()
+    try:
+        message = _PARCEL_SCAM.replace("https://t.ly/abcd ", "")
+        first = app_module.detect_fraud_with_chatgpt(message, display_name="小明")
+        again = app_module.detect_fraud_with_chatgpt(message, display_name="阿嬤")
+        variant = app_module.detect_fraud_with_chatgpt(
+            _PARCEL_SCAM_VARIANT.replace("https://bit.ly/zzz ", ""), display_name="阿公")
+    finally:
+        app_module.llm_gateway, app_module.NEAR_DUPLICATE_MODE = original_gateway, original_mode
+        app_module.LOCAL_RISK_SCORING = original_local
+
+    assert first["result"]["fraud_type"] == "假物流詐騙"
+    assert again["cache_hit"] and again["result"]["display_name"] == "阿嬤"
+    assert variant["near_duplicate_distance"] == 0 and variant["result"]["display_name"] == "阿公"
+    # 一次完整分析加上一次確認
+    assert len(completions.prompts) == 2
+    assert near_duplicate_index.get_stats()["outcomes"].get("confirmed") == 1
+
+
+if __name__ == "__main__":
+    test_cache_key_normalization()
+    test_cache_personalizes_ttl_and_bound()
+    test_cache_shared_backend()
+    test_near_duplicate_index()
+    test_detect_fraud_reuses_cached_analysis()
+    print("✅ 詐騙分析結果快取測試通過")
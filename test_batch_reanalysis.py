@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試批次重新分析（以本地替身取代 Batch API 與 Firestore，不需連網）
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from batch_reanalysis import BatchReanalysisJob, LocalBatchStub, write_batch_files
+from firebase_manager import FirebaseManager
+
+
+class _Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _Query:
+    def __init__(self, db, collection, after=None, size=None):
+        self._db, self._collection, self._after, self._size = db, collection, after, size
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, size):
+        return _Query(self._db, self._collection, self._after, size)
+
+    def start_after(self, doc):
+        return _Query(self._db, self._collection, doc.id, self._size)
+
+    def stream(self):
+        self._db.queries += 1
+        ids = sorted(doc_id for doc_id in self._db.data[self._collection] if self._after is None or doc_id > self._after)
+        return [_Doc(doc_id, self._db.data[self._collection][doc_id]) for doc_id in ids[:self._size]]
+
+    def document(self, doc_id):
+        return (self._collection, doc_id)
+
+
+class _Batch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def update(self, ref, data):
+        self._writes.append((ref, data))
+
+    def commit(self):
+        self._db.commits.append(len(self._writes))
+        for (collection, doc_id), data in self._writes:
+            self._db.data[collection][doc_id].update(data)
+
+
+class _FakeFirestore:
+    """只實作串流分頁與批次寫入的 Firestore 替身"""
+
+    def __init__(self, data):
+        self.data = data
+        self.queries = 0
+        self.commits = []
+
+    def collection(self, name):
+        return _Query(self, name)
+
+    def batch(self):
+        return _Batch(self)
+
+
+def _firebase_manager(data):
+    manager = FirebaseManager.__new__(FirebaseManager)
+    manager.db = _FakeFirestore(data)
+    return manager
+
+
+def test_stream_and_batch_write():
+    """測試依頁串流讀取整個集合，並依上限分批寫入"""
+    manager = _firebase_manager({'fraud_reports': {f"r{i:02d}": {'message': str(i)} for i in range(7)}})
+    reports = list(manager.stream_collection('fraud_reports', page_size=3))
+    assert [report['id'] for report in reports] == [f"r{i:02d}" for i in range(7)]
+    assert manager.db.queries == 3
+
+    written = manager.batch_update_documents('fraud_reports', {f"r{i:02d}": {'checked': True} for i in range(5)}, batch_size=2)
+    assert written == 5 and manager.db.commits == [2, 2, 1]
+    assert manager.db.data['fraud_reports']['r04']['checked']
+
+
+def test_write_batch_files_splits():
+    """測試超過每檔請求數上限時換下一個輸入檔"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        files = write_batch_files(({"custom_id": str(i)} for i in range(5)), output_dir, max_requests=2)
+        assert [count for _, count in files] == [2, 2, 1]
+        with open(files[-1][0], encoding='utf-8') as f:
+            assert json.loads(f.read()) == {"custom_id": "4"}
+
+
+def test_job_end_to_end():
+    """測試完整流程：讀取兩個集合、送出批次、輪詢、寫回結果，失敗的請求不寫入"""
+    manager = _firebase_manager({
+        'fraud_reports': {
+            'a': {'message': "恭喜中獎，請先匯手續費", 'fraud_type': "舊類型", 'risk_level': "中"},
+            'b': {'message': "晚上一起吃飯"},
+            'c': {'message': ""},
+        },
+        'emerging_fraud_reports': {
+            'x': {'user_message_description': "有人冒充檢察官要我交出存摺"},
+            'y': {'user_message_description': "失敗的請求"},
+        },
+    })
+
+    def responder(prompt):
+        if "失敗" in prompt:
+            return None
+        risk = "高" if "中獎" in prompt or "檢察官" in prompt else "低"
+        return {"risk": risk, "type": "新類型" if risk == "高" else "非詐騙相關", "reason": "說明", "advice": "💡 建議", "emerging": False}
+
+    sleeps = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        job = BatchReanalysisJob(LocalBatchStub(responder), manager, model="test-model",
+                                 output_dir=output_dir, relabel=True, sleep=sleeps.append)
+        stats = job.run()
+
+    assert stats == {'requests': 4, 'batches': 1, 'succeeded': 3, 'failed': 1, 'written': 3}
+    assert len(sleeps) == 1
+    data = manager.db.data
+    assert data['fraud_reports']['a']['fraud_type'] == "新類型" and data['fraud_reports']['a']['risk_level'] == "高"
+    assert data['fraud_reports']['a']['reanalysis']['model'] == "test-model"
+    assert data['fraud_reports']['b']['reanalysis']['fraud_type'] == "非詐騙相關"
+    assert 'reanalysis' not in data['fraud_reports']['c']
+    assert data['emerging_fraud_reports']['x']['reanalysis']['risk_level'] == "高"
+    assert 'reanalysis' not in data['emerging_fraud_reports']['y']
+
+
+if __name__ == "__main__":
+    test_stream_and_batch_write()
+    test_write_batch_files_splits()
+    test_job_end_to_end()
+    print("✅ 批次重新分析測試通過")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試 OpenAI 斷路器與初步結果
+"""
+
+import os
+import sys
+import time
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, LatencyBudgetExceeded
+
+_UNCERTAIN_MESSAGE = "您好，我是大樓管理室，明天下午會有師傅到府檢查水管，費用之後再跟您說明"
+
+
+def _fail():
+    raise RuntimeError("上游錯誤")
+
+
+def test_opens_on_errors_and_recovers():
+    """測試錯誤率超過門檻時斷路，斷路期間直接拒絕，半開試探成功後恢復"""
+    breaker = CircuitBreaker("test", window=4, min_calls=4, error_rate=0.5, open_seconds=0.1)
+    assert breaker.call(lambda: "ok") == "ok"
+    for _ in range(3):
+        try:
+            breaker.call(_fail)
+        except RuntimeError:
+            pass
+    assert breaker.state == "open"
+    try:
+        breaker.call(lambda: "ok")
+        assert False, "斷路中應該拒絕請求"
+    except CircuitOpenError:
+        pass
+
+    time.sleep(0.15)
+    assert breaker.state == "half_open"
+    assert breaker.call(lambda: "ok") == "ok"
+    stats = breaker.get_stats()
+    assert stats["state"] == "closed" and stats["opened"] == 1 and stats["rejected"] == 1
+
+
+def test_opens_on_p95_latency():
+    """測試 p95 延遲超過門檻時斷路"""
+    breaker = CircuitBreaker("test", window=10, min_calls=5, p95_latency=1.0)
+    for latency in (0.1, 0.2, 0.1, 0.2):
+        breaker.record(True, latency)
+    assert breaker.state == "closed"
+    breaker.record(True, 5.0)
+    assert breaker.state == "open"
+
+
+def test_latency_budget():
+    """測試超過延遲預算時呼叫端立即返回，背景完成的結果仍可取得並計入統計"""
+    breaker = CircuitBreaker("test")
+
+    def slow():
+        time.sleep(0.2)
+        return "晚到的結果"
+
+    start = time.monotonic()
+    try:
+        breaker.call(slow, latency_budget=0.05)
+        assert False, "應該超過延遲預算"
+    except LatencyBudgetExceeded as e:
+        assert time.monotonic() - start < 0.15
+        assert e.future.result(timeout=1) == "晚到的結果"
+    time.sleep(0.01)
+    stats = breaker.get_stats()
+    assert stats["budget_exceeded"] == 1 and stats["calls"] == 1
+    assert stats["window_p95_latency"] >= 0.2
+
+
+def test_detect_fraud_returns_preliminary_result_when_open():
+    """測試斷路時文字分析不呼叫 OpenAI，改回覆標示為初步結果的本地判斷"""
+    import anti_fraud_clean_app as app_module
+    from llm_gateway import LLMGateway
+
+    class _Completions:
+        calls = 0
+
+        def create(self, **kwargs):
+            _Completions.calls += 1
+            raise AssertionError("斷路中不應呼叫 OpenAI")
+
+    fake_client = type("Client", (), {"chat": type("Chat", (), {"completions": _Completions()})()})()
+    open_breaker = CircuitBreaker("test", min_calls=1)
+    open_breaker.record(False, 0.0)
+
+    original_gateway = app_module.llm_gateway
+    app_module.llm_gateway = LLMGateway(client=fake_client, breaker=open_breaker)
+    try:
+        response = app_module.detect_fraud_with_chatgpt(_UNCERTAIN_MESSAGE, display_name="阿嬤")
+    finally:
+        app_module.llm_gateway = original_gateway
+
+    assert response["success"] and response["preliminary"]
+    assert response["result"]["is_preliminary"]
+    assert response["result"]["explanation"].startswith("⏳ 初步結果")
+    assert response["result"]["display_name"] == "阿嬤"
+    assert _Completions.calls == 0
+
+
+if __name__ == "__main__":
+    test_opens_on_errors_and_recovers()
+    test_opens_on_p95_latency()
+    test_latency_budget()
+    test_detect_fraud_returns_preliminary_result_when_open()
+    print("✅ OpenAI 斷路器測試通過")
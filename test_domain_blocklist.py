@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地詐騙網域黑名單測試（不需要網路連線）
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from domain_blocklist import DomainBlocklist, ingest_feeds, normalize_domain
+
+
+def _write_feed(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path
+
+
+def test_normalize_domain():
+    """測試網址與網域的標準化"""
+    assert normalize_domain("https://WWW.Evil-Shop.com:8443/login?a=1") == "evil-shop.com"
+    assert normalize_domain("evil-shop.com/path") == "evil-shop.com"
+    assert normalize_domain("gооgle.com").startswith("xn--")
+    assert normalize_domain("not a domain") is None
+    assert normalize_domain("localhost") is None
+
+
+def test_ingest_and_lookup():
+    """測試匯入、子網域比對、白名單排除與合併"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        feed = _write_feed(tmp_dir, "feed.txt", "# 165 匯出\nhttps://evil-shop.com/login\nwww.fake-bank.tw\nsites.google.com\n")
+        csv_feed = _write_feed(tmp_dir, "feed.csv", 'id,url\n1,"https://scam-a.cc/x"\n')
+        output = os.path.join(tmp_dir, "blocklist.bin")
+
+        stats = ingest_feeds([feed], output, whitelist={"google.com"})
+        assert stats['ingested_domains'] == 2
+        assert stats['skipped_whitelisted'] == 1
+
+        blocklist = DomainBlocklist(output)
+        assert blocklist.match_host("https://evil-shop.com/x") == "evil-shop.com"
+        assert blocklist.match_host("login.evil-shop.com") == "evil-shop.com"
+        assert blocklist.match_host("fake-bank.tw") == "fake-bank.tw"
+        assert blocklist.match_host("sites.google.com") is None
+        assert blocklist.match_host("shop.com") is None
+        assert blocklist.find_blocklisted_url(["google.com", "evil-shop.com"]) == {
+            'url': "evil-shop.com", 'blocked_domain': "evil-shop.com"
+        }
+
+        ingest_feeds([csv_feed], output, merge=True)
+        assert blocklist.reload()
+        assert blocklist.match_host("scam-a.cc") == "scam-a.cc"
+        assert blocklist.match_host("evil-shop.com") == "evil-shop.com"
+        assert blocklist.get_stats()['entries'] == 3
+
+
+def test_public_suffixes_and_whitelist_are_not_blocked():
+    """測試來源檔中單獨的公開後綴與白名單網域不會寫入黑名單，否則會封鎖底下所有網站"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        feed = _write_feed(tmp_dir, "feed.txt", "com.tw\nhttps://gov.tw/\ngithub.io\nevil-shop.com.tw\ngoogle.com\n")
+        output = os.path.join(tmp_dir, "blocklist.bin")
+
+        stats = ingest_feeds([feed], output)
+        assert stats['skipped_public_suffixes'] == 3
+        assert stats['skipped_whitelisted'] == 1
+        assert stats['ingested_domains'] == 1
+
+        blocklist = DomainBlocklist(output)
+        assert blocklist.match_host("shop.evil-shop.com.tw") == "evil-shop.com.tw"
+        assert blocklist.match_host("www.cht.com.tw") is None
+        assert blocklist.match_host("165.npa.gov.tw") is None
+        assert blocklist.match_host("google.com") is None
+
+
+def test_missing_blocklist_is_ignored():
+    """測試黑名單檔案不存在時不會命中"""
+    blocklist = DomainBlocklist(os.path.join(tempfile.gettempdir(), "missing-blocklist.bin"))
+    assert blocklist.match_host("evil-shop.com") is None
+    assert blocklist.get_stats()['loaded'] is False
+
+
+if __name__ == "__main__":
+    test_normalize_domain()
+    test_ingest_and_lookup()
+    test_public_suffixes_and_whitelist_are_not_blocked()
+    test_missing_blocklist_is_ignored()
+    print("✅ 詐騙網域黑名單測試通過")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+網域變形檢測模組測試（不需要網路連線）
+"""
+
+import sys
+import os
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from domain_spoofing_detector import (
+    detect_domain_spoofing, detect_domain_spoofing_many, SpoofVerdictCache, get_safe_domains_version,
+    _confusable_skeleton, _decode_idna_host
+)
+
+SAFE_DOMAINS = {
+    "google.com": "Google 搜尋引擎",
+    "shopee.tw": "蝦皮購物",
+    "cht.com.tw": "中華電信",
+    "gov.tw": "中華民國政府網站",
+}
+
+
+def test_basic_verdicts():
+    """測試基本的變形網域與白名單判斷"""
+    assert detect_domain_spoofing("https://www.google.com", SAFE_DOMAINS)['is_spoofed'] is False
+    assert detect_domain_spoofing("cht.tw", SAFE_DOMAINS)['is_spoofed'] is False
+
+    result = detect_domain_spoofing("請點 google-tw.com 領獎", SAFE_DOMAINS)
+    assert result['is_spoofed'] is True
+    assert result['original_domain'] == "google.com"
+
+
+def test_verdict_cache_hits_and_copies():
+    """測試重複網域命中快取，且返回值修改不影響快取"""
+    first = detect_domain_spoofing("shopee-tw.com", SAFE_DOMAINS)
+    first['spoofed_domain'] = "被修改"
+    second = detect_domain_spoofing("shopee-tw.com", SAFE_DOMAINS)
+    assert second['spoofed_domain'] == "shopee-tw.com"
+
+
+def test_cache_invalidated_when_registry_changes():
+    """測試白名單版本改變時快取自動失效"""
+    cache = SpoofVerdictCache(max_size=2)
+    version = get_safe_domains_version(SAFE_DOMAINS)
+    cache.put("a.com", version, {'is_spoofed': False})
+    assert cache.get("a.com", version) == {'is_spoofed': False}
+
+    new_version = get_safe_domains_version(dict(SAFE_DOMAINS, **{"line.me": "LINE"}))
+    assert new_version != version
+    assert cache.get("a.com", new_version) is None
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['invalidations'] == 1
+
+
+def test_cache_is_bounded():
+    """測試快取容量上限與LRU淘汰"""
+    cache = SpoofVerdictCache(max_size=2)
+    cache.put("a.com", "v1", {'is_spoofed': False})
+    cache.put("b.com", "v1", {'is_spoofed': False})
+    cache.get("a.com", "v1")
+    cache.put("c.com", "v1", {'is_spoofed': False})
+
+    assert cache.get("b.com", "v1") is None
+    assert cache.get("a.com", "v1") is not None
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_homograph_skeleton():
+    """測試易混淆骨架與 punycode 解碼"""
+    assert _confusable_skeleton("g00gle.com") == "google.com"
+    assert _confusable_skeleton("gооgle.com") == "google.com"  # 西里爾字母 о
+    assert _confusable_skeleton("rnicrosoft.com") == "microsoft.com"
+    assert _decode_idna_host("xn--ggle-55da.com") != "xn--ggle-55da.com"
+
+
+def test_idn_homograph_detected():
+    """測試 punycode 國際化網域的相似字元攻擊"""
+    punycode_host = "gооgle.com".encode("idna").decode("ascii")
+    result = detect_domain_spoofing(f"https://{punycode_host}/login", SAFE_DOMAINS)
+    assert result['is_spoofed'] is True
+    assert result['original_domain'] == "google.com"
+    assert result['spoofing_type'] == "相似字元攻擊"
+
+
+def test_many_reports_every_spoofed_host():
+    """測試批次檢測會去重並回報每一個變形網域"""
+    verdicts = detect_domain_spoofing_many(
+        ["google-tw.com", "https://Google-TW.com/login", "www.google.com", "shopee-tw.com", ""],
+        SAFE_DOMAINS
+    )
+    assert list(verdicts) == ["google-tw.com", "www.google.com", "shopee-tw.com"]
+    assert verdicts["www.google.com"]['is_spoofed'] is False
+    spoofed = [host for host, verdict in verdicts.items() if verdict['is_spoofed']]
+    assert spoofed == ["google-tw.com", "shopee-tw.com"]
+    assert verdicts["shopee-tw.com"]['original_domain'] == "shopee.tw"
+
+
+if __name__ == "__main__":
+    test_basic_verdicts()
+    test_verdict_cache_hits_and_copies()
+    test_cache_invalidated_when_registry_changes()
+    test_cache_is_bounded()
+    test_homograph_skeleton()
+    test_idn_homograph_detected()
+    test_many_reports_every_spoofed_host()
+    print("✅ 網域變形檢測測試通過")
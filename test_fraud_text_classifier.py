@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試詐騙文字分類器
+"""
+
+import os
+import sys
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fraud_text_classifier import (
+    FraudTextClassifier, extract_features, fraud_type_group, train_model
+)
+
+_PARCEL_SCAM = "【中華郵政】您的包裹因地址不完整無法投遞，請點擊 https://tw-post-update.com 更新收件地址，逾期將退回"
+_GREETING = "阿嬤早安，今天天氣很好，記得吃早餐喔，晚上一起去市場買菜"
+
+
+def test_features_ignore_entities():
+    """測試只換了網址、電話與金額的訊息得到相同的特徵"""
+    a = extract_features("請撥 0912-345-678 並匯款 5000 元到 https://a.example/x", n_features=2 ** 10)
+    b = extract_features("請撥 0987 654 321 並匯款 12,000 元到 https://b.example/y", n_features=2 ** 10)
+    assert a == b
+    assert abs(sum(value * value for value in a.values()) - 1.0) < 1e-9
+    assert fraud_type_group("假冒Netflix（帳戶問題）") == "釣魚簡訊詐騙"
+    assert fraud_type_group("假冒台水公司詐騙") == "假冒機構詐騙"
+
+
+def test_train_and_predict():
+    """測試以少量訊息訓練後，相似的訊息得到一致的預測"""
+    messages = [
+        "恭喜您中獎了，請先匯手續費到指定帳戶領取獎金",
+        "您的包裹地址不完整，請點連結更新收件地址",
+        "今天晚上全家一起吃飯，記得早點回來",
+        "明天社區活動中心有健康講座，歡迎參加",
+    ]
+    classifier = FraudTextClassifier(train_model(
+        messages, [1, 1, 0, 0], ["中獎詐騙", "釣魚簡訊詐騙", None, None], n_features=2 ** 10, epochs=200
+    ))
+    prediction = classifier.predict("恭喜中獎，請先匯手續費領獎金")
+    assert prediction["fraud_probability"] > 0.5
+    assert prediction["fraud_type"] == "中獎詐騙"
+    assert classifier.predict("晚上全家一起吃飯")["fraud_probability"] < 0.5
+    assert classifier.get_stats()["predictions"] == 2
+
+
+def test_bundled_model():
+    """測試隨附的模型檔可以載入，且推論在 1 毫秒內完成"""
+    classifier = FraudTextClassifier.load()
+    assert classifier.available
+    assert classifier.predict(_PARCEL_SCAM)["fraud_probability"] > 0.5
+    assert classifier.predict(_GREETING)["fraud_probability"] < 0.5
+    for _ in range(50):
+        classifier.predict(_PARCEL_SCAM)
+    assert classifier.get_stats()["avg_latency_ms"] < 1.0
+
+
+if __name__ == "__main__":
+    test_features_ignore_entities()
+    test_train_and_predict()
+    test_bundled_model()
+    print("✅ 詐騙文字分類器測試通過")
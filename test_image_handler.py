@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試截圖分析：單次 Vision 呼叫與本地 QR 碼解碼（以假的 OpenAI 客戶端與解碼器取代）
+"""
+
+import os
+import sys
+import json
+from io import BytesIO
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+import image_analysis_service
+from image_handler import ImageHandler
+from llm_gateway import LLMGateway
+from qr_decoder import QRCodeDecoder
+from screenshot_cache import screenshot_cache
+
+
+def _png():
+    buffered = BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class _Completions:
+    """依序回傳指定 JSON 的假 OpenAI 客戶端"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.routes = []
+
+    def create(self, messages, **kwargs):
+        self.routes.append(kwargs["response_format"]["json_schema"]["name"])
+        message = type("Message", (), {"content": json.dumps(self.answer, ensure_ascii=False)})()
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})()], "usage": None})()
+
+
+def _analyze(answer, qr_codes=None, image=None, clear_cache=True):
+    completions = _Completions(answer)
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    service = image_analysis_service.image_analysis_service
+    original_gateway, original_decoder = service.gateway, image_analysis_service.qr_decoder
+    service.gateway = LLMGateway(client=client)
+    image_analysis_service.qr_decoder = QRCodeDecoder(backend=lambda image: list(qr_codes or []))
+    if clear_cache:
+        # 每個測試都用同一張空白圖片，避免沿用前一個測試的截圖快取
+        screenshot_cache.clear()
+    try:
+        result = ImageHandler()._analyze_image_content(image or _png(), "", "GENERAL")
+    finally:
+        service.gateway, image_analysis_service.qr_decoder = original_gateway, original_decoder
+    return result, completions.routes
+
+
+def _answer(text, qr=False, qr_risk="低", risk="低"):
+    return {"text": text, "qr": qr, "qr_content": "付款連結" if qr else "", "qr_risk": qr_risk,
+            "risk": risk, "type": "非詐騙相關" if risk == "低" else "投資詐騙", "reason": "看起來是一般內容", "advice": "😊 放心"}
+
+
+def test_single_call_with_qr():
+    """測試只呼叫一次 Vision，本地解不出 QR 碼時沿用模型看到的高風險 QR 碼"""
+    result, routes = _analyze(_answer("加入投資群組保證獲利，掃碼付款", qr=True, qr_risk="高", risk="中"))
+    assert routes == ["screenshot_fraud_analysis"]
+    assert result["extracted_text"] == "加入投資群組保證獲利，掃碼付款"
+    assert result["risk_level"] == "高風險" and result["fraud_type"] == "可疑QR碼詐騙"
+    assert "qr_result" not in result
+
+
+def test_local_checks_use_single_call_text():
+    """測試本地檢查（土豆防詐機器人內容）改用單次分析回傳的文字"""
+    result, routes = _analyze(_answer("土豆防詐機器人提醒您查看個人檔案"))
+    assert routes == ["screenshot_fraud_analysis"]
+    assert result["analysis_source"] == "土豆防詐機器人檢測"
+    assert result["extracted_text"] == "土豆防詐機器人提醒您查看個人檔案"
+
+
+def test_local_qr_urls_use_url_checks():
+    """測試本地解出的 QR 碼網址經過網域變形與白名單檢查，不花費額外的 OpenAI 呼叫"""
+    result, routes = _analyze(_answer("掃描下方QR碼登入"), qr_codes=["https://www.g00gle.com/login"])
+    assert routes == ["screenshot_fraud_analysis"]
+    assert result["risk_level"] == "高風險" and result["fraud_type"] == "可疑QR碼詐騙"
+    assert result["analysis_source"] == "QR碼網址檢查"
+    assert "g00gle.com" in result["explanation"]
+
+    result, routes = _analyze(_answer("掃描下方QR碼搜尋"), qr_codes=["https://www.google.com", "WIFI:S:home;;"])
+    assert routes == ["screenshot_fraud_analysis"]
+    assert result["risk_level"] == "低" and result["qr_url_analysis"]["fraud_type"] == "非詐騙相關"
+    assert result["qr_codes"] == ["https://www.google.com", "WIFI:S:home;;"]
+
+    # 沒有命中黑名單、網域變形或白名單的網址只附上內容，交給 Vision 的判斷
+    result, routes = _analyze(_answer("掃碼付款"), qr_codes=["https://tinyshop.example.net/pay"])
+    assert routes == ["screenshot_fraud_analysis"]
+    assert "qr_url_analysis" not in result and "tinyshop.example.net/pay" in result["explanation"]
+
+    decoder = QRCodeDecoder(backend=lambda image: ["https://a.example", "https://a.example", "12345"])
+    assert decoder.decode(Image.new("RGB", (8, 8)))["urls"] == ["https://a.example"]
+    assert decoder.get_stats()["codes"] == 2
+
+
+def test_forwarded_screenshot_reuses_analysis():
+    """測試轉傳時被重新壓縮的同一張高風險截圖沿用分析結果，不再呼叫 Vision"""
+    image = Image.new("RGB", (720, 1280), "white")
+    for y in range(0, 1280, 160):
+        image.paste((133, 226, 73), (40, y + 20, 520, y + 120))
+    original, recompressed = BytesIO(), BytesIO()
+    image.save(original, format="PNG")
+    image.save(recompressed, format="JPEG", quality=60)
+
+    answer = _answer("保證獲利，加入VIP投資群組", risk="高")
+    result, routes = _analyze(answer, image=original.getvalue())
+    assert routes == ["screenshot_fraud_analysis"] and result["risk_level"] == "高"
+    result, routes = _analyze(answer, image=recompressed.getvalue(), clear_cache=False)
+    assert routes == [] and result["risk_level"] == "高"
+    assert result["extracted_text"] == "保證獲利，加入VIP投資群組"
+    # 解出不同的QR碼內容時不沿用
+    result, routes = _analyze(answer, qr_codes=["https://pay.example/other"], image=recompressed.getvalue(), clear_cache=False)
+    assert routes == ["screenshot_fraud_analysis"]
+
+
+if __name__ == "__main__":
+    test_single_call_with_qr()
+    test_local_checks_use_single_call_text()
+    test_local_qr_urls_use_url_checks()
+    test_forwarded_screenshot_reuses_analysis()
+    print("✅ 截圖分析測試通過")
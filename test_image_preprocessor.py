@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試圖片前處理（解碼、縮小、編碼各一次）
+"""
+
+import os
+import sys
+import random
+from io import BytesIO
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+
+from image_preprocessor import ImagePreprocessor, prepare_image, image_preprocessor
+
+
+def _screenshot(size=(1080, 2000), mode="RGB", fmt="PNG"):
+    """產生類似聊天截圖的圖片"""
+    rng = random.Random(1)
+    image = Image.new(mode, size, "#e8eef5")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, size[1], 90):
+        x = rng.choice([40, 400])
+        draw.rounded_rectangle([x, y + 10, x + 600, y + 80], 20, fill=rng.choice(["#ffffff", "#85e249"]))
+        draw.text((x + 20, y + 30), "請點擊 https://tw-post.example/abc 更新地址", fill="black")
+    buffered = BytesIO()
+    image.save(buffered, format=fmt)
+    return buffered.getvalue()
+
+
+def test_large_png_encoded_once_as_jpeg():
+    """測試大張 PNG 縮小後改以 JPEG 送出，QR 碼解碼用的圖片保留原始解析度"""
+    content = _screenshot()
+    preprocessor = ImagePreprocessor(max_size=1024, fmt="JPEG", quality=85)
+    prepared = preprocessor.prepare(content)
+    assert prepared.data_url.startswith("data:image/jpeg;base64,")
+    assert prepared.image.size == (1080, 2000)
+    assert prepared.encoded_bytes < prepared.original_bytes
+
+    png = BytesIO()
+    Image.open(BytesIO(content)).resize((553, 1024)).save(png, format="PNG")
+    assert prepared.encoded_bytes < len(png.getvalue())
+
+    stats = preprocessor.get_stats()
+    assert stats["images"] == 1 and stats["bytes_sent"] == prepared.encoded_bytes
+    assert stats["reused_original"] == 0 and stats["avg_encode_ms"] > 0
+
+
+def test_small_jpeg_and_transparency():
+    """測試不需縮小的 JPEG 直接送出原始檔，透明 PNG 以白色背景轉成 JPEG"""
+    content = _screenshot(size=(600, 800), fmt="JPEG")
+    preprocessor = ImagePreprocessor(fmt="JPEG")
+    prepared = preprocessor.prepare(content)
+    assert prepared.encoded_bytes == len(content)
+    assert preprocessor.get_stats()["reused_original"] == 1
+
+    prepared = preprocessor.prepare(_screenshot(size=(2000, 400), mode="RGBA"))
+    assert prepared.data_url.startswith("data:image/jpeg;base64,")
+
+    webp = ImagePreprocessor(fmt="WEBP", quality=80).prepare(_screenshot(size=(2000, 400)))
+    assert webp.data_url.startswith("data:image/webp;base64,")
+    assert prepare_image(webp) is webp
+
+
+def test_handler_prepares_each_image_once():
+    """測試分開呼叫 OCR 與圖片分析時，兩次請求共用同一份編碼結果"""
+    import image_handler
+    import image_analysis_service
+    from llm_gateway import LLMGateway
+    from screenshot_cache import screenshot_cache
+
+    class _Completions:
+        def __init__(self):
+            self.image_urls = []
+
+        def create(self, messages, **kwargs):
+            self.image_urls.extend(part["image_url"]["url"] for part in messages[-1]["content"] if part["type"] == "image_url")
+            # OCR 不使用結構化輸出，回傳純文字；圖片分析回傳 JSON
+            content = ('{"risk": "中", "type": "假冒物流詐騙", "reason": "要求點連結補運費", "advice": "🚫 不要點連結"}'
+                       if "response_format" in kwargs else "您的包裹地址不完整，請點擊連結更新並支付運費 30 元")
+            message = type("Message", (), {"content": content})()
+            return type("Response", (), {"choices": [type("Choice", (), {"message": message})()], "usage": None})()
+
+    completions = _Completions()
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    service = image_analysis_service.image_analysis_service
+    original_gateway, original_mode = service.gateway, image_handler.IMAGE_SINGLE_CALL_ANALYSIS
+    service.gateway = LLMGateway(client=client)
+    image_handler.IMAGE_SINGLE_CALL_ANALYSIS = False
+    images_before = image_preprocessor.get_stats()["images"]
+    screenshot_cache.clear()
+    try:
+        result = image_handler.ImageHandler()._analyze_image_content(_screenshot(), "", "GENERAL")
+    finally:
+        service.gateway, image_handler.IMAGE_SINGLE_CALL_ANALYSIS = original_gateway, original_mode
+
+    assert result["success"]
+    assert image_preprocessor.get_stats()["images"] == images_before + 1
+    assert len(completions.image_urls) == 2 and len(set(completions.image_urls)) == 1
+
+
+if __name__ == "__main__":
+    test_large_png_encoded_once_as_jpeg()
+    test_small_jpeg_and_transparency()
+    test_handler_prepares_each_image_once()
+    print("✅ 圖片前處理測試通過")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試 LLM 閘道
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from circuit_breaker import CircuitBreaker
+from llm_gateway import LLMGateway, LLMGatewayBusy, LLMGatewayUnavailable
+
+_ROUTES = {
+    "chat": {"model": "chat-model", "timeout": 0.1, "max_tokens": 50, "concurrency": 1},
+    "vision": {"model": "vision-model", "timeout": 5.0, "max_tokens": 300, "concurrency": 2},
+}
+
+
+class _Completions:
+    """記錄請求參數的假 OpenAI 客戶端"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+
+    def create(self, messages, **kwargs):
+        self.requests.append(kwargs)
+        time.sleep(self.delay)
+        details = type("Details", (), {"cached_tokens": 64 if len(self.requests) > 1 else 0})()
+        usage = type("Usage", (), {"prompt_tokens": 120, "completion_tokens": 30, "prompt_tokens_details": details})()
+        message = type("Message", (), {"content": "好的"})()
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})()], "usage": usage})()
+
+
+def _gateway(completions):
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    return LLMGateway(client=client, routes=_ROUTES, breaker=CircuitBreaker("test"),
+                      latency_budgets={"chat": 1.0, "vision": 1.0})
+
+
+def test_route_settings_and_stats():
+    """測試未指定時套用用途的模型、逾時與回應上限，並記錄延遲、token 分佈與提示詞快取命中"""
+    completions = _Completions()
+    gateway = _gateway(completions)
+    gateway.complete("vision", [{"role": "user", "content": "看圖"}])
+    gateway.hedged_complete("chat", [{"role": "user", "content": "你好"}], max_tokens=10)
+
+    assert completions.requests[0] == {"model": "vision-model", "timeout": 5.0, "max_tokens": 300}
+    assert completions.requests[1]["model"] == "chat-model" and completions.requests[1]["max_tokens"] == 10
+
+    routes = gateway.get_stats()["routes"]
+    assert routes["vision"]["calls"] == 1 and routes["chat"]["calls"] == 1
+    assert routes["vision"]["prompt_tokens"]["buckets"]["<=128"] == 1
+    assert routes["vision"]["completion_tokens"]["buckets"]["<=64"] == 1
+    assert sum(routes["chat"]["latency_seconds"]["buckets"].values()) == 1
+
+    # 第二次呼叫命中提示詞前綴快取
+    assert routes["vision"]["prompt_cache"]["cached_calls"] == 0
+    assert routes["chat"]["prompt_cache"]["cached_calls"] == 1
+    assert routes["chat"]["prompt_cache"]["cached_tokens"] == 64
+    assert routes["chat"]["prompt_cache"]["cached_token_ratio"] == round(64 / 120, 4)
+
+
+def test_concurrency_cap():
+    """測試同一用途的同時請求數達上限時，等待超過用途逾時即返回忙碌"""
+    gateway = _gateway(_Completions(delay=0.3))
+    worker = threading.Thread(target=gateway.complete, args=("chat", [{"role": "user", "content": "一"}]))
+    worker.start()
+    time.sleep(0.05)
+    try:
+        gateway.complete("chat", [{"role": "user", "content": "二"}])
+        assert False, "同時請求數已達上限"
+    except LLMGatewayBusy:
+        pass
+    # 其他用途不受影響
+    gateway.complete("vision", [{"role": "user", "content": "看圖"}])
+    worker.join()
+    routes = gateway.get_stats()["routes"]
+    assert routes["chat"]["busy"] == 1 and routes["chat"]["max_in_flight"] == 1
+
+
+def test_unavailable_without_client():
+    """測試沒有 OpenAI 客戶端時不送出請求也不計入斷路器"""
+    breaker = CircuitBreaker("test")
+    gateway = LLMGateway(client=None, routes=_ROUTES, breaker=breaker)
+    assert not gateway.available
+    try:
+        gateway.hedged_complete("chat", [{"role": "user", "content": "你好"}])
+        assert False, "沒有客戶端時應拋出例外"
+    except LLMGatewayUnavailable:
+        pass
+    assert breaker.get_stats()["calls"] == 0
+
+
+def test_breaker_per_route():
+    """測試每個用途各自斷路，p95 門檻依延遲預算調整；慢的圖片分析不會讓聊天一起斷路"""
+    completions = _Completions()
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    gateway = LLMGateway(client=client, routes=_ROUTES, latency_budgets={"chat": 1.0, "vision": 2.0})
+    assert gateway.breakers["chat"] is not gateway.breakers["vision"]
+    assert gateway.breakers["vision"].p95_latency > gateway.breakers["chat"].p95_latency
+
+    for _ in range(5):
+        gateway.breakers["vision"].record(True, 5.0)
+    assert gateway.breakers["vision"].state == "open"
+    response = gateway.hedged_complete("chat", [{"role": "user", "content": "你好"}])
+    assert response.choices[0].message.content == "好的"
+    stats = gateway.get_breaker_stats()
+    assert stats["chat"]["state"] == "closed" and stats["vision"]["state"] == "open"
+
+
+def test_busy_not_recorded_by_breaker():
+    """測試等待同時請求名額逾時不計入斷路器，等待名額的時間也不算進上游延遲"""
+    breaker = CircuitBreaker("test")
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": _Completions(delay=0.3)})()})()
+    gateway = LLMGateway(client=client, routes=_ROUTES, breaker=breaker, latency_budgets={"chat": 1.0})
+    worker = threading.Thread(target=gateway.hedged_complete, args=("chat", [{"role": "user", "content": "一"}]))
+    worker.start()
+    time.sleep(0.05)
+    try:
+        gateway.hedged_complete("chat", [{"role": "user", "content": "二"}])
+        assert False, "同時請求數已達上限"
+    except LLMGatewayBusy:
+        pass
+    worker.join()
+    stats = breaker.get_stats()
+    assert stats["calls"] == 1 and stats["failures"] == 0 and stats["ignored"] == 1
+
+    # 排隊等待的時間不算進延遲：第二個請求等第一個完成後才送出
+    gateway = LLMGateway(client=client, routes={"chat": dict(_ROUTES["chat"], timeout=1.0)},
+                         breaker=CircuitBreaker("queue"), latency_budgets={"chat": 2.0})
+    workers = [threading.Thread(target=gateway.hedged_complete, args=("chat", [{"role": "user", "content": "一"}]))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert gateway.breakers["chat"].get_stats()["calls"] == 2
+    assert gateway.breakers["chat"].get_stats()["window_p95_latency"] < 0.5
+
+
+if __name__ == "__main__":
+    test_route_settings_and_stats()
+    test_concurrency_cap()
+    test_unavailable_without_client()
+    test_breaker_per_route()
+    test_busy_not_recorded_by_breaker()
+    print("✅ LLM 閘道測試通過")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試截圖分析結果快取（dHash 漢明距離比對）
+"""
+
+import os
+import sys
+import time
+import random
+from io import BytesIO
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+
+from screenshot_cache import ScreenshotResultCache, dhash
+
+
+def _chat_screenshot(seed, size=(1080, 2000)):
+    """產生類似聊天截圖的圖片，不同 seed 的對話框位置與長度不同"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "#e8eef5")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, size[1], 90):
+        x = rng.choice([40, 400])
+        draw.rounded_rectangle([x, y + 10, x + rng.randint(300, 600), y + 80], 20, fill=rng.choice(["#ffffff", "#85e249"]))
+        draw.text((x + 20, y + 30), "加入VIP群組保證獲利", fill="black")
+    return image
+
+
+def _distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def test_dhash_tolerates_forwarding():
+    """測試重新壓縮、縮放與稍微裁切後仍在容許距離內，不同的截圖則遠超過"""
+    cache = ScreenshotResultCache()
+    image = _chat_screenshot(1)
+    fingerprint = dhash(image)
+
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=50)
+    variants = [
+        Image.open(BytesIO(buffered.getvalue())),
+        image.resize((540, 1000)),
+        image.crop((0, 40, 1080, 1960)),
+        image.crop((10, 0, 1070, 2000)),
+    ]
+    for variant in variants:
+        assert _distance(fingerprint, dhash(variant)) <= cache.max_distance
+    for seed in range(2, 8):
+        assert _distance(fingerprint, dhash(_chat_screenshot(seed))) > 2 * cache.max_distance
+
+
+def test_cache_conditions_and_bounds():
+    """測試只收錄高風險結果、比對條件不同時不沿用，以及筆數與存活時間上限"""
+    cache = ScreenshotResultCache(max_size=2, max_distance=4, ttl=0.2)
+    high = {"success": True, "risk_level": "高風險", "fraud_type": "投資詐騙"}
+    assert cache.put(0b1111, "GENERAL", "", [], high)
+    assert not cache.put(0b0000, "GENERAL", "", [], {"success": True, "risk_level": "低風險"})
+    assert not cache.put(0b0000, "GENERAL", "", [], {"success": False, "risk_level": "高風險"})
+
+    result, distance = cache.get(0b1101, "GENERAL", " ", None)
+    assert result == high and distance == 1
+    result["fraud_type"] = "改過"
+    assert cache.get(0b1111, "GENERAL")[0]["fraud_type"] == "投資詐騙"
+    assert cache.get(1 << 40, "GENERAL") is None
+    assert cache.get(0b1111, "PHISHING") is None
+    assert cache.get(0b1111, "GENERAL", "這是我朋友傳的") is None
+    assert cache.get(0b1111, "GENERAL", "", ["https://pay.example"]) is None
+
+    cache.put(1 << 20, "GENERAL", "", [], high)
+    cache.put(1 << 30, "GENERAL", "", [], high)
+    assert cache.get(0b1111, "GENERAL") is None
+
+    time.sleep(0.25)
+    assert cache.get(1 << 30, "GENERAL") is None
+    stats = cache.get_stats()
+    assert stats["hits"] == 2 and stats["lookups"] == 8 and stats["hit_rate"] == 0.25
+    assert stats["skipped_low_risk"] == 2 and stats["evictions"] == 1 and stats["expirations"] == 2
+    assert stats["size"] == 0 and stats["hash_bits"] == 256
+
+
+if __name__ == "__main__":
+    test_dhash_tolerates_forwarding()
+    test_cache_conditions_and_bounds()
+    print("✅ 截圖分析結果快取測試通過")
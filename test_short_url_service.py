@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+短網址服務測試（不需要網路連線）
+"""
+
+import sys
+import os
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from short_url_service import ShortURLCache, ShortURLExpander, is_short_url_host
+
+
+class _RedirectHandler(BaseHTTPRequestHandler):
+    """本機測試用的短網址服務：/r/<代碼> 轉址到 /final/<代碼>，另有頁面內轉址、延遲與超大內容"""
+
+    def do_GET(self):
+        body = b''
+        if self.path.startswith('/r/'):
+            self.send_response(302)
+            self.send_header('Location', '/final/' + self.path[3:])
+        elif self.path == '/slow':
+            time.sleep(1.5)
+            self.send_response(200)
+        elif self.path == '/meta':
+            self.send_response(200)
+            body = b'<html><head><meta http-equiv="Refresh" content="0; url=/js"></head></html>'
+        elif self.path == '/js':
+            self.send_response(200)
+            body = b'<html><script>window.location.href = "/hidden";</script></html>'
+        elif self.path == '/hidden':
+            self.send_response(200)
+            body = '<html><title>中華電信</title><input id="target" value="/final/h"></html>'.encode('utf-8')
+        elif self.path == '/huge':
+            self.send_response(200)
+            body = b'<html>' + b'x' * (1024 * 1024) + b'<script>location = "/final/never";</script></html>'
+        else:
+            self.send_response(200)
+            body = b'<html><title>final</title></html>'
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RedirectHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_cache_success_and_failure_ttl():
+    """測試成功與失敗結果使用不同的存活時間"""
+    cache = ShortURLCache(max_size=10, success_ttl=60, failure_ttl=0, persist_path=None)
+    cache.put("https://reurl.cc/abc", "https://evil.com/", ["https://reurl.cc/abc", "https://evil.com/"], True)
+    cache.put("https://bit.ly/down", "https://bit.ly/down", ["https://bit.ly/down"], False)
+
+    # 主機名稱大小寫不同視為同一個短網址，路徑則區分大小寫
+    cached = cache.get("https://REURL.cc/abc")
+    assert cached == {
+        'final_url': "https://evil.com/",
+        'redirect_chain': ["https://reurl.cc/abc", "https://evil.com/"],
+        'success': True,
+        'page_title': None,
+    }
+    assert cache.get("https://reurl.cc/ABC") is None
+    assert cache.get("https://bit.ly/down") is None
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 1
+    assert stats['expirations'] == 1
+
+
+def test_cache_is_bounded():
+    """測試快取容量上限"""
+    cache = ShortURLCache(max_size=2, persist_path=None)
+    for code in ("a", "b", "c"):
+        cache.put(f"https://bit.ly/{code}", f"https://example.com/{code}", [], True)
+    assert cache.get("https://bit.ly/a") is None
+    assert cache.get("https://bit.ly/c")['final_url'] == "https://example.com/c"
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_cache_persists_across_restarts():
+    """測試快取保存到檔案後重新載入"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "short_urls.json")
+        cache = ShortURLCache(max_size=10, persist_path=path, persist_interval=3600)
+        cache.put("https://lihi.cc/x", "https://scam.example/", ["https://lihi.cc/x", "https://scam.example/"], True)
+        cache.persist()
+
+        restarted = ShortURLCache(max_size=10, persist_path=path)
+        assert restarted.get("https://lihi.cc/x")['final_url'] == "https://scam.example/"
+
+
+def test_expander_expands_all_urls_under_deadline():
+    """測試同時展開多個短網址、使用快取並遵守總期限"""
+    server, base = _start_server()
+    try:
+        cache = ShortURLCache(max_size=10, persist_path=None)
+        expander = ShortURLExpander(cache=cache, request_timeout=5, deadline=0.8, max_workers=4, per_host_limit=2)
+        expander.is_short_url = lambda url: url.startswith(base)
+
+        urls = [f"{base}/r/a", f"{base}/slow", "https://example.com/", f"{base}/r/b", f"{base}/r/a"]
+        start = time.time()
+        results = expander.expand_all(urls)
+        assert time.time() - start < 1.4
+
+        assert [result['original_url'] for result in results] == urls
+        assert results[0]['final_url'] == f"{base}/final/a"
+        assert results[0]['redirect_chain'] == [f"{base}/r/a", f"{base}/final/a"]
+        assert results[0]['success'] is True
+        assert results[1]['success'] is False
+        assert results[2]['is_short_url'] is False
+        assert results[3]['final_url'] == f"{base}/final/b"
+        assert results[4] == results[0]
+        assert expander.get_stats()['deadline_exceeded'] == 1
+
+        # 超過期限的結果不會被快取，成功的結果會被快取
+        assert cache.get(f"{base}/slow") is None
+        assert expander.expand(f"{base}/r/b")['final_url'] == f"{base}/final/b"
+        assert cache.get_stats()['hits'] >= 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_follow_redirects_in_page_and_caps_body():
+    """測試頁面內轉址（meta refresh、JavaScript、隱藏欄位）與讀取量上限"""
+    server, base = _start_server()
+    try:
+        expander = ShortURLExpander(max_body_bytes=16 * 1024, max_chain_bytes=32 * 1024)
+
+        result = expander.follow_redirects(f"{base}/meta")
+        assert result['redirect_chain'] == [f"{base}/meta", f"{base}/js", f"{base}/hidden", f"{base}/final/h"]
+        assert result['success'] is True
+        assert result['page_title'] == "final"
+
+        result = expander.follow_redirects(f"{base}/huge")
+        assert result['final_url'] == f"{base}/huge"
+        assert result['bytes_read'] <= 16 * 1024
+        assert expander.get_stats()['truncated_bodies'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_local_limits_are_not_cached_as_failures():
+    """測試因本地期限或讀取量上限沒追蹤完的短網址不寫入失敗快取，遠端沒有轉址的結果仍會快取"""
+    server, base = _start_server()
+    try:
+        cache = ShortURLCache(max_size=10, persist_path=None)
+        expander = ShortURLExpander(cache=cache, request_timeout=5, max_body_bytes=16 * 1024)
+
+        result = expander._fetch(f"{base}/slow", time.time() + 0.3)
+        assert result['success'] is False and result['incomplete'] is True
+        assert cache.get(f"{base}/slow") is None
+
+        result = expander._fetch(f"{base}/huge", time.time() + 5)
+        assert result['incomplete'] is True
+        assert cache.get(f"{base}/huge") is None
+
+        result = expander._fetch(f"{base}/final/x", time.time() + 5)
+        assert result['success'] is False and result['incomplete'] is False
+        assert cache.get(f"{base}/final/x")['success'] is False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_short_url_host_detection():
+    """測試短網址服務以主機名稱集合與標籤後綴判斷，不再以子字串比對"""
+    assert is_short_url_host("bit.ly")
+    assert is_short_url_host("REURL.cc:443")
+    assert is_short_url_host("go.bit.ly")
+    assert not is_short_url_host("shopeet.com")
+    assert not is_short_url_host("abit.ly")
+    assert not is_short_url_host("bit.ly.evil.com")
+
+    expander = ShortURLExpander()
+    results = expander.expand_all(["https://shopeet.com/", "https://example.com/"])
+    assert [result['is_short_url'] for result in results] == [False, False]
+    assert expander.get_stats()['avoided_expansions'] == 1
+
+
+def test_standin_server_scenarios():
+    """測試展開器在轉址模擬伺服器的所有情境都得到預期的最終網址"""
+    from redirect_standin_server import RedirectStandInServer, default_scenarios
+
+    with RedirectStandInServer() as server:
+        expander = ShortURLExpander(cache=None, short_hosts={server.host}, max_body_bytes=64 * 1024)
+        for name, start_path, expected_path in default_scenarios():
+            result = expander.expand(server.url(start_path))
+            assert result['final_url'] == server.url(expected_path), name
+        # 超大網頁的客戶端提早停止讀取，等伺服器端送完再取樣
+        stats = server.get_stats(wait_idle=True)
+        assert stats['requests'] > 0 and stats['active'] == 0
+
+
+if __name__ == "__main__":
+    test_cache_success_and_failure_ttl()
+    test_cache_is_bounded()
+    test_cache_persists_across_restarts()
+    test_expander_expands_all_urls_under_deadline()
+    test_follow_redirects_in_page_and_caps_body()
+    test_local_limits_are_not_cached_as_failures()
+    test_short_url_host_detection()
+    test_standin_server_scenarios()
+    print("✅ 短網址服務測試通過")
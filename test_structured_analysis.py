@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試結構化分析輸出解析與 token 用量統計
+"""
+
+import os
+import sys
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from structured_analysis import (
+    IMAGE_ANALYSIS_FIELDS, TEXT_ANALYSIS_FIELDS, TEXT_ANALYSIS_SCHEMA, TokenUsageTracker,
+    build_response_format, build_text_analysis_messages, parse_structured_analysis
+)
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+def test_parse_structured_analysis():
+    """測試結構化輸出轉成分析結果欄位，格式不符時返回 None 以便改用文字格式"""
+    content = '{"risk": "高", "type": "投資詐騙", "reason": " 保證獲利不合理 ", "advice": "🚫 不要匯款", "emerging": true}'
+    assert parse_structured_analysis(content, TEXT_ANALYSIS_FIELDS) == {
+        "risk_level": "高",
+        "fraud_type": "投資詐騙",
+        "explanation": "保證獲利不合理",
+        "suggestions": "🚫 不要匯款",
+        "is_emerging": True,
+    }
+    assert parse_structured_analysis("風險等級：高", TEXT_ANALYSIS_FIELDS) is None
+    assert parse_structured_analysis('{"risk": "高"}', IMAGE_ANALYSIS_FIELDS) is None
+    assert parse_structured_analysis(None, IMAGE_ANALYSIS_FIELDS) is None
+
+    response_format = build_response_format("fraud_analysis", TEXT_ANALYSIS_SCHEMA)
+    assert response_format["json_schema"]["strict"] is True
+    assert set(TEXT_ANALYSIS_SCHEMA["required"]) == set(TEXT_ANALYSIS_FIELDS)
+
+
+def test_token_usage_savings():
+    """測試兩種輸出模式都有資料時計算每次呼叫平均節省的 token 數"""
+    tracker = TokenUsageTracker()
+    tracker.record("text_analysis", _Usage(400, 200), structured=False)
+    tracker.record("text_analysis", _Usage(300, 80), structured=True)
+    tracker.record("text_analysis", _Usage(320, 100), structured=True)
+    tracker.record("vision", None, structured=True)
+
+    stats = tracker.get_stats()
+    assert stats["text_analysis"]["structured"]["calls"] == 2
+    assert stats["text_analysis"]["structured"]["avg_prompt_tokens"] == 310
+    assert stats["text_analysis"]["avg_tokens_saved_per_call"] == 600 - 400
+    assert "vision" not in stats
+
+
+def test_image_result_parsing():
+    """測試圖片分析結果可解析結構化輸出，也保留舊版文字格式的解析"""
+    from image_analysis_service import ImageAnalysisService
+
+    service = ImageAnalysisService()
+    parsed = service._parse_analysis_result(
+        '{"risk": "極高", "type": "釣魚網站", "reason": "網址和銀行官網不一樣", "advice": "🚫 不要輸入密碼\\n📞 打給銀行確認"}'
+    )
+    assert parsed["risk_level"] == "極高"
+    assert parsed["explanation"] == "網址和銀行官網不一樣"
+    assert parsed["suggestions"].startswith("🚫")
+
+    parsed = service._parse_analysis_result("風險等級：低\n詐騙類型：非詐騙相關\n分析說明：一般聊天\n土豆建議：😊 放心")
+    assert parsed["fraud_type"] == "非詐騙相關"
+    assert parsed["explanation"] == "一般聊天"
+
+
+def test_prompt_static_prefix():
+    """測試不同訊息的提示詞只有結尾不同，固定指示形成相同的開頭"""
+    from config import CHAT_SYSTEM_PROMPT
+
+    first = build_text_analysis_messages("恭喜中獎，請匯手續費", "這是個短網址")
+    second = build_text_analysis_messages("明天一起吃飯")
+    assert first[0] == second[0] and first[0]["content"].startswith(CHAT_SYSTEM_PROMPT)
+    assert first[0]["content"].startswith("你是一位名為「防詐騙助手」")
+    assert first[1]["content"].endswith("恭喜中獎，請匯手續費\n---")
+    assert second[1]["content"] == "訊息：\n---\n明天一起吃飯\n---"
+
+    free_text = build_text_analysis_messages("明天一起吃飯", structured=False)
+    assert free_text[0]["content"].startswith(first[0]["content"])
+    assert free_text[1] == second[1]
+
+    from image_analysis_service import ImageAnalysisService
+    prompts = [ImageAnalysisService()._get_analysis_prompt(analysis_type, "", structured)
+               for analysis_type in ("GENERAL", "PHISHING") for structured in (True, False)]
+    shared = os.path.commonprefix(prompts)
+    assert len(shared) > 0.8 * min(len(prompt) for prompt in prompts)
+
+
+if __name__ == "__main__":
+    test_parse_structured_analysis()
+    test_token_usage_savings()
+    test_image_result_parsing()
+    test_prompt_static_prefix()
+    print("✅ 結構化分析輸出測試通過")
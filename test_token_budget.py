@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+測試提示詞 token 預算
+"""
+
+import os
+import sys
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from token_budget import TokenBudgetManager, compress_text, count_tokens, truncate_to_tokens
+
+
+def test_compress_text():
+    """測試合併空白、移除重複的行，以及長網址改為主機名稱"""
+    long_url = "https://event.scam-shop.xyz/landing/abcdef?utm_source=line&utm_medium=share&token=" + "x" * 40
+    text = f"限時優惠   今天截止\n\n限時優惠 今天截止\n點擊 {long_url} 領取\n點擊 https://a.tw/x 領取"
+    assert compress_text(text) == "限時優惠 今天截止\n點擊 https://event.scam-shop.xyz/… 領取\n點擊 https://a.tw/x 領取"
+
+
+def test_truncate_keeps_head_and_tail():
+    """測試截斷後不超過上限，且保留訊息開頭與結尾"""
+    text = "開頭" + "中" * 3000 + "結尾"
+    truncated = truncate_to_tokens(text, 200)
+    assert count_tokens(truncated) <= 200
+    assert truncated.startswith("開頭") and truncated.endswith("結尾")
+    assert truncate_to_tokens("短訊息", 200) == "短訊息"
+
+
+def test_fit_enforces_route_budget():
+    """測試超出預算的內容被壓縮並截斷，預算內的內容保持不變並記錄統計"""
+    manager = TokenBudgetManager({"text_analysis": {"prompt": 300, "completion": 100}})
+    system_prompt = "系統提示" * 25
+
+    assert manager.fit("text_analysis", "一般訊息", fixed_prompt=system_prompt) == "一般訊息"
+    fitted = manager.fit("text_analysis", "保證獲利\n" * 50 + "請加LINE " + "賺" * 1000, fixed_prompt=system_prompt)
+    assert count_tokens(system_prompt) + count_tokens(fitted) <= 300
+    assert fitted.count("保證獲利") == 1
+
+    stats = manager.get_stats()["routes"]["text_analysis"]
+    assert stats["requests"] == 2
+    assert stats["compressed"] == 1 and stats["truncated"] == 1
+    assert stats["tokens_saved"] > 1000
+    assert manager.completion_limit("text_analysis") == 100
+
+
+if __name__ == "__main__":
+    test_compress_text()
+    test_truncate_keeps_head_and_tail()
+    test_fit_enforces_route_budget()
+    print("✅ 提示詞 token 預算測試通過")
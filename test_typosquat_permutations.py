@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+變形網域查詢表測試（不需要網路連線）
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加當前目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from domain_spoofing_detector import _SafeDomainIndex, _detect_host_spoofing, get_safe_domains_version
+from typosquat_permutations import (
+    build_permutation_table, generate_permutations, load_permutation_table, save_permutation_table
+)
+
+SAFE_DOMAINS = {
+    "google.com": "Google 搜尋引擎",
+    "shopee.tw": "蝦皮購物",
+    "cht.com.tw": "中華電信",
+}
+
+
+def test_generate_permutations():
+    """測試常見變形的產生"""
+    permutations = generate_permutations("www.shopee.tw")
+    assert "shopee-tw.com" in permutations
+    assert "shopeee.tw" in permutations
+    assert "shopwe.tw" in permutations
+    assert "shopee.com.tw" in permutations
+    # 過短或含路徑的網域不產生變形
+    assert generate_permutations("cht.com.tw") == set()
+    assert generate_permutations("example.com/tw/") == set()
+
+
+def test_table_matches_fuzzy_detection():
+    """測試查表結果與模糊比對完全相同，且不收錄白名單網域"""
+    table = build_permutation_table(SAFE_DOMAINS)
+    assert "google.com" not in table.entries
+    assert table.lookup("google-tw.com") == ("google.com", "插入額外字元攻擊")
+
+    registry_version = get_safe_domains_version(SAFE_DOMAINS)
+    bare_index = _SafeDomainIndex(SAFE_DOMAINS, registry_version)
+    table_index = _SafeDomainIndex(SAFE_DOMAINS, registry_version)
+    table_index.permutations = table
+    for host in list(table.entries)[:200]:
+        assert _detect_host_spoofing(host, table_index) == _detect_host_spoofing(host, bare_index)
+
+    stats = table.get_stats()
+    assert stats['hits'] >= 1
+    assert stats['memory_bytes'] > 0
+
+
+def test_save_and_load_checks_registry_version():
+    """測試查詢表存檔與白名單版本檢查"""
+    table = build_permutation_table(SAFE_DOMAINS)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "table.json")
+        save_permutation_table(table, path)
+
+        loaded = load_permutation_table(table.registry_version, path)
+        assert loaded.entries == table.entries
+        assert loaded.brands == table.brands
+        assert load_permutation_table("stale-version", path) is None
+        assert load_permutation_table(table.registry_version, os.path.join(tmp_dir, "missing.json")) is None
+
+
+if __name__ == "__main__":
+    test_generate_permutations()
+    test_table_matches_fuzzy_detection()
+    test_save_and_load_checks_registry_version()
+    print("✅ 變形網域查詢表測試通過")
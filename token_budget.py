@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示詞 token 預算模組
+在送出 OpenAI 請求前於本機估算 token 數，超出各用途的預算時先壓縮內容
+（合併空白、移除重複的行、長網址改為網站主機名稱），仍超出時保留開頭與結尾、截去中段。
+
+有安裝 tiktoken 時使用精確的計算方式，否則以字元類型估算
+（中日韓文字約 1 字 1 token，其餘約 4 個字元 1 token）。
+"""
+
+import re
+import logging
+import threading
+from urllib.parse import urlparse
+
+from config import TOKEN_BUDGETS, TOKEN_BUDGET_LONG_URL_LENGTH
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # 選用套件
+    tiktoken = None
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding('o200k_base')
+    except Exception as e:  # 編碼檔需要下載，離線時改用估算
+        logger.warning(f"載入 tiktoken 編碼失敗，改用估算: {e}")
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+_URL_PATTERN = re.compile(r'https?://[^\s\u4e00-\u9fff，。！？；：]+')
+_TRUNCATION_MARK = '\n…（中間內容過長已省略）…\n'
+
+
+def count_tokens(text):
+    """估算文字的 token 數"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4)
+
+
+def _shorten_url(match):
+    """長網址只保留協定與主機名稱（網域判斷已在本機完成，路徑與追蹤參數對分析幫助不大）"""
+    url = match.group(0)
+    if len(url) <= TOKEN_BUDGET_LONG_URL_LENGTH:
+        return url
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/…" if parsed.netloc else url
+
+
+def compress_text(text):
+    """
+    壓縮訊息內容：合併連續空白、移除重複出現的行、長網址改為主機名稱
+
+    Returns:
+        str: 壓縮後的文字
+    """
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if not line or line in seen:
+            continue
+        seen.add(line)
+        lines.append(_URL_PATTERN.sub(_shorten_url, line))
+    return '\n'.join(lines)
+
+
+def _head_and_tail(text, keep):
+    """取開頭與結尾共 keep 個字元（各一半）"""
+    tail_length = keep // 2
+    return text[:keep - tail_length], text[len(text) - tail_length:] if tail_length else ''
+
+
+def truncate_to_tokens(text, max_tokens):
+    """保留開頭與結尾、截去中段，使文字不超過 max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max(0, max_tokens - count_tokens(_TRUNCATION_MARK))
+    # 二分搜尋可保留的字元數
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        head, tail = _head_and_tail(text, mid)
+        if count_tokens(head) + count_tokens(tail) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    head, tail = _head_and_tail(text, low)
+    return head + _TRUNCATION_MARK + tail
+
+
+class TokenBudgetManager:
+    """依用途（route）控制提示詞大小並統計 token 用量"""
+
+    def __init__(self, budgets=None):
+        self.budgets = budgets if budgets is not None else TOKEN_BUDGETS
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def completion_limit(self, route):
+        """取得用途的回應 token 上限（作為 max_tokens）"""
+        return self.budgets[route]['completion']
+
+    def fit(self, route, content, fixed_prompt=''):
+        """
+        讓使用者內容符合用途的提示詞預算
+
+        Args:
+            route: 用途（如 text_analysis、chat、vision）
+            content: 使用者提供、可被壓縮的內容
+            fixed_prompt: 不可壓縮的提示詞部分（系統提示詞、指示文字），用於計算剩餘預算
+
+        Returns:
+            str: 壓縮或截斷後的內容
+        """
+        budget = self.budgets[route]['prompt']
+        fixed_tokens = count_tokens(fixed_prompt)
+        original_tokens = count_tokens(content)
+        fitted = content
+        compressed = truncated = False
+
+        if fixed_tokens + original_tokens > budget:
+            fitted = compress_text(content)
+            compressed = fitted != content
+            if fixed_tokens + count_tokens(fitted) > budget:
+                fitted = truncate_to_tokens(fitted, max(0, budget - fixed_tokens))
+                truncated = True
+
+        fitted_tokens = count_tokens(fitted)
+        if compressed or truncated:
+            logger.info(f"{route} 提示詞超出預算 {budget}：內容 {original_tokens} -> {fitted_tokens} token"
+                        f"{'（已截斷）' if truncated else ''}")
+
+        with self._lock:
+            stats = self._stats.setdefault(route, {
+                'requests': 0, 'estimated_prompt_tokens': 0, 'compressed': 0, 'truncated': 0, 'tokens_saved': 0,
+            })
+            stats['requests'] += 1
+            stats['estimated_prompt_tokens'] += fixed_tokens + fitted_tokens
+            stats['compressed'] += compressed
+            stats['truncated'] += truncated
+            stats['tokens_saved'] += original_tokens - fitted_tokens
+        return fitted
+
+    def get_stats(self):
+        """取得各用途的預算與使用統計"""
+        with self._lock:
+            return {
+                'tokenizer': 'tiktoken' if _encoding is not None else 'estimate',
+                'routes': {
+                    route: dict(
+                        stats,
+                        prompt_budget=self.budgets[route]['prompt'],
+                        completion_budget=self.budgets[route]['completion'],
+                        avg_prompt_tokens=round(stats['estimated_prompt_tokens'] / stats['requests'], 1),
+                    )
+                    for route, stats in self._stats.items()
+                },
+            }
+
+
+# 全域 token 預算管理實例
+token_budget = TokenBudgetManager()
+
+
+def get_token_budget_stats():
+    """取得 token 預算統計"""
+    return token_budget.get_stats()
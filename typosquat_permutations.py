@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常見變形網域預先產生模組
+將白名單網域的機械式變形（-tw 後綴、單字元替換、重複字母、網域後綴互換）
+預先產生成查詢表，檢測時只需一次查表就能判定，不必再跑模糊比對。
+
+查詢表由建置步驟產生：
+    python typosquat_permutations.py
+
+每個項目都先以完整的網域變形檢測驗證過，只保留檢測結果指向單一白名單網域的變形，
+因此查表結果與模糊比對的結果完全相同。查詢表記錄白名單版本，
+白名單改變後會自動停用，直到重新建置為止。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+from config import TYPOSQUAT_TABLE_FILE
+
+logger = logging.getLogger(__name__)
+
+# 查詢表支援的變形類型（與 domain_spoofing_detector 的 spoofing_type 一致）
+PERMUTATION_SPOOF_TYPES = [
+    "基礎域名變形攻擊",
+    "插入額外字元攻擊",
+    "網域名稱變形攻擊",
+    "字元替換",
+    "插入額外字元",
+]
+# 每個白名單網域保留的類型編碼空間：code = 網域索引 * _KIND_SLOTS + 類型索引
+_KIND_SLOTS = 8
+
+# 單字元替換時使用的鍵盤鄰近字元與常見數字替換
+_SUBSTITUTIONS = {
+    'a': 'qsz4', 'b': 'vgn8', 'c': 'xdv', 'd': 'sfe', 'e': 'wrd3', 'f': 'dgr', 'g': 'fht9',
+    'h': 'gjy', 'i': 'uokl', 'j': 'hku', 'k': 'jli', 'l': 'kopi', 'm': 'nj', 'n': 'bmh',
+    'o': 'ipl', 'p': 'ol', 'q': 'wa', 'r': 'etf', 's': 'adw5', 't': 'ryg7', 'u': 'yij',
+    'v': 'cbf', 'w': 'qes', 'x': 'zcs', 'y': 'tuh', 'z': 'xa2',
+}
+
+# -tw 後綴變形常見的頂級網域
+_SUFFIX_TLDS = ['.com', '.net', '.tw', '.com.tw', '.cc', '.top', '.xyz']
+
+# 網域後綴互換
+_TLD_SWAPS = {
+    '.com.tw': ['.tw', '.com', '.net', '.net.tw'],
+    '.tw': ['.com.tw', '.com', '.net'],
+    '.com': ['.com.tw', '.tw', '.net', '.co'],
+    '.net': ['.com', '.net.tw'],
+    '.org.tw': ['.org', '.com.tw'],
+}
+
+
+class PermutationTable:
+    """
+    預先產生的變形網域查詢表
+
+    以 {變形網域: 編碼} 的字典保存，編碼同時包含被模仿的白名單網域與變形類型。
+    """
+
+    def __init__(self, registry_version, brands, entries):
+        self.registry_version = registry_version
+        self.brands = brands
+        self.entries = entries
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, host):
+        """
+        查詢主機名稱（已移除www前綴）
+
+        Returns:
+            tuple 或 None: (被模仿的白名單網域, 變形類型)
+        """
+        code = self.entries.get(host)
+        with self._lock:
+            self.lookups += 1
+            if code is not None:
+                self.hits += 1
+        if code is None:
+            return None
+        return self.brands[code // _KIND_SLOTS], PERMUTATION_SPOOF_TYPES[code % _KIND_SLOTS]
+
+    def memory_bytes(self):
+        """估算查詢表在記憶體中的大小（字典、鍵、值與白名單網域列表）"""
+        size = sys.getsizeof(self.entries) + sys.getsizeof(self.brands)
+        size += sum(sys.getsizeof(host) + sys.getsizeof(code)
+                    for host, code in self.entries.items())
+        size += sum(sys.getsizeof(brand) for brand in self.brands)
+        return size
+
+    def get_stats(self):
+        """取得查詢表統計"""
+        with self._lock:
+            return {
+                'registry_version': self.registry_version,
+                'entries': len(self.entries),
+                'brands': len(self.brands),
+                'memory_bytes': self.memory_bytes(),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            }
+
+
+def _split_domain(domain):
+    """拆成 (基礎網域名稱, 其餘後綴)，例如 shopee.tw -> ('shopee', '.tw')"""
+    domain = domain.lower()
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    base, _, suffix = domain.partition('.')
+    return base, '.' + suffix if suffix else ''
+
+
+def generate_permutations(safe_domain):
+    """
+    產生單一白名單網域的常見變形網域
+
+    Args:
+        safe_domain: 白名單網域（如 shopee.tw）
+
+    Returns:
+        set: 變形後的主機名稱（不含www前綴）
+    """
+    base, suffix = _split_domain(safe_domain)
+    # 含路徑或過短的網域不產生變形，避免大量誤報
+    if not suffix or '/' in suffix or len(base) < 4:
+        return set()
+
+    candidates = set()
+
+    # 1. -tw / -taiwan 後綴
+    for tag in ('-tw', '-taiwan'):
+        for tld in set(_SUFFIX_TLDS + [suffix]):
+            candidates.add(base + tag + tld)
+
+    # 2. 單字元替換
+    for i, ch in enumerate(base):
+        for replacement in _SUBSTITUTIONS.get(ch, ''):
+            candidates.add(base[:i] + replacement + base[i + 1:] + suffix)
+
+    # 3. 重複字母
+    for i in range(len(base)):
+        candidates.add(base[:i + 1] + base[i] + base[i + 1:] + suffix)
+
+    # 4. 網域後綴互換
+    for swapped in _TLD_SWAPS.get(suffix, []):
+        candidates.add(base + swapped)
+
+    return candidates
+
+
+def build_permutation_table(safe_domains):
+    """
+    建立變形網域查詢表
+
+    每個候選變形都以完整的網域變形檢測驗證，只保留結果為單一白名單網域、
+    且類型在 PERMUTATION_SPOOF_TYPES 中的項目。白名單網域與合法變體不會被收錄。
+
+    Args:
+        safe_domains: 白名單網域字典
+
+    Returns:
+        PermutationTable: 查詢表
+    """
+    from domain_spoofing_detector import (
+        _SafeDomainIndex, _detect_host_spoofing, get_safe_domains_version
+    )
+
+    registry_version = get_safe_domains_version(safe_domains)
+    # 使用不含查詢表的索引驗證，確保結果來自模糊比對
+    index = _SafeDomainIndex(safe_domains, registry_version)
+
+    candidates = set()
+    for safe_domain in safe_domains:
+        candidates.update(generate_permutations(safe_domain))
+    candidates -= index.normalized
+
+    brand_ids = {}
+    brands = []
+    entries = {}
+    for host in sorted(candidates):
+        verdict = _detect_host_spoofing(host, index)
+        if not verdict.get('is_spoofed'):
+            continue
+        spoofing_type = verdict.get('spoofing_type')
+        original_domain = verdict.get('original_domain')
+        if spoofing_type not in PERMUTATION_SPOOF_TYPES or original_domain not in safe_domains:
+            continue
+
+        if original_domain not in brand_ids:
+            brand_ids[original_domain] = len(brands)
+            brands.append(original_domain)
+        kind = PERMUTATION_SPOOF_TYPES.index(spoofing_type)
+        entries[host] = brand_ids[original_domain] * _KIND_SLOTS + kind
+
+    logger.info(f"變形網域查詢表建置完成：候選 {len(candidates)} 筆，收錄 {len(entries)} 筆")
+    return PermutationTable(registry_version, brands, entries)
+
+
+def save_permutation_table(table, path):
+    """將查詢表存成 JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'registry_version': table.registry_version,
+            'kind_slots': _KIND_SLOTS,
+            'spoof_types': PERMUTATION_SPOOF_TYPES,
+            'brands': table.brands,
+            'entries': table.entries,
+        }, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def _default_table_path():
+    """取得查詢表預設路徑（相對於模組所在目錄）"""
+    if os.path.isabs(TYPOSQUAT_TABLE_FILE):
+        return TYPOSQUAT_TABLE_FILE
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), TYPOSQUAT_TABLE_FILE)
+
+
+def load_permutation_table(registry_version, path=None):
+    """
+    載入預先產生的查詢表
+
+    Args:
+        registry_version: 目前的白名單版本
+        path: 查詢表路徑（省略時使用設定檔的路徑）
+
+    Returns:
+        PermutationTable 或 None: 檔案不存在、格式不符或白名單版本不一致時返回 None
+    """
+    path = path or _default_table_path()
+    if not os.path.exists(path):
+        logger.info(f"找不到變形網域查詢表 {path}，僅使用模糊比對")
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"載入變形網域查詢表失敗: {e}")
+        return None
+
+    if data.get('kind_slots') != _KIND_SLOTS or data.get('spoof_types') != PERMUTATION_SPOOF_TYPES:
+        logger.warning("變形網域查詢表格式版本不符，請重新建置")
+        return None
+    if data.get('registry_version') != registry_version:
+        logger.warning("變形網域查詢表與目前白名單版本不一致，請重新建置")
+        return None
+
+    return PermutationTable(registry_version, data['brands'], data['entries'])
+
+
+def main():
+    """建置步驟：從 safe_domains.json 產生查詢表並報告記憶體用量"""
+    logging.basicConfig(level=logging.INFO)
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    safe_domains_path = os.path.join(base_dir, 'safe_domains.json')
+    with open(safe_domains_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    safe_domains = {}
+    for domains in data['safe_domains'].values():
+        if isinstance(domains, dict):
+            safe_domains.update(domains)
+
+    output_path = sys.argv[1] if len(sys.argv) > 1 else _default_table_path()
+    start = time.time()
+    table = build_permutation_table(safe_domains)
+    save_permutation_table(table, output_path)
+
+    stats = table.get_stats()
+    print(f"✅ 已產生 {stats['entries']} 筆變形網域（{stats['brands']} 個白名單網域），"
+          f"耗時 {time.time() - start:.1f} 秒")
+    print(f"💾 記憶體用量約 {stats['memory_bytes'] / 1024:.1f} KB，"
+          f"檔案大小 {os.path.getsize(output_path) / 1024:.1f} KB")
+    print(f"📄 已儲存到 {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+網址檢查模組
+文字訊息與圖片中QR碼網址共用的本地網址檢查流程，不呼叫 OpenAI：
+詐騙網域黑名單 → 短網址展開（展開後的每一跳再比對黑名單）→ 網域變形檢測 → 白名單與合法子網域。
+
+命中其中任一項時直接產生分析結果；都沒有命中時回傳短網址展開後的訊息與網址資訊，
+交給後續的本地風險評分或 AI 分析。
+"""
+
+import re
+import logging
+from urllib.parse import urlparse
+
+from domain_spoofing_detector import detect_domain_spoofing_many, extract_urls
+from domain_blocklist import find_blocklisted_url
+from short_url_service import expand_short_urls, is_short_url_host
+
+logger = logging.getLogger(__name__)
+
+# 確保只提取有效的URL部分，支援二級域名如 .com.tw, .co.uk 等
+_URL_PATTERN = re.compile(r'https?://[^\s\u4e00-\u9fff，。！？；：]+|www\.[^\s\u4e00-\u9fff，。！？；：]+|[a-zA-Z0-9][a-zA-Z0-9-]*\.[a-zA-Z]{2,}(?:\.[a-zA-Z]{2,})?(?:/[^\s\u4e00-\u9fff，。！？；：]*)?')
+_TRAILING_PUNCTUATION = re.compile(r'[，。！？；：]+$')
+
+# 常見的合法子網域前綴
+_LEGITIMATE_SUBDOMAIN_PREFIXES = {
+    'www', 'mail', 'email', 'webmail', 'smtp', 'pop', 'imap',
+    'ftp', 'sftp', 'api', 'app', 'mobile', 'm', 'wap',
+    'admin', 'secure', 'ssl', 'login', 'auth', 'account',
+    'shop', 'store', 'buy', 'order', 'cart', 'checkout',
+    'news', 'blog', 'forum', 'support', 'help', 'service',
+    'event', 'events', 'promo', 'promotion', 'campaign',
+    'member', 'members', 'user', 'users', 'profile',
+    'search', 'find', 'discover', 'explore',
+    'download', 'upload', 'file', 'files', 'doc', 'docs',
+    'img', 'image', 'images', 'pic', 'pics', 'photo', 'photos',
+    'video', 'videos', 'media', 'cdn', 'static', 'assets',
+    'dev', 'test', 'staging', 'beta', 'alpha', 'demo',
+    'tw', 'taiwan', 'hk', 'hongkong', 'cn', 'china',
+    'en', 'english', 'zh', 'chinese',
+    'playing', 'play', 'game', 'games', 'entertainment', 'fun',
+    'amp', 'article', 'articles', 'read', 'view', 'content'
+}
+
+_SUSPICIOUS_SUBDOMAIN_PATTERNS = [
+    '-tw-', '-official-', '-secure-', '-login-', '-bank-',
+    'phishing', 'fake', 'scam', 'fraud', 'malware'
+]
+
+
+def is_legitimate_subdomain(subdomain_part):
+    """檢查子網域部分是否合法"""
+    if not subdomain_part or len(subdomain_part) > 20:  # 太長的子網域可疑
+        return False
+
+    if subdomain_part.lower() in _LEGITIMATE_SUBDOMAIN_PREFIXES:
+        return True
+
+    if any(pattern in subdomain_part.lower() for pattern in _SUSPICIOUS_SUBDOMAIN_PATTERNS):
+        return False
+
+    # 只能包含字母、數字和連字符，且不能以連字符開始或結束
+    if not re.match(r'^[a-zA-Z0-9-]+$', subdomain_part):
+        return False
+    return not (subdomain_part.startswith('-') or subdomain_part.endswith('-'))
+
+
+def _analysis_result(result, raw_result, display_name, url_info):
+    """以與 detect_fraud_with_chatgpt 相同的格式包裝分析結果"""
+    return {
+        "success": True,
+        "message": "分析完成",
+        "result": dict(result, is_emerging=False, display_name=display_name, **url_info),
+        "raw_result": raw_result
+    }
+
+
+def _blocklist_result(blocklist_hit, display_name, url_info):
+    """建立命中本地詐騙網域黑名單時的分析結果"""
+    blocked_domain = blocklist_hit['blocked_domain']
+    logger.warning(f"網址命中詐騙網域黑名單: {blocklist_hit['url']} ({blocked_domain})")
+    return _analysis_result({
+        "risk_level": "極高風險",
+        "fraud_type": "已知詐騙網站",
+        "explanation": f"這個網址「{blocked_domain}」已經被確認是詐騙網站，之前就有人被騙或檢舉過了！\n\n千萬不要點進去，也不要在裡面輸入任何個人資料、密碼或信用卡號碼。",
+        "suggestions": "🚫 不要點擊這個網址\n🛡️ 如已輸入資料請立即更改密碼並聯絡銀行\n📞 有疑問請撥打165反詐騙專線",
+        "is_blocklisted": True,
+        "blocked_domain": blocked_domain
+    }, f"詐騙網域黑名單命中：{blocked_domain}", display_name, url_info)
+
+
+def _spoofing_result(spoofed_domains, display_name, url_info):
+    """建立檢測到網域變形攻擊時的分析結果"""
+    spoofing_result = spoofed_domains[0]
+    for verdict in spoofed_domains:
+        logger.warning(f"檢測到網域變形攻擊: {verdict['spoofed_domain']} 模仿 {verdict['original_domain']}")
+
+    explanation = spoofing_result['risk_explanation']
+    if len(spoofed_domains) > 1:
+        other_domains = "\n".join(
+            f"• {verdict['spoofed_domain']}（疑似假冒 {verdict['original_domain']}）"
+            for verdict in spoofed_domains[1:]
+        )
+        explanation += f"\n\n另外，這則訊息裡還有其他可疑的假網址：\n{other_domains}"
+
+    return _analysis_result({
+        "risk_level": "高風險",
+        "fraud_type": "網域變形詐騙",
+        "explanation": explanation,
+        "suggestions": f"• 立即停止使用這個網站\n• 不要輸入任何個人資料或密碼\n• 如需使用正牌網站，請直接搜尋 {spoofing_result['original_domain']} 或從書籤進入\n• 將此可疑網址回報給165反詐騙專線",
+        "is_domain_spoofing": True,  # 特殊標記
+        "spoofing_result": spoofing_result,  # 包含完整的變形檢測結果
+        "spoofed_domains": spoofed_domains  # 訊息中所有的變形網域
+    }, f"網域變形攻擊檢測：{spoofing_result['spoofing_type']} - {spoofing_result['risk_explanation']}",
+        display_name, url_info)
+
+
+def _safe_domain_result(domain, safe_domains, normalized_safe_domains, display_name, url_info):
+    """網域為白名單網域或其合法子網域時，建立低風險的分析結果"""
+    if domain in normalized_safe_domains:
+        original_domain, site_description = normalized_safe_domains[domain]
+        logger.info(f"檢測到白名單中的域名: {domain} -> {original_domain}")
+        return _analysis_result({
+            "risk_level": "低風險",
+            "fraud_type": "非詐騙相關",
+            "explanation": f"這個網站是 {original_domain}，{site_description}，可以安心使用。",
+            "suggestions": "這是正規網站，不必特別擔心。如有疑慮，建議您直接從官方管道進入該網站。"
+        }, f"經過分析，這是已知的可信任網站：{site_description}", display_name, url_info)
+
+    # 檢查是否為合法的子網域（例如 event.liontravel.com）
+    domain_clean = domain[4:] if domain.startswith('www.') else domain
+    for safe_domain_key in safe_domains:
+        safe_domain_lower = safe_domain_key.lower()
+        safe_domain_clean = safe_domain_lower[4:] if safe_domain_lower.startswith('www.') else safe_domain_lower
+        # 必須是 *.safe_domain 的格式，且不是網域本身
+        if domain_clean.endswith('.' + safe_domain_clean) and domain_clean != safe_domain_clean:
+            subdomain_part = domain_clean[:-len('.' + safe_domain_clean)]
+            if is_legitimate_subdomain(subdomain_part):
+                site_description = safe_domains.get(safe_domain_key, "台灣常見的可靠網站")
+                logger.info(f"檢測到合法子網域: {domain} -> {safe_domain_key}")
+                return _analysis_result({
+                    "risk_level": "低風險",
+                    "fraud_type": "非詐騙相關",
+                    "explanation": f"這個網站是 {safe_domain_key} 的子網域，{site_description}，可以安心使用。",
+                    "suggestions": "這是正規網站的子網域，不必特別擔心。如有疑慮，建議您直接從官方管道進入該網站。"
+                }, f"經過分析，這是已知可信任網站的子網域：{site_description}", display_name, url_info)
+    return None
+
+
+def check_message_urls(user_message, safe_domains, display_name="朋友"):
+    """
+    以本地規則檢查訊息中的網址（黑名單、短網址展開、網域變形、白名單），不呼叫 OpenAI
+
+    Args:
+        user_message: 訊息內容（QR碼網址以換行串接即可）
+        safe_domains: 白名單網域 -> 說明
+        display_name: 使用者名稱（放進分析結果）
+
+    Returns:
+        dict: {
+            'result': 命中黑名單、網域變形或白名單時的分析結果（與 detect_fraud_with_chatgpt 相同格式），否則為 None,
+            'analysis_message': 短網址替換為展開後網址的訊息,
+            'expanded_urls': 訊息中每個網址展開後的最終網址,
+            'url_info': {'original_url', 'expanded_url', 'is_short_url', 'url_expanded_successfully'}
+                        （結果欄位以第一個短網址為主，沒有短網址時使用第一個網址）,
+            'unlisted_urls': 不在白名單中的網址與轉址數量
+        }
+    """
+    url_info = {
+        "original_url": None,
+        "expanded_url": None,
+        "is_short_url": False,
+        "url_expanded_successfully": False
+    }
+    check = {
+        'result': None,
+        'analysis_message': user_message,
+        'expanded_urls': [],
+        'url_info': url_info,
+        'unlisted_urls': 0,
+    }
+
+    # 先比對本地詐騙網域黑名單，已確認的詐騙網址不需要展開
+    blocklist_hit = find_blocklisted_url(extract_urls(user_message))
+    if blocklist_hit:
+        check['result'] = _blocklist_result(blocklist_hit, display_name, url_info)
+        return check
+
+    analysis_message = user_message
+    redirect_hops = []  # 短網址展開後經過的所有網址（不含短網址本身）
+    url_matches = _URL_PATTERN.findall(user_message)
+    if url_matches:
+        candidate_urls = []
+        for matched_text in url_matches:
+            url = _TRAILING_PUNCTUATION.sub('', matched_text)
+            if not url.startswith(('http://', 'https://')):
+                url = 'https://' + url
+            candidate_urls.append((matched_text, url))
+
+        # 同時展開訊息中所有的短網址（共用連線池與總期限）
+        expansions = expand_short_urls([url for _, url in candidate_urls])
+        check['expanded_urls'] = [expansion['final_url'] for expansion in expansions]
+
+        primary = next((expansion for expansion in expansions if expansion['is_short_url']), expansions[0])
+        url_info.update(
+            original_url=primary['original_url'],
+            expanded_url=primary['final_url'],
+            is_short_url=primary['is_short_url'],
+            url_expanded_successfully=primary['success']
+        )
+
+        replaced_texts = set()
+        for (matched_text, url), expansion in zip(candidate_urls, expansions):
+            # 短網址成功展開時，將訊息中的短網址替換為展開後的URL，以便於分析
+            if expansion['is_short_url'] and expansion['success'] and matched_text not in replaced_texts:
+                replaced_texts.add(matched_text)
+                analysis_message = analysis_message.replace(matched_text, f"{url} (展開後: {expansion['final_url']})")
+                # 轉址過程中的每一跳都要經過黑名單、網域變形與白名單檢查
+                redirect_hops.extend(hop for hop in expansion['redirect_chain'][1:] if hop not in redirect_hops)
+                logger.info(f"已展開短網址進行分析: {url} -> {expansion['final_url']}")
+
+        # 展開後的網址也要比對黑名單
+        blocklist_hit = find_blocklisted_url(redirect_hops)
+        if blocklist_hit:
+            check['result'] = _blocklist_result(blocklist_hit, display_name, url_info)
+            return check
+    check['analysis_message'] = analysis_message
+
+    # 檢查網域變形攻擊（一次檢測訊息中的所有網域）
+    spoofing_verdicts = detect_domain_spoofing_many(extract_urls(analysis_message) + redirect_hops, safe_domains)
+    spoofed_domains = [verdict for verdict in spoofing_verdicts.values() if verdict['is_spoofed']]
+    if spoofed_domains:
+        check['result'] = _spoofing_result(spoofed_domains, display_name, url_info)
+        return check
+
+    cleaned_urls = [url for url in (_TRAILING_PUNCTUATION.sub('', url) for url in _URL_PATTERN.findall(analysis_message)) if url]
+
+    # 標準化的安全網域列表（包含www和非www版本）
+    normalized_safe_domains = {}
+    for safe_domain, description in safe_domains.items():
+        safe_domain_lower = safe_domain.lower()
+        normalized_safe_domains[safe_domain_lower] = (safe_domain, description)
+        if safe_domain_lower.startswith('www.'):
+            normalized_safe_domains[safe_domain_lower[4:]] = (safe_domain, description)
+        else:
+            normalized_safe_domains['www.' + safe_domain_lower] = (safe_domain, description)
+
+    # 短網址轉址過程中（含最終網址）經過非白名單網站時，不能因為訊息裡有白名單網址就判定安全
+    unlisted_hops = [
+        hop for hop in redirect_hops
+        if urlparse(hop).netloc.lower() not in normalized_safe_domains and not is_short_url_host(urlparse(hop).netloc)
+    ]
+    if unlisted_hops:
+        logger.warning(f"短網址轉址經過非白名單網站: {unlisted_hops}")
+        cleaned_urls = []
+
+    for url in cleaned_urls:
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        try:
+            domain = urlparse(url).netloc.lower()
+        except ValueError:
+            # URL解析失敗，繼續檢查下一個
+            continue
+        result = _safe_domain_result(domain, safe_domains, normalized_safe_domains, display_name, url_info)
+        if result:
+            check['result'] = result
+            return check
+
+    # 白名單網址在前面已直接回覆，這裡剩下的網址都不在白名單中
+    check['unlisted_urls'] = len(cleaned_urls) + len(unlisted_hops)
+    return check